@@ -1,6 +1,28 @@
 # design atm
 # entities - atm, user, account, display, cash dispenser, card, bank service
 # functionalities - show balance, withdraw, deposit cash
+# every executed transaction is appended to the bank's columnar TransactionLedger
+# each account has its own lock, transfers lock both accounts in account number order so they cannot deadlock
+# transactions are slotted objects with increasing int ids taken from the same clock read as their timestamp
+# CashDispenser holds notes per denomination, NoteMixPlanner checks an amount can be paid before the account is debited
+# RemoteBankService talks to a bank host over pooled, pipelined connections and batches concurrent lookups
+# RemoteBankAdapter puts it behind the BankService interface so ATM and ReplayEngine can run against a bank host
+# ReplayEngine streams transaction records (csv file or any iterator) through the bank without the keypad
+from array import array
+from collections import namedtuple
+import asyncio
+import bisect
+import csv
+import functools
+import itertools
+import json
+import math
+import os
+import random
+import sys
+import threading
+import tempfile
+import time
 import uuid
 from datetime import datetime
 
@@ -20,39 +42,80 @@ class Account:
     def __init__(self, account_number, balance):
         self.account_number = account_number
         self.balance = balance
-        self.transaction_history = []
+        self.transaction_history = []  # ledger row ids, oldest first, filled by TransactionLedger
+        self.lock = threading.Lock()
 
     def get_balance(self):
-        return self.balance
+        with self.lock:
+            return self.balance
 
     def deposit(self, amount):
-        self.balance += amount
+        with self.lock:
+            self._deposit(amount)
 
     def withdraw(self, amount):
+        with self.lock:
+            return self._withdraw(amount)
+
+    def _deposit(self, amount):
+        self.balance += amount
+
+    def _withdraw(self, amount):
         if amount >= self.balance:
             return False
         self.balance -= amount
         return True
 
     def transfer(self, to_account, amount):
-        if self.withdraw(amount):
-            to_account.deposit(amount)
-            return True
-        return False
+        if to_account is self:
+            with self.lock:
+                return amount < self.balance
+        # same global order for every transfer, so two opposite transfers never wait on each other
+        first, second = sorted((self, to_account), key=lambda account: account.account_number)
+        with first.lock, second.lock:
+            if self._withdraw(amount):
+                to_account._deposit(amount)
+                return True
+            return False
+
+
+_last_tx_id = 0
+_tx_id_lock = threading.Lock()
+
+
+def next_transaction_id():
+    # one clock read gives both the id and the timestamp, ids are nanoseconds since epoch bumped to stay unique
+    global _last_tx_id
+    now = time.time_ns()
+    with _tx_id_lock:
+        _last_tx_id = now if now > _last_tx_id else _last_tx_id + 1
+        return _last_tx_id, now
 
 
 class Transaction:
+    __slots__ = ("id", "amount", "timestamp_ns", "status")
+
     def __init__(self, amount):
-        self.id = str(uuid.uuid4())
+        self.id, self.timestamp_ns = next_transaction_id()
         self.amount = amount
-        self.date = datetime.now()
         self.status = "Pending"
 
+    @property
+    def date(self):
+        # built on demand, most transactions are never looked at as a datetime
+        return datetime.fromtimestamp(self.timestamp_ns / 1e9)
+
+    @date.setter
+    def date(self, value):
+        self.timestamp_ns = int(value.timestamp() * 1e9)
+
     def execute(self):
         pass
 
 
 class BalanceInquiry(Transaction):
+    __slots__ = ("account",)
+
     def __init__(self, account):
         super().__init__(0)
         self.account = account
@@ -63,6 +126,8 @@ class BalanceInquiry(Transaction):
 
 
 class CashWithdrawal(Transaction):
+    __slots__ = ("account",)
+
     def __init__(self, amount, account):
         super().__init__(amount)
         self.account = account
@@ -76,6 +141,8 @@ class CashWithdrawal(Transaction):
 
 
 class CashDeposit(Transaction):
+    __slots__ = ("account",)
+
     def __init__(self, amount, account):
         super().__init__(amount)
         self.account = account
@@ -87,22 +154,124 @@ class CashDeposit(Transaction):
 
 
 class FundTransfer(Transaction):
+    __slots__ = ("from_account", "to_account")
+
     def __init__(self, from_account, to_account, amount):
         super().__init__(amount)
         self.from_account = from_account
         self.to_account = to_account
 
     def execute(self):
-        if self.from_account.transer(self.to_account, self.amount):
+        if self.from_account.transfer(self.to_account, self.amount):
             self.status = "Success"
             return True
         self.status = "Failed"
         return False
 
 
+LedgerEntry = namedtuple("LedgerEntry", "row tx_id timestamp type account counterparty amount status")
+
+
+# append-only, one typed array per column, rows are never changed after they are written
+# rows_by_account keeps each account's row ids in time order, so "last n" is a slice and a date range is a bisect
+class TransactionLedger:
+    TYPES = ["BalanceInquiry", "CashWithdrawal", "CashDeposit", "FundTransfer"]
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.tx_ids = array("q")  # next_transaction_id values, increasing
+        self.timestamps = array("d")  # epoch seconds, never decreasing
+        self.types = array("b")
+        self.accounts = array("l")  # index into account_numbers
+        self.counterparties = array("l")  # -1 when there is none
+        self.amounts = array("d")
+        self.statuses = array("b")  # 1 success, 0 failed
+        self.account_numbers = []
+        self.account_ids = {}  # account_number: index
+        self.rows_by_account = []  # index: array of row ids
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def _account_id(self, account):
+        account_id = self.account_ids.get(account.account_number)
+        if account_id is None:
+            account_id = self.account_ids[account.account_number] = len(self.account_numbers)
+            self.account_numbers.append(account.account_number)
+            self.rows_by_account.append(array("l"))
+            # the account shows the history of the first ledger that records it, other ledgers keep their own rows
+            if not isinstance(account.transaction_history, array):
+                account.transaction_history = self.rows_by_account[account_id]
+        return account_id
+
+    def record(self, tx):
+        account = getattr(tx, "account", None) or tx.from_account
+        counterparty = getattr(tx, "to_account", None)
+        with self.lock:
+            row = len(self.timestamps)
+            account_id = self._account_id(account)
+            counterparty_id = self._account_id(counterparty) if counterparty else -1
+            timestamp = tx.timestamp_ns / 1e9
+            if self.timestamps and timestamp < self.timestamps[-1]:
+                timestamp = self.timestamps[-1]
+            self.tx_ids.append(tx.id)
+            self.timestamps.append(timestamp)
+            self.types.append(self.TYPES.index(type(tx).__name__))
+            self.accounts.append(account_id)
+            self.counterparties.append(counterparty_id)
+            self.amounts.append(tx.amount)
+            self.statuses.append(1 if tx.status == "Success" else 0)
+            self.rows_by_account[account_id].append(row)
+            if counterparty_id >= 0:
+                self.rows_by_account[counterparty_id].append(row)
+        return row
+
+    def entry(self, row):
+        counterparty = self.counterparties[row]
+        return LedgerEntry(row, self.tx_ids[row],
+                           datetime.fromtimestamp(self.timestamps[row]), self.TYPES[self.types[row]],
+                           self.account_numbers[self.accounts[row]],
+                           self.account_numbers[counterparty] if counterparty >= 0 else None,
+                           self.amounts[row], "Success" if self.statuses[row] else "Failed")
+
+    def _rows(self, account_number):
+        account_id = self.account_ids.get(account_number)
+        return self.rows_by_account[account_id] if account_id is not None else array("l")
+
+    def last_transactions(self, account_number, n=10):
+        rows = self._rows(account_number)
+        return [self.entry(row) for row in reversed(rows[-n:])] if n > 0 else []
+
+    def _row_range(self, start: datetime, end: datetime, account_number=None):
+        # rows with start <= timestamp < end
+        low, high = start.timestamp(), end.timestamp()
+        if account_number is None:
+            return range(bisect.bisect_left(self.timestamps, low), bisect.bisect_left(self.timestamps, high))
+        rows = self._rows(account_number)
+        key = self.timestamps.__getitem__
+        return rows[bisect.bisect_left(rows, low, key=key):bisect.bisect_left(rows, high, key=key)]
+
+    def transactions_between(self, start: datetime, end: datetime, account_number=None):
+        return [self.entry(row) for row in self._row_range(start, end, account_number)]
+
+    def export_statement(self, account_number, start: datetime, end: datetime):
+        # generator of csv lines, rows are read one at a time so any range can be streamed
+        yield "tx_id,date,type,counterparty,debit,credit,status\n"
+        for row in self._row_range(start, end, account_number):
+            entry = self.entry(row)
+            incoming = entry.type == "CashDeposit" or (entry.type == "FundTransfer" and entry.counterparty == account_number)
+            counterparty = entry.account if entry.counterparty == account_number else entry.counterparty
+            debit, credit = ("", entry.amount) if incoming else (entry.amount, "")
+            if entry.type == "BalanceInquiry":
+                debit = ""
+            yield (f"{entry.tx_id},{entry.timestamp.isoformat()},{entry.type},{counterparty or ''},"
+                   f"{debit},{credit},{entry.status}\n")
+
+
 class BankService:
     def __init__(self):
         self.cards = {} # card_number: card
+        self.ledger = TransactionLedger()
 
     def register_card(self, card):
         self.cards[card.card_number] = card
@@ -117,19 +286,602 @@ class BankService:
         return self.cards[card_number].account
 
 
+# stand-in for the bank host, newline delimited json over tcp
+# a message is {"id", "calls": [[op, *args], ...]} and the reply is {"id", "results": [...]} in the same order
+# latency is the network round trip, service_time / call_time is host work, limited to `workers` messages at once
+class BankServer:
+    OPS = ("validate_card", "validate_pin", "get_balance", "withdraw", "deposit", "transfer")
+
+    def __init__(self, bank_service, latency=0.002, service_time=0.001, call_time=0.00002, workers=4):
+        self.bank_service = bank_service
+        self.latency = latency
+        self.service_time = service_time
+        self.call_time = call_time
+        self.workers = workers
+        self.server = None
+        self.connections = set()  # handler tasks
+        self.messages = 0
+
+    async def start(self, host="127.0.0.1", port=0):
+        self.worker_slots = asyncio.Semaphore(self.workers)
+        self.server = await asyncio.start_server(self._handle, host, port)
+        return self.server.sockets[0].getsockname()[:2]
+
+    async def stop(self):
+        # handlers end once their client hangs up
+        self.server.close()
+        await asyncio.gather(*self.connections)
+        await self.server.wait_closed()
+
+    def _execute(self, op, *args):
+        bank = self.bank_service
+        if op not in self.OPS:
+            raise Exception(f"Unknown operation {op}")
+        if not bank.validate_card(args[0]):
+            return None if op == "get_balance" else False
+        if op == "validate_pin":
+            return bank.validate_pin(*args)
+        if op == "get_balance":
+            return bank.get_account(args[0]).get_balance()
+        if op == "withdraw":
+            return bank.get_account(args[0]).withdraw(args[1])
+        if op == "deposit":
+            bank.get_account(args[0]).deposit(args[1])
+        if op == "transfer":
+            if not bank.validate_card(args[1]):
+                return False
+            return bank.get_account(args[0]).transfer(bank.get_account(args[1]), args[2])
+        return True
+
+    async def _handle(self, reader, writer):
+        # requests on one connection are served concurrently and answered as they finish (pipelining)
+        self.connections.add(asyncio.current_task())
+        tasks = set()
+        while line := await reader.readline():
+            task = asyncio.create_task(self._serve(json.loads(line), writer))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        await asyncio.gather(*tasks)
+        writer.close()
+        self.connections.discard(asyncio.current_task())
+
+    async def _serve(self, message, writer):
+        self.messages += 1
+        await asyncio.sleep(self.latency / 2)
+        async with self.worker_slots:
+            await asyncio.sleep(self.service_time + self.call_time * len(message["calls"]))
+            try:
+                reply = {"id": message["id"], "results": [self._execute(*call) for call in message["calls"]]}
+            except Exception as e:
+                reply = {"id": message["id"], "error": str(e)}
+        await asyncio.sleep(self.latency / 2)
+        if not writer.is_closing():
+            writer.write(json.dumps(reply).encode() + b"\n")
+
+
+# one round trip per call on a fresh connection, what each ATM would do on its own
+class NaiveBankClient:
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+
+    async def _call(self, op, *args):
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        try:
+            writer.write(json.dumps({"id": 0, "calls": [[op, *args]]}).encode() + b"\n")
+            reply = json.loads(await reader.readline())
+        finally:
+            writer.close()
+            await writer.wait_closed()
+        if "error" in reply:
+            raise Exception(reply["error"])
+        return reply["results"][0]
+
+    async def validate_card(self, card_number):
+        return await self._call("validate_card", card_number)
+
+    async def validate_pin(self, card_number, pin):
+        return await self._call("validate_pin", card_number, pin)
+
+    async def get_balance(self, card_number):
+        return await self._call("get_balance", card_number)
+
+    async def close(self):
+        pass
+
+
+class _BankConnection:
+    def __init__(self, reader, writer, on_close):
+        self.reader = reader
+        self.writer = writer
+        self.waiters = {}  # message id: future
+        self.closed = False
+        self.on_close = on_close
+        self.read_task = asyncio.create_task(self._read_replies())
+
+    async def _read_replies(self):
+        try:
+            while line := await self.reader.readline():
+                reply = json.loads(line)
+                waiter = self.waiters.pop(reply["id"], None)
+                if waiter and not waiter.done():
+                    waiter.set_result(reply)
+        except (OSError, ValueError):
+            pass  # reset or garbled stream, handled like a hang up
+        finally:
+            self.closed = True
+            for waiter in self.waiters.values():
+                if not waiter.done():
+                    waiter.set_exception(Exception("Bank connection closed"))
+            self.waiters.clear()
+            self.on_close(self)
+
+
+# async BankService backend for a remote bank host
+# - a fixed pool of connections, every message carries an id so many can be in flight on one connection
+# - identical lookups already in flight share one future instead of going out again, account changes never do,
+#   and a balance read waits for changes to that account already sent so it never returns an older balance
+# - calls made in the same loop tick (or within batch_window) go out together as one message, up to max_batch
+# - a message not answered within timeout fails its calls, its connection is dropped and replaced in the background
+class RemoteBankService:
+    def __init__(self, host, port, pool_size=4, max_batch=64, batch_window=0.0, timeout=5.0, reconnect_delay=0.1):
+        self.host = host
+        self.port = port
+        self.pool_size = pool_size
+        self.max_batch = max_batch
+        self.batch_window = batch_window
+        self.timeout = timeout
+        self.reconnect_delay = reconnect_delay
+        self.connections = []
+        self.reconnects = set()  # tasks replacing dropped connections
+        self.closing = False
+        self.message_ids = itertools.count()
+        self.next_connection = 0
+        self.in_flight = {}  # (op, *args): future
+        self.writes = {}  # card_number: futures of account changes sent and not answered yet
+        self.batch = []  # [(key, future)]
+        self.flush_handle = None
+        self.coalesced = 0
+        self.messages = 0
+        self.evicted = 0
+
+    async def _open(self):
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(self.host, self.port), self.timeout)
+        self.connections.append(_BankConnection(reader, writer, self._evict))
+
+    async def connect(self):
+        for _ in range(self.pool_size):
+            await self._open()
+        return self
+
+    async def _reconnect(self):
+        while not self.closing:
+            try:
+                await self._open()
+                return
+            except (OSError, asyncio.TimeoutError):
+                await asyncio.sleep(self.reconnect_delay)
+
+    def _evict(self, connection):
+        if connection not in self.connections:
+            return
+        self.connections.remove(connection)
+        self.evicted += 1
+        connection.writer.close()
+        if not self.closing:
+            task = asyncio.get_running_loop().create_task(self._reconnect())
+            self.reconnects.add(task)
+            task.add_done_callback(self.reconnects.discard)
+
+    def _connection(self):
+        while self.connections:
+            connection = self.connections[self.next_connection % len(self.connections)]
+            self.next_connection += 1
+            if not connection.closed and not connection.writer.is_closing():
+                return connection
+            self._evict(connection)
+        return None
+
+    async def close(self):
+        self._flush()
+        self.closing = True
+        for task in list(self.reconnects):
+            task.cancel()
+        # let every reply already in flight arrive before hanging up
+        await asyncio.gather(*(waiter for connection in self.connections for waiter in list(connection.waiters.values())),
+                             return_exceptions=True)
+        for connection in self.connections:
+            connection.writer.close()
+        await asyncio.gather(*(connection.read_task for connection in self.connections), *self.reconnects,
+                             return_exceptions=True)
+        self.connections = []
+
+    async def __aenter__(self):
+        return await self.connect()
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    def _call(self, key, writes=()):
+        # writes: card numbers whose balance the call changes
+        if not writes:
+            future = self.in_flight.get(key)
+            if future is not None:
+                self.coalesced += 1
+                return asyncio.shield(future)
+        future = asyncio.get_running_loop().create_future()
+        if writes:
+            for card_number in writes:
+                # a balance read already waiting to go out must not be shared with readers after this change
+                self.in_flight.pop(("get_balance", card_number), None)
+                self.writes.setdefault(card_number, set()).add(future)
+            future.add_done_callback(functools.partial(self._write_done, writes))
+        else:
+            self.in_flight[key] = future
+        self.batch.append((key, future))
+        if len(self.batch) >= self.max_batch:
+            self._flush()
+        elif self.flush_handle is None:
+            loop = asyncio.get_running_loop()
+            self.flush_handle = (loop.call_later(self.batch_window, self._flush) if self.batch_window
+                                 else loop.call_soon(self._flush))
+        return asyncio.shield(future)
+
+    def _write_done(self, writes, future):
+        for card_number in writes:
+            pending = self.writes.get(card_number)
+            if pending is not None:
+                pending.discard(future)
+                if not pending:
+                    del self.writes[card_number]
+
+    def _flush(self):
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        if not self.batch:
+            return
+        batch, self.batch = self.batch, []
+        loop = asyncio.get_running_loop()
+        reply = loop.create_future()
+        reply.add_done_callback(lambda reply: self._resolve(batch, reply))
+        connection = self._connection()
+        if connection is None:
+            reply.set_exception(Exception("No connection to the bank host"))
+            return
+        message_id = next(self.message_ids)
+        connection.waiters[message_id] = reply
+        connection.writer.write(json.dumps({"id": message_id, "calls": [key for key, _ in batch]}).encode() + b"\n")
+        self.messages += 1
+        timer = loop.call_later(self.timeout, self._expire, connection, message_id)
+        reply.add_done_callback(lambda reply: timer.cancel())
+
+    def _expire(self, connection, message_id):
+        waiter = connection.waiters.pop(message_id, None)
+        if waiter is not None and not waiter.done():
+            waiter.set_exception(Exception(f"Bank host did not answer within {self.timeout}s"))
+        self._evict(connection)
+
+    def _resolve(self, batch, reply):
+        error = reply.exception() or (Exception(reply.result()["error"]) if "error" in reply.result() else None)
+        results = reply.result()["results"] if error is None else [None] * len(batch)
+        for (key, future), result in zip(batch, results):
+            if self.in_flight.get(key) is future:
+                del self.in_flight[key]
+            if future.done():
+                continue
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+
+    async def validate_card(self, card_number):
+        return await self._call(("validate_card", card_number))
+
+    async def validate_pin(self, card_number, pin):
+        return await self._call(("validate_pin", card_number, pin))
+
+    async def get_balance(self, card_number):
+        writes = self.writes.get(card_number)
+        if writes:
+            await asyncio.wait(list(writes))
+        return await self._call(("get_balance", card_number))
+
+    async def withdraw(self, card_number, amount):
+        return await self._call(("withdraw", card_number, amount), writes=(card_number,))
+
+    async def deposit(self, card_number, amount):
+        return await self._call(("deposit", card_number, amount), writes=(card_number,))
+
+    async def transfer(self, card_number, to_card_number, amount):
+        return await self._call(("transfer", card_number, to_card_number, amount), writes=(card_number, to_card_number))
+
+
+# card and account proxies handed out by RemoteBankAdapter, the bank host only knows cards so a card number is the account number
+class RemoteAccount:
+    def __init__(self, bank, card_number):
+        self.bank = bank
+        self.account_number = card_number
+        self.transaction_history = []  # ledger row ids, filled by TransactionLedger
+
+    def get_balance(self):
+        return self.bank.call(self.bank.client.get_balance(self.account_number))
+
+    def deposit(self, amount):
+        self.bank.call(self.bank.client.deposit(self.account_number, amount))
+
+    def withdraw(self, amount):
+        return self.bank.call(self.bank.client.withdraw(self.account_number, amount))
+
+    def transfer(self, to_account, amount):
+        return self.bank.call(self.bank.client.transfer(self.account_number, to_account.account_number, amount))
+
+
+class RemoteCard:
+    def __init__(self, bank, card_number):
+        self.bank = bank
+        self.card_number = card_number
+        self.account = RemoteAccount(bank, card_number)
+
+    def validate_pin(self, input_pin):
+        return self.bank.validate_pin(self.card_number, input_pin)
+
+
+# read side of BankService.cards, a card is checked with the bank host the first time it is asked for
+class _RemoteCards:
+    def __init__(self, bank):
+        self.bank = bank
+        self.cards = {}  # card_number: RemoteCard
+
+    def get(self, card_number, default=None):
+        card = self.cards.get(card_number)
+        if card is None and card_number is not None:
+            if not self.bank.call(self.bank.client.validate_card(card_number)):
+                return default
+            card = self.cards.setdefault(card_number, RemoteCard(self.bank, card_number))
+        return card
+
+    def __getitem__(self, card_number):
+        card = self.get(card_number)
+        if card is None:
+            raise KeyError(card_number)
+        return card
+
+    def __contains__(self, card_number):
+        return self.get(card_number) is not None
+
+
+# BankService interface over a RemoteBankService for the synchronous ATM and ReplayEngine
+# the async client runs on its own event loop thread, so calls from many ATM threads share its pool and batches
+# the ledger stays local, it records what this ATM (or fleet) executed
+class RemoteBankAdapter:
+    def __init__(self, host, port, **client_options):
+        self.timeout = client_options.get("timeout", 5.0) * 2 + 1
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+        self.client = self.call(RemoteBankService(host, port, **client_options).connect())
+        self.cards = _RemoteCards(self)
+        self.ledger = TransactionLedger()
+
+    def call(self, coroutine):
+        # the client fails a call after its own timeout, this one only guards against a stuck loop
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result(self.timeout)
+
+    def register_card(self, card):
+        raise Exception("Cards are registered on the bank host")
+
+    def validate_card(self, card_number):
+        return card_number in self.cards
+
+    def validate_pin(self, card_number, pin):
+        return self.call(self.client.validate_pin(card_number, pin))
+
+    def get_account(self, card_number):
+        return self.cards[card_number].account
+
+    def close(self):
+        self.call(self.client.close())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+
+# picks the fewest notes for an amount
+# unbounded_mix assumes endless notes and is memoised, it is the answer for almost every withdrawal
+# when a cassette runs short, plan falls back to a branch and bound search over the real counts
+class NoteMixPlanner:
+    MAX_DP_UNITS = 100000  # larger amounts skip the unbounded dp, its tables grow with the amount
+
+    def __init__(self, denominations=(2000, 500, 200, 100)):
+        self.denominations = tuple(sorted(denominations, reverse=True))
+        self.unit = math.gcd(*self.denominations)
+        self.unbounded_mix = functools.lru_cache(maxsize=4096)(self._unbounded_mix)
+
+    def _unbounded_mix(self, amount):
+        # coin change dp in units of the smallest step, returns counts per denomination or None
+        if amount % self.unit:
+            return None
+        units = amount // self.unit
+        steps = [d // self.unit for d in self.denominations]
+        fewest = [0] + [math.inf] * units
+        last = [0] * (units + 1)
+        for value in range(1, units + 1):
+            for i, step in enumerate(steps):
+                if step <= value and fewest[value - step] + 1 < fewest[value]:
+                    fewest[value] = fewest[value - step] + 1
+                    last[value] = i
+        if fewest[units] == math.inf:
+            return None
+        mix = [0] * len(steps)
+        while units:
+            mix[last[units]] += 1
+            units -= steps[last[units]]
+        return tuple(mix)
+
+    def plan(self, amount, counts):
+        # counts lines up with self.denominations, returns the mix with the fewest notes or None
+        if amount <= 0 or amount != int(amount):
+            return None
+        amount = int(amount)
+        if amount % self.unit or amount > sum(d * c for d, c in zip(self.denominations, counts)):
+            return None
+        if amount // self.unit > self.MAX_DP_UNITS:
+            return self._bounded_mix(amount, counts)
+        mix = self.unbounded_mix(amount)
+        if mix is None:
+            return None
+        if all(used <= available for used, available in zip(mix, counts)):
+            return mix
+        return self._bounded_mix(amount, counts)
+
+    def _bounded_mix(self, amount, counts):
+        denominations = self.denominations
+        # value_left[i] = cash held in denominations i.. , anything above it cannot be paid from there
+        value_left = [0] * (len(denominations) + 1)
+        for i in range(len(denominations) - 1, -1, -1):
+            value_left[i] = value_left[i + 1] + denominations[i] * counts[i]
+        best = [None, math.inf]
+        mix = [0] * len(denominations)
+
+        def search(i, remaining, notes):
+            if remaining == 0:
+                if notes < best[1]:
+                    best[0], best[1] = tuple(mix), notes
+                return
+            if i == len(denominations) or remaining > value_left[i]:
+                return
+            if notes + -(-remaining // denominations[i]) >= best[1]:
+                return  # even all big notes cannot beat the best mix
+            for used in range(min(counts[i], remaining // denominations[i]), -1, -1):
+                mix[i] = used
+                search(i + 1, remaining - used * denominations[i], notes + used)
+            mix[i] = 0
+
+        search(0, amount, 0)
+        return best[0]
+
+
 # components
+# one cassette per denomination, a withdrawal is only accepted when the notes in the cassettes can make it up
 class CashDispenser:
-    def __init__(self, available_cash=100000):
-        self.available_cash = available_cash
+    CASSETTE_CAPACITY = 2500  # notes
+    planners = {}  # denominations: NoteMixPlanner, shared by every dispenser with the same notes
 
-    def dispense(self, amount):
-        if self.available_cash >= amount:
-            self.available_cash -= amount
-            return True
-        return False
+    def __init__(self, available_cash=100000, cassettes=None):
+        # cassettes is {denomination: notes}, otherwise available_cash is split evenly by value over INR notes
+        if cassettes is None:
+            denominations = (2000, 500, 200, 100)
+            cassettes = {d: int(available_cash / len(denominations) // d) for d in denominations}
+            cassettes[100] += int(available_cash - sum(d * n for d, n in cassettes.items())) // 100
+        self.planner = self.planners.get(tuple(sorted(cassettes, reverse=True)))
+        if self.planner is None:
+            self.planner = self.planners[tuple(sorted(cassettes, reverse=True))] = NoteMixPlanner(cassettes)
+        self.counts = [cassettes[d] for d in self.planner.denominations]
+        self.lock = threading.Lock()
+        self.history = {}  # day number: notes dispensed per denomination
+
+    @property
+    def denominations(self):
+        return self.planner.denominations
+
+    @property
+    def available_cash(self):
+        return sum(d * n for d, n in zip(self.planner.denominations, self.counts))
+
+    def cassettes(self):
+        return dict(zip(self.planner.denominations, self.counts))
+
+    def can_dispense(self, amount):
+        return self.planner.plan(amount, self.counts) is not None
+
+    def dispense(self, amount, day=None):
+        with self.lock:
+            mix = self.planner.plan(amount, self.counts)
+            if mix is None:
+                return False
+            for i, used in enumerate(mix):
+                self.counts[i] -= used
+            day = int(time.time() // 86400) if day is None else day
+            dispensed = self.history.get(day)
+            if dispensed is None:
+                dispensed = self.history[day] = [0] * len(self.counts)
+            for i, used in enumerate(mix):
+                dispensed[i] += used
+            return mix
+
+    def load(self, denomination, notes):
+        with self.lock:
+            self.counts[self.planner.denominations.index(denomination)] += notes
 
     def refill(self, amount):
-        self.available_cash += amount
+        # cash with no note breakdown goes in largest notes first, returns what the smallest note cannot make up
+        with self.lock:
+            for i, denomination in enumerate(self.planner.denominations):
+                notes, amount = divmod(amount, denomination)
+                self.counts[i] += int(notes)
+        return amount
+
+
+RefillForecast = namedtuple("RefillForecast", "atm_id denomination notes daily_demand days_left")
+
+
+# fleet view over CashDispenser.history, daily demand per cassette is an exponentially weighted average
+# so a cassette that empties fast after payday shows up before one that drains slowly
+class RefillForecaster:
+    def __init__(self, dispensers, smoothing=0.3):
+        self.dispensers = dispensers  # atm_id: CashDispenser
+        self.smoothing = smoothing
+
+    def daily_demand(self, dispenser, today):
+        # days with no withdrawals count as zero demand
+        if not dispenser.history:
+            return [0.0] * len(dispenser.counts)
+        first = min(dispenser.history)
+        zeros = [0] * len(dispenser.counts)
+        demand = list(map(float, dispenser.history[first]))
+        for day in range(first + 1, today + 1):
+            dispensed = dispenser.history.get(day, zeros)
+            demand = [self.smoothing * d + (1 - self.smoothing) * avg for d, avg in zip(dispensed, demand)]
+        return demand
+
+    def forecast(self, today):
+        # every cassette in the fleet, the one that runs out first comes first
+        forecasts = []
+        for atm_id, dispenser in self.dispensers.items():
+            for denomination, notes, demand in zip(dispenser.denominations, dispenser.counts,
+                                                   self.daily_demand(dispenser, today)):
+                days_left = notes / demand if demand else math.inf
+                forecasts.append(RefillForecast(atm_id, denomination, notes, demand, days_left))
+        forecasts.sort(key=lambda forecast: forecast.days_left)
+        return forecasts
+
+    def refill_plan(self, today, horizon_days=2):
+        # atm_id: {denomination: notes to load}, only for cassettes that run out within the horizon
+        plan = {}
+        for forecast in self.forecast(today):
+            if forecast.days_left > horizon_days:
+                break
+            notes = CashDispenser.CASSETTE_CAPACITY - forecast.notes
+            if notes > 0:
+                plan.setdefault(forecast.atm_id, {})[forecast.denomination] = notes
+        return plan
+
+
+# withdrawal as the ATM menu and ReplayEngine both run it: plan the notes, debit the account, then dispense
+# returns (CashWithdrawal, failure reason or None), the transaction is None when the notes cannot be made up
+def withdraw_cash(account, amount, cash_dispenser: CashDispenser):
+    if not cash_dispenser.can_dispense(amount):
+        return None, "cannot dispense"
+    tx = CashWithdrawal(amount, account)
+    tx.execute()
+    if tx.status != "Success":
+        return tx, "insufficient funds"
+    if not cash_dispenser.dispense(amount):
+        account.deposit(amount)  # cassette emptied since the check
+        tx.status = "Failed"
+        return tx, "cannot dispense"
+    return tx, None
 
 
 class CardReader:
@@ -184,7 +936,7 @@ class ATM:
         return True
 
     def show_menu(self):
-        self.screen.display("1. Balance\n2. Withdraw\n3. Deposit\n4. Transfer\n5. Exit")
+        self.screen.display("1. Balance\n2. Withdraw\n3. Deposit\n4. Transfer\n5. Mini statement\n6. Exit")
 
     def perform_transaction(self):
         while True:
@@ -194,13 +946,18 @@ class ATM:
             if choice == '1':
                 tx = BalanceInquiry(self.current_account)
                 balance = tx.execute()
+                self.bank_service.ledger.record(tx)
                 self.screen.display(f"Balance: ₹{balance}")
 
             elif choice == '2':
                 amount = float(self.key_pad.get_input("Withdraw amount: "))
-                tx = CashWithdrawal(amount, self.current_account)
-                tx.execute()
-                if tx.status == "Success" and self.cash_dispenser.dispense(amount):
+                tx, _ = withdraw_cash(self.current_account, amount, self.cash_dispenser)
+                if tx is None:
+                    self.screen.display(f"Cannot dispense ₹{amount}, available notes: "
+                                        f"{', '.join(str(d) for d, n in self.cash_dispenser.cassettes().items() if n)}")
+                    continue
+                self.bank_service.ledger.record(tx)
+                if tx.status == "Success":
                     self.screen.display("Withdrawal successful.")
                 else:
                     self.screen.display("Withdrawal failed.")
@@ -209,6 +966,7 @@ class ATM:
                 amount = float(self.key_pad.get_input("Deposit amount: "))
                 tx = CashDeposit(amount, self.current_account)
                 tx.execute()
+                self.bank_service.ledger.record(tx)
                 self.screen.display("Deposit successful.")
 
             elif choice == '4':
@@ -220,12 +978,17 @@ class ATM:
                 to_account = self.bank_service.get_account(to_card_number)
                 tx = FundTransfer(self.current_account, to_account, amount)
                 tx.execute()
+                self.bank_service.ledger.record(tx)
                 if tx.status == "Success":
                     self.screen.display("Transfer successful.")
                 else:
                     self.screen.display("Transfer failed.")
 
             elif choice == '5':
+                for entry in self.bank_service.ledger.last_transactions(self.current_account.account_number, 5):
+                    self.screen.display(f"{entry.timestamp:%d-%m %H:%M} {entry.type} ₹{entry.amount} {entry.status}")
+
+            elif choice == '6':
                 break
             else:
                 self.screen.display("Invalid option.")
@@ -236,20 +999,522 @@ class ATM:
         self.current_account = None
 
 
-bank = BankService()
+TransactionRecord = namedtuple("TransactionRecord", "type card amount to_card")
+ReplayResult = namedtuple("ReplayResult", "type success reason latency_ns")
+
+
+# fixed size log histogram, each bucket is ~9% wide, so percentiles stay accurate without keeping samples
+class LatencyHistogram:
+    BUCKETS_PER_DOUBLING = 8
+    NUM_BUCKETS = 320  # 1ns .. ~1000s
+
+    def __init__(self):
+        self.buckets = array("q", bytes(8 * self.NUM_BUCKETS))
+        self.count = 0
+        self.total_ns = 0
+        self.min_ns = None
+        self.max_ns = 0
+
+    def add(self, latency_ns):
+        index = int(math.log2(latency_ns) * self.BUCKETS_PER_DOUBLING) if latency_ns > 1 else 0
+        self.buckets[min(index, self.NUM_BUCKETS - 1)] += 1
+        self.count += 1
+        self.total_ns += latency_ns
+        if self.min_ns is None or latency_ns < self.min_ns:
+            self.min_ns = latency_ns
+        if latency_ns > self.max_ns:
+            self.max_ns = latency_ns
+
+    def percentile(self, p):
+        # upper edge of the bucket holding the p-th sample
+        if not self.count:
+            return 0
+        target = max(1, math.ceil(self.count * p / 100))
+        seen = 0
+        for index, bucket in enumerate(self.buckets):
+            seen += bucket
+            if seen >= target:
+                return min(2 ** ((index + 1) / self.BUCKETS_PER_DOUBLING), self.max_ns)
+        return self.max_ns
+
+    def mean(self):
+        return self.total_ns / self.count if self.count else 0
+
+    def merge(self, other):
+        for index, bucket in enumerate(other.buckets):
+            self.buckets[index] += bucket
+        self.count += other.count
+        self.total_ns += other.total_ns
+        if other.min_ns is not None and (self.min_ns is None or other.min_ns < self.min_ns):
+            self.min_ns = other.min_ns
+        self.max_ns = max(self.max_ns, other.max_ns)
+
+
+class ReplayReport:
+    def __init__(self):
+        self.latency = {}  # type: LatencyHistogram
+        self.succeeded = {}  # type: count
+        self.failed = {}  # type: count
+        self.failure_reasons = {}  # reason: count
+
+    def add(self, result):
+        histogram = self.latency.get(result.type)
+        if histogram is None:
+            histogram = self.latency[result.type] = LatencyHistogram()
+            self.succeeded[result.type] = self.failed[result.type] = 0
+        histogram.add(result.latency_ns)
+        if result.success:
+            self.succeeded[result.type] += 1
+        else:
+            self.failed[result.type] += 1
+            self.failure_reasons[result.reason] = self.failure_reasons.get(result.reason, 0) + 1
+
+    def total(self):
+        return sum(self.succeeded.values()) + sum(self.failed.values())
+
+    def summary(self):
+        lines = [f"{'type':<10} {'ok':>9} {'failed':>9} {'mean us':>9} {'p50 us':>9} {'p99 us':>9} {'max us':>9}"]
+        for tx_type, histogram in sorted(self.latency.items()):
+            lines.append(f"{tx_type:<10} {self.succeeded[tx_type]:>9} {self.failed[tx_type]:>9} "
+                         f"{histogram.mean() / 1000:>9.2f} {histogram.percentile(50) / 1000:>9.2f} "
+                         f"{histogram.percentile(99) / 1000:>9.2f} {histogram.max_ns / 1000:>9.2f}")
+        for reason, count in sorted(self.failure_reasons.items()):
+            lines.append(f"  {reason}: {count}")
+        return "\n".join(lines)
+
+
+# headless driver, every stage is a generator so only one record is alive at a time
+# record types: balance, withdraw, deposit, transfer (to_card only for transfer)
+class ReplayEngine:
+    TYPES = ("balance", "withdraw", "deposit", "transfer")
+
+    def __init__(self, bank_service, cash_dispenser=None, record_ledger=True):
+        self.bank_service = bank_service
+        self.cash_dispenser = cash_dispenser or CashDispenser()
+        self.record_ledger = record_ledger
+
+    @staticmethod
+    def read_records(source):
+        # source is a csv path or an iterable of csv lines / rows / TransactionRecords
+        if isinstance(source, (str, os.PathLike)):
+            with open(source, newline="") as f:
+                yield from ReplayEngine.read_records(f)
+            return
+        rows = iter(source)
+        first = next(rows, None)
+        if first is None:
+            return
+        if isinstance(first, str):
+            rows = csv.reader(_chain_first(first, rows))
+            first = next(rows, None)
+            if first and first[0] == "type":  # header
+                first = next(rows, None)
+            if first is None:
+                return
+        yield from _chain_first(first, rows)
+
+    @staticmethod
+    def parse_records(rows):
+        for row in rows:
+            if isinstance(row, TransactionRecord):
+                yield row
+                continue
+            try:
+                tx_type, card, amount = row[0].strip().lower(), row[1].strip(), float(row[2] or 0)
+                to_card = row[3].strip() if len(row) > 3 and row[3] else None
+            except (IndexError, ValueError):
+                yield TransactionRecord("invalid", None, 0, None)
+                continue
+            yield TransactionRecord(tx_type, card, amount, to_card)
+
+    def execute(self, record):
+        # returns (success, failure reason), same checks the ATM menu does
+        if record.type not in self.TYPES:
+            return False, "invalid record"
+        cards = self.bank_service.cards
+        card = cards.get(record.card)
+        if card is None:
+            return False, "invalid card"
+        account = card.account
+        if record.type == "withdraw":
+            tx, reason = withdraw_cash(account, record.amount, self.cash_dispenser)
+            if tx is None:
+                return False, reason
+        else:
+            if record.type == "balance":
+                tx = BalanceInquiry(account)
+            elif record.type == "deposit":
+                tx = CashDeposit(record.amount, account)
+            else:
+                to_card = cards.get(record.to_card)
+                if to_card is None:
+                    return False, "invalid recipient"
+                tx = FundTransfer(account, to_card.account, record.amount)
+            tx.execute()
+            reason = None if tx.status == "Success" else "insufficient funds"
+        if self.record_ledger:
+            self.bank_service.ledger.record(tx)
+        if reason:
+            return False, reason
+        if record.type == "deposit":
+            self.cash_dispenser.refill(record.amount)
+        return True, None
+
+    def run(self, records):
+        clock = time.perf_counter_ns
+        for record in records:
+            start = clock()
+            success, reason = self.execute(record)
+            yield ReplayResult(record.type, success, reason, clock() - start)
+
+    def replay(self, source, report=None):
+        report = report or ReplayReport()
+        for result in self.run(self.parse_records(self.read_records(source))):
+            report.add(result)
+        return report
+
+
+def _chain_first(first, rest):
+    yield first
+    yield from rest
+
+
+def generate_records(num_records, card_numbers, seed=0):
+    # synthetic day of traffic, mostly withdrawals and balance checks
+    rng = random.Random(seed)
+    types = ["balance", "withdraw", "deposit", "transfer"]
+    weights = [30, 45, 15, 10]
+    for _ in range(num_records):
+        tx_type = rng.choices(types, weights)[0]
+        to_card = rng.choice(card_numbers) if tx_type == "transfer" else None
+        yield TransactionRecord(tx_type, rng.choice(card_numbers), rng.randrange(1, 100) * 100, to_card)
+
+
+def benchmark_transactions(num_objects=500000):
+    # the old Transaction layout, kept here only to compare against
+    class DictTransaction:
+        def __init__(self, amount, account):
+            self.id = str(uuid.uuid4())
+            self.amount = amount
+            self.date = datetime.now()
+            self.status = "Pending"
+            self.account = account
+
+    account = Account("ACC0", 10 ** 6)
+    for name, make in (("uuid4 + datetime + __dict__", lambda amount: DictTransaction(amount, account)),
+                       ("slots + clock id", lambda amount: CashWithdrawal(amount, account))):
+        start = time.perf_counter()
+        for i in range(num_objects):
+            make(i)
+        elapsed = time.perf_counter() - start
+        tx = make(100)
+        size = sys.getsizeof(tx) + sum(sys.getsizeof(value) for value in (tx.id, getattr(tx, "__dict__", None))
+                                       if value is not None)
+        if isinstance(tx, DictTransaction):
+            size += sys.getsizeof(tx.date)
+        print(f"{name:<28} {num_objects / elapsed:>10.0f} objects/s  {size} bytes/object")
+    ids = [CashDeposit(1, account).id for _ in range(100000)]
+    if ids != sorted(set(ids)):
+        raise Exception("Transaction ids are not unique and increasing")
+
+
+def benchmark_ledger(num_entries=1000000, num_accounts=100000, queries=10000, seed=0):
+    rng = random.Random(seed)
+    # two ledgers recording the same accounts must not share row ids
+    accounts = [Account(f"ACC{i}", 10 ** 6) for i in range(3)]
+    ledgers = (TransactionLedger(), TransactionLedger())
+    for i in range(20):
+        tx = CashDeposit(100, accounts[i % 3])
+        tx.status = "Success"
+        ledgers[i % 2].record(tx)
+    for ledger in ledgers:
+        for account in accounts:
+            rows = ledger._rows(account.account_number)
+            if list(rows) != sorted(set(rows)) or any(ledger.accounts[row] != ledger.account_ids[account.account_number]
+                                                      for row in rows):
+                raise Exception(f"Ledger rows for {account.account_number} are mixed with another ledger's")
+        if sum(len(ledger._rows(account.account_number)) for account in accounts) != len(ledger):
+            raise Exception("Ledger rows do not add up to its entries")
+
+    ledger = TransactionLedger()
+    accounts = [Account(f"ACC{i}", 10 ** 6) for i in range(num_accounts)]
+    start_time = datetime(2024, 1, 1).timestamp()
+    start = time.perf_counter()
+    for i in range(num_entries):
+        tx = CashDeposit(rng.randrange(1, 10000), rng.choice(accounts))
+        tx.status = "Success"
+        tx.timestamp_ns = int((start_time + i) * 1e9)
+        ledger.record(tx)
+    elapsed = time.perf_counter() - start
+    columns = [ledger.tx_ids, ledger.timestamps, ledger.types, ledger.accounts, ledger.counterparties, ledger.amounts,
+               ledger.statuses]
+    memory = sum(column.itemsize * len(column) for column in columns + ledger.rows_by_account)
+    print(f"recorded {num_entries} entries in {elapsed:.1f}s, {memory / num_entries:.0f} bytes/entry")
+
+    start = time.perf_counter()
+    for _ in range(queries):
+        ledger.last_transactions(rng.choice(accounts).account_number, 10)
+    print(f"last 10 transactions: {(time.perf_counter() - start) / queries * 1e6:.1f}us per query")
+
+    start = time.perf_counter()
+    for _ in range(queries):
+        low = start_time + rng.randrange(num_entries)
+        ledger.transactions_between(datetime.fromtimestamp(low), datetime.fromtimestamp(low + 3600),
+                                    rng.choice(accounts).account_number)
+    print(f"one hour of one account: {(time.perf_counter() - start) / queries * 1e6:.1f}us per query")
+
+    start = time.perf_counter()
+    lines = sum(1 for _ in ledger.export_statement(accounts[0].account_number, datetime(2024, 1, 1), datetime(2025, 1, 1)))
+    print(f"streamed {lines} statement lines in {(time.perf_counter() - start) * 1000:.1f}ms")
+
+
+def _run_account_threads(accounts, num_threads, ops_per_thread, seed=0):
+    # random withdraw / deposit / transfer mix, returns (deposited, withdrawn) over all threads
+    totals = []
+
+    def worker(worker_id):
+        rng = random.Random(seed + worker_id)
+        deposited = withdrawn = 0
+        for _ in range(ops_per_thread):
+            account = rng.choice(accounts)
+            amount = rng.randrange(1, 500)
+            operation = rng.random()
+            if operation < 0.2:
+                account.deposit(amount)
+                deposited += amount
+            elif operation < 0.4:
+                if account.withdraw(amount):
+                    withdrawn += amount
+            else:
+                FundTransfer(account, rng.choice(accounts), amount).execute()
+        totals.append((deposited, withdrawn))
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(num_threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sum(total[0] for total in totals), sum(total[1] for total in totals)
+
+
+def stress_test_accounts(num_accounts=20, num_threads=16, ops_per_thread=20000):
+    # few accounts and many threads so transfers keep crossing, money must be conserved and never go negative
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    accounts = [Account(f"ACC{i}", 10000) for i in range(num_accounts)]
+    initial = sum(account.balance for account in accounts)
+    try:
+        deposited, withdrawn = _run_account_threads(accounts, num_threads, ops_per_thread)
+    finally:
+        sys.setswitchinterval(switch_interval)
+    final = sum(account.balance for account in accounts)
+    if final != initial + deposited - withdrawn:
+        raise Exception(f"Money not conserved: {final} != {initial} + {deposited} - {withdrawn}")
+    if any(account.balance < 0 for account in accounts):
+        raise Exception("Account overdrawn")
+    print(f"stress test passed: {num_threads} threads x {ops_per_thread} ops over {num_accounts} accounts")
+
+
+def benchmark_account_throughput(thread_counts=(1, 2, 4, 8, 16), num_accounts=10000, ops_per_thread=50000):
+    for num_threads in thread_counts:
+        accounts = [Account(f"ACC{i}", 10000) for i in range(num_accounts)]
+        start = time.perf_counter()
+        _run_account_threads(accounts, num_threads, ops_per_thread)
+        elapsed = time.perf_counter() - start
+        print(f"{num_threads} threads: {num_threads * ops_per_thread / elapsed:.0f} ops/s")
+
+
+def benchmark_note_mix(queries=100000, num_atms=1000, days=90, seed=0):
+    rng = random.Random(seed)
+    amounts = [rng.randrange(1, 100) * 100 for _ in range(queries)]
+    planner = NoteMixPlanner()
+    full = [CashDispenser.CASSETTE_CAPACITY] * 4
+    short = [3, 2, 40, 5]  # big notes nearly gone, most amounts need the bounded search
+    for name, counts in (("cached, full cassettes", full), ("bounded search, short cassettes", short)):
+        start = time.perf_counter()
+        for amount in amounts:
+            planner.plan(amount, counts)
+        print(f"plan {name}: {(time.perf_counter() - start) / queries * 1e6:.2f}us per amount")
+
+    dispensers = {f"ATM{i}": CashDispenser(cassettes={d: CashDispenser.CASSETTE_CAPACITY for d in (2000, 500, 200, 100)})
+                  for i in range(num_atms)}
+    atm_ids = list(dispensers)
+    start = time.perf_counter()
+    withdrawals = refills = 0
+    for day in range(days):
+        for _ in range(num_atms * 20):
+            dispensers[rng.choice(atm_ids)].dispense(rng.randrange(1, 100) * 100, day)
+            withdrawals += 1
+        for atm_id, notes in RefillForecaster(dispensers).refill_plan(day).items():
+            refills += 1
+            for denomination, count in notes.items():
+                dispensers[atm_id].load(denomination, count)
+    print(f"{withdrawals} withdrawals over {num_atms} atms and {days} days, {refills} forecast refills, "
+          f"{time.perf_counter() - start:.1f}s")
+    forecaster = RefillForecaster(dispensers)
+    start = time.perf_counter()
+    plan = forecaster.refill_plan(days - 1)
+    print(f"fleet forecast: {(time.perf_counter() - start) * 1000:.1f}ms, {len(plan)} atms to refill in 2 days, "
+          f"first to run out: {forecaster.forecast(days - 1)[0]}")
+
+
+async def _bank_load(client, card_numbers, num_atms, sessions_per_atm, seed):
+    # every atm runs card check, pin check and balance lookup back to back, a tenth of the traffic is 20 hot cards
+    rng = random.Random(seed)
+    histogram = LatencyHistogram()
+    clock = time.perf_counter_ns
+
+    async def atm_sessions():
+        for _ in range(sessions_per_atm):
+            card = rng.choice(card_numbers[:20]) if rng.random() < 0.1 else rng.choice(card_numbers)
+            for call in (client.validate_card(card), client.validate_pin(card, "0000"), client.get_balance(card)):
+                start = clock()
+                await call
+                histogram.add(clock() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(atm_sessions() for _ in range(num_atms)))
+    return histogram, time.perf_counter() - start
+
+
+def benchmark_remote_bank(num_atms=200, sessions_per_atm=20, num_cards=10000, latency=0.002, workers=4, seed=0):
+    card_numbers = [f"CARD{i}" for i in range(num_cards)]
+
+    async def run(name, make_client):
+        server = BankServer(_replay_bank(card_numbers), latency=latency, workers=workers)
+        host, port = await server.start()
+        client = await make_client(host, port)
+        histogram, elapsed = await _bank_load(client, card_numbers, num_atms, sessions_per_atm, seed)
+        await client.close()
+        await server.stop()
+        extra = f", {client.coalesced} coalesced" if isinstance(client, RemoteBankService) else ""
+        print(f"{name:<28} {histogram.count / elapsed:>8.0f} rps  p50 {histogram.percentile(50) / 1e6:>7.1f}ms  "
+              f"p99 {histogram.percentile(99) / 1e6:>7.1f}ms  {server.messages} messages{extra}")
+
+    async def naive(host, port):
+        return NaiveBankClient(host, port)
+
+    async def pooled(host, port):
+        return await RemoteBankService(host, port, max_batch=1).connect()
+
+    async def batched(host, port):
+        return await RemoteBankService(host, port).connect()
+
+    print(f"{num_atms} atms x {sessions_per_atm} sessions, {latency * 1000:.0f}ms round trip, {workers} host workers")
+    for name, make_client in (("connection per call", naive), ("pooled + pipelined", pooled),
+                              ("pooled + pipelined + batched", batched)):
+        asyncio.run(run(name, make_client))
+
+
+def benchmark_remote_replay(num_atms=32, records_per_atm=300, num_cards=10000, latency=0.002, workers=4):
+    # one ReplayEngine thread per atm over a shared RemoteBankAdapter, final balances must match an in-process replay
+    card_numbers = [f"CARD{i}" for i in range(num_cards)]
+    records = list(generate_records(num_atms * records_per_atm, card_numbers))
+    local = _replay_bank(card_numbers)
+    ReplayEngine(local, CashDispenser(10 ** 12), record_ledger=False).replay(records)
+    expected = sum(card.account.balance for card in local.cards.values())
+
+    for name, client_options in (("pooled + pipelined", {"max_batch": 1}), ("pooled + pipelined + batched", {})):
+        server = BankServer(_replay_bank(card_numbers), latency=latency, workers=workers)
+        server_loop = asyncio.new_event_loop()
+        server_thread = threading.Thread(target=server_loop.run_forever, daemon=True)
+        server_thread.start()
+        host, port = asyncio.run_coroutine_threadsafe(server.start(), server_loop).result()
+        bank = RemoteBankAdapter(host, port, **client_options)
+        reports = [ReplayReport() for _ in range(num_atms)]
+
+        def atm(i):
+            engine = ReplayEngine(bank, CashDispenser(10 ** 12))
+            engine.replay(records[i * records_per_atm:(i + 1) * records_per_atm], reports[i])
+
+        threads = [threading.Thread(target=atm, args=(i,)) for i in range(num_atms)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        bank.close()
+        asyncio.run_coroutine_threadsafe(server.stop(), server_loop).result()
+        server_loop.call_soon_threadsafe(server_loop.stop)
+        server_thread.join()
+        server_loop.close()
+
+        histogram = LatencyHistogram()
+        for report in reports:
+            for type_histogram in report.latency.values():
+                histogram.merge(type_histogram)
+        balance = sum(card.account.balance for card in server.bank_service.cards.values())
+        if balance != expected:
+            raise Exception(f"Remote replay left {balance} in the bank, in-process replay left {expected}")
+        print(f"remote replay, {name:<28} {histogram.count / elapsed:>6.0f} records/s  p99 "
+              f"{histogram.percentile(99) / 1e6:>6.1f}ms  {server.messages} messages, balances match")
+
+
+def _replay_bank(card_numbers):
+    bank = BankService()
+    for i, card_number in enumerate(card_numbers):
+        bank.register_card(Card(card_number, "12/30", "0000", Account(f"ACC{i}", 10 ** 6)))
+    return bank
+
+
+def benchmark_replay(num_records=1000000, num_cards=10000):
+    card_numbers = [f"CARD{i}" for i in range(num_cards)]
+    engine = ReplayEngine(_replay_bank(card_numbers), CashDispenser(10 ** 12), record_ledger=False)
+    start = time.perf_counter()
+    report = engine.replay(generate_records(num_records, card_numbers))
+    elapsed = time.perf_counter() - start
+    print(f"replayed {report.total()} records from an iterator in {elapsed:.1f}s ({report.total() / elapsed:.0f}/s)")
+    print(report.summary())
+
+    # same traffic from a csv file, streamed line by line
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "transactions.csv")
+        with open(path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(TransactionRecord._fields)
+            writer.writerows((r.type, r.card, r.amount, r.to_card or "") for r in generate_records(num_records, card_numbers))
+        engine = ReplayEngine(_replay_bank(card_numbers), CashDispenser(10 ** 12))
+        start = time.perf_counter()
+        report = engine.replay(path)
+        elapsed = time.perf_counter() - start
+        print(f"replayed {report.total()} records from csv with ledger in {elapsed:.1f}s ({report.total() / elapsed:.0f}/s)")
+
+
+if __name__ == "__main__":
+    if "--bench" in sys.argv:
+        benchmark_transactions()
+        benchmark_ledger()
+        stress_test_accounts()
+        benchmark_account_throughput()
+        benchmark_replay()
+        benchmark_note_mix()
+        benchmark_remote_bank()
+        benchmark_remote_replay()
+        sys.exit()
+    if "--replay" in sys.argv:
+        # python atm.py --replay transactions.csv, every card in the file gets an account with ₹10,00,000
+        path = sys.argv[sys.argv.index("--replay") + 1]
+        cards = set()
+        for record in ReplayEngine.parse_records(ReplayEngine.read_records(path)):
+            cards.update(card for card in (record.card, record.to_card) if card)
+        print(ReplayEngine(_replay_bank(sorted(cards))).replay(path).summary())
+        sys.exit()
+
+    bank = BankService()
 
-acc1 = Account("ACC123", 10000)
-acc2 = Account("ACC999", 5000)
+    acc1 = Account("ACC123", 10000)
+    acc2 = Account("ACC999", 5000)
 
-card1 = Card("CARD123", "12/26", "1234", acc1)
-card2 = Card("CARD999", "01/27", "4321", acc2)
+    card1 = Card("CARD123", "12/26", "1234", acc1)
+    card2 = Card("CARD999", "01/27", "4321", acc2)
 
-bank.register_card(card1)
-bank.register_card(card2)
+    bank.register_card(card1)
+    bank.register_card(card2)
 
-atm = ATM(bank)
+    atm = ATM(bank)
 
-if atm.insert_card("CARD123"):
-    if atm.authenticate():
-        atm.perform_transaction()
-    atm.eject_card()
+    if atm.insert_card("CARD123"):
+        if atm.authenticate():
+            atm.perform_transaction()
+        atm.eject_card()
@@ -1,11 +1,33 @@
 # design book-my-show style movie ticket system
 # user can search for movies, select theatres, book tickets
 # Entities - User, Movie, Theatre, Ticket, Payment
+# every show keeps a seat map per seat type, one bitmap per row (bit set = free), so adjacent seats are found with shifts
+# seats can be held for a few minutes while payment runs, holds expire lazily off a per-show heap
+# each show has its own lock, so hold / confirm / release / book are atomic without shows blocking each other
+# in flash-sale mode bookings wait in a bounded fifo per show and a committer settles a whole batch per lock
+# listing pages are served from AvailabilityCache, a per-movie json snapshot kept current by show change listeners
+# movie search: title prefix by bisect over sorted names, then word level matching where the last word may be a
+# prefix and misspelt words are corrected through a trigram index checked with a bounded edit distance
+# Catalog indexes shows by movie, theatre, city and area, each bucket sorted by show time
 
+from array import array
+from collections import OrderedDict, deque
+from concurrent.futures import Future
 from datetime import datetime
 from enum import Enum
+import bisect
+import heapq
+import itertools
+import json
+import operator
+import queue
+import random
+import re
+import sys
+import threading
+import time
 import uuid
-from typing import List, Dict, Union
+from typing import List, Dict, Union, Optional
 
 
 class SeatType(Enum):
@@ -31,51 +53,168 @@ class User:
 
 
 class Ticket:
-    def __init__(self, ticket_id: str, total_seats: int, total_price: int, show_time: datetime):
+    def __init__(self, ticket_id: str, total_seats: int, total_price: int, show_time: datetime, seats=None):
         self.__ticket_id = ticket_id
         self._total_seats = total_seats
         self.total_price = total_price
         self._show_time = show_time
         self._date_of_booking = datetime.now()
+        self.seats = seats or []  # (row, column) pairs
 
 
 class Theatre:
-    def __init__(self, theatre_id: str, name: str, address: str, low: int, middle: int, high: int):
+    def __init__(self, theatre_id: str, name: str, address: str, low: int, middle: int, high: int,
+                 city: Optional[str] = None, seats_per_row: int = 20):
         self._theatre_id = theatre_id
         self.name = name
-        self.address = address
+        self.address = address  # area, e.g. "JP Nagar"
+        self.city = city
+        self.seats_per_row = seats_per_row
         self.seats = {
             "low": low,
             "middle": middle,
             "high": high
         }
 
+    @property
+    def theatre_id(self):
+        return self._theatre_id
+
+
+# rows of one seat type, bit c of rows[r] is set while seat (r, c) is free
+# rows are tried middle first (ties go to the back), and a block is placed as close to the row centre as it fits
+class SeatMap:
+    __slots__ = ("widths", "rows", "free", "row_order")
+    MAX_SEATS_PER_ROW = 64
+    layouts = {}  # (num_seats, seats_per_row): (row widths, row order), shared by every show with that layout
+
+    def __init__(self, num_seats: int, seats_per_row: int = 20):
+        if not 0 < seats_per_row <= self.MAX_SEATS_PER_ROW:
+            raise Exception(f"Rows can hold 1 to {self.MAX_SEATS_PER_ROW} seats")
+        layout = self.layouts.get((num_seats, seats_per_row))
+        if layout is None:
+            num_rows = -(-num_seats // seats_per_row)
+            widths = [seats_per_row] * num_rows
+            if num_seats % seats_per_row:
+                widths[-1] = num_seats % seats_per_row
+            row_order = sorted(range(num_rows), key=lambda row: (abs(row - (num_rows - 1) / 2), -row))
+            layout = self.layouts[(num_seats, seats_per_row)] = (tuple(widths), tuple(row_order))
+        self.widths, self.row_order = layout
+        self.rows = array("Q", [(1 << width) - 1 for width in self.widths])
+        self.free = num_seats
+
+    def is_free(self, row: int, column: int) -> bool:
+        return 0 <= row < len(self.rows) and 0 <= column < self.widths[row] and self.rows[row] >> column & 1 == 1
+
+    @staticmethod
+    def _block_starts(bits: int, n: int) -> int:
+        # bit c of the result is set when seats c .. c+n-1 are all free, shifts double so it takes log n steps
+        covered = 1
+        while covered < n:
+            step = min(covered, n - covered)
+            bits &= bits >> step
+            covered += step
+        return bits
+
+    def find_adjacent(self, n: int):
+        # best n seats side by side, None when no row has such a gap
+        if n <= 0 or n > self.free:
+            return None
+        for row in self.row_order:
+            bits = self.rows[row]
+            if bits.bit_count() < n:
+                continue
+            starts = self._block_starts(bits, n)
+            if not starts:
+                continue
+            centre = (self.widths[row] - n) // 2
+            right = starts >> centre << centre  # starts at or after the centre
+            left = starts & ((1 << centre) - 1)
+            options = []
+            if right:
+                options.append((right & -right).bit_length() - 1)
+            if left:
+                options.append(left.bit_length() - 1)
+            start = min(options, key=lambda column: abs(column - centre))
+            return [(row, column) for column in range(start, start + n)]
+        return None
+
+    def find_best(self, n: int):
+        # n free seats that need not be together, used when no block of n is left
+        if n <= 0 or n > self.free:
+            return None
+        seats = []
+        for row in self.row_order:
+            bits = self.rows[row]
+            centre = self.widths[row] / 2
+            columns = sorted((column for column in range(self.widths[row]) if bits >> column & 1),
+                             key=lambda column: abs(column + 0.5 - centre))
+            seats += [(row, column) for column in columns[:n - len(seats)]]
+            if len(seats) == n:
+                return seats
+        return None
+
+    def book(self, seats) -> bool:
+        # all or nothing
+        if len(set(seats)) != len(seats) or not all(self.is_free(row, column) for row, column in seats):
+            return False
+        for row, column in seats:
+            self.rows[row] &= ~(1 << column)
+        self.free -= len(seats)
+        return True
+
+    def release(self, seats):
+        for row, column in seats:
+            if not 0 <= row < len(self.rows) or not 0 <= column < self.widths[row] or self.is_free(row, column):
+                raise Exception(f"Seat {row}-{column} is not booked")
+        for row, column in seats:
+            self.rows[row] |= 1 << column
+        self.free += len(seats)
+
 
 class SeatInfo:
+    __slots__ = ("seat_maps",)
+
     def __init__(self, theatre):
-        self.lower_seats = theatre.seats.get("low")
-        self.middle_seats = theatre.seats.get("middle")
-        self.higher_seats = theatre.seats.get("high")
+        seats_per_row = getattr(theatre, "seats_per_row", 20)
+        self.seat_maps = {
+            SeatType.LOWER: SeatMap(theatre.seats.get("low"), seats_per_row),
+            SeatType.MIDDLE: SeatMap(theatre.seats.get("middle"), seats_per_row),
+            SeatType.HIGH: SeatMap(theatre.seats.get("high"), seats_per_row),
+        }
+
+    @property
+    def lower_seats(self):
+        return self.seat_maps[SeatType.LOWER].free
+
+    @property
+    def middle_seats(self):
+        return self.seat_maps[SeatType.MIDDLE].free
+
+    @property
+    def higher_seats(self):
+        return self.seat_maps[SeatType.HIGH].free
 
 
 class SeatBookingEngine:
     @staticmethod
     def get_available_seats(seat_type: SeatType, seat_info: SeatInfo):
-        if seat_type == SeatType.LOWER:
-            return seat_info.lower_seats
-        elif seat_type == SeatType.MIDDLE:
-            return seat_info.middle_seats
-        else:
-            return seat_info.higher_seats
+        return seat_info.seat_maps[seat_type].free
 
     @staticmethod
-    def book_seats(seat_type: SeatType, seat_info: SeatInfo, seats_required: int):
-        if seat_type == SeatType.LOWER:
-            seat_info.lower_seats -= seats_required
-        elif seat_type == SeatType.MIDDLE:
-            seat_info.middle_seats -= seats_required
-        else:
-            seat_info.higher_seats -= seats_required
+    def book_seats(seat_type: SeatType, seat_info: SeatInfo, seats_required: int, seats=None):
+        # books the given seats, or the best block of seats_required (scattered if no block is left)
+        # returns the booked seats or None
+        seat_map = seat_info.seat_maps[seat_type]
+        if seats is None:
+            seats = seat_map.find_adjacent(seats_required) or seat_map.find_best(seats_required)
+        if seats is None or not seat_map.book(seats):
+            return None
+        return seats
+
+    @staticmethod
+    def release_seats(seat_type: SeatType, seat_info: SeatInfo, seats):
+        seat_info.seat_maps[seat_type].release(seats)
 
 
 class ShowPrice:
@@ -93,25 +232,227 @@ class ShowPrice:
             return self.higher_seat_price
 
 
+class SeatHold:
+    def __init__(self, hold_id: str, show, seat_type: SeatType, seats, expires_at: float):
+        self.hold_id = hold_id
+        self.show = show
+        self.seat_type = seat_type
+        self.seats = seats
+        self.expires_at = expires_at  # time.monotonic()
+
+
 class Show:
     def __init__(self, show_id, movie_name: str, show_time: datetime, show_price: ShowPrice, theatre: Theatre):
         self.show_id = show_id
         self.movie_name = movie_name
+        self.theatre = theatre
         self.theatre_name = theatre.name
         self.show_time = show_time
         self.show_price = show_price
         self.seat_info = SeatInfo(theatre)
         self.seat_booking_engine = SeatBookingEngine()
+        self.lock = threading.Lock()
+        self.holds = {}  # hold_id: SeatHold, held seats are taken in the seat map until confirmed or released
+        self.hold_expiry = []  # heap of (expires_at, hold_id), entries of finished holds are skipped when popped
+        self.version = 0  # bumped on every seat change
+        self.listeners = []  # called as listener(show, seat_type) under the show lock after a seat change
+
+    def _changed(self, seat_type: SeatType):
+        self.version += 1
+        for listener in self.listeners:
+            listener(self, seat_type)
 
-    def book_show(self, seat_type: SeatType, seats_required: int) -> Union[Ticket, None]:
+    def _expire_holds(self, now: float):
+        while self.hold_expiry and self.hold_expiry[0][0] <= now:
+            hold = self.holds.pop(heapq.heappop(self.hold_expiry)[1], None)
+            if hold is not None:
+                self.seat_booking_engine.release_seats(hold.seat_type, self.seat_info, hold.seats)
+                self._changed(hold.seat_type)
+
+    def _book(self, seat_type: SeatType, seats_required: int, seats):
         available_seats = self.seat_booking_engine.get_available_seats(seat_type, self.seat_info)
-        if available_seats >= seats_required:
-            per_seat_price = self.show_price.get_per_seat_price(seat_type)
-            total_price = per_seat_price * seats_required
-            ticket = Ticket(str(uuid.uuid4()), seats_required, total_price, self.show_time)
-            self.seat_booking_engine.book_seats(seat_type, self.seat_info, seats_required)
-            return ticket
-        return None
+        if available_seats < seats_required:
+            return None
+        booked = self.seat_booking_engine.book_seats(seat_type, self.seat_info, seats_required, seats)
+        if booked:
+            self._changed(seat_type)
+        return booked
+
+    def _ticket(self, seat_type: SeatType, booked) -> Ticket:
+        per_seat_price = self.show_price.get_per_seat_price(seat_type)
+        total_price = per_seat_price * len(booked)
+        return Ticket(str(uuid.uuid4()), len(booked), total_price, self.show_time, booked)
+
+    def book_show(self, seat_type: SeatType, seats_required: int, seats=None) -> Union[Ticket, None]:
+        # seats picks exact (row, column) pairs, otherwise the best adjacent block is chosen
+        with self.lock:
+            self._expire_holds(time.monotonic())
+            booked = self._book(seat_type, seats_required, seats)
+        return self._ticket(seat_type, booked) if booked else None
+
+    def hold_seats(self, seat_type: SeatType, seats_required: int, ttl: float = 600, seats=None) -> Optional[SeatHold]:
+        with self.lock:
+            now = time.monotonic()
+            self._expire_holds(now)
+            booked = self._book(seat_type, seats_required, seats)
+            if not booked:
+                return None
+            hold = SeatHold(str(uuid.uuid4()), self, seat_type, booked, now + ttl)
+            self.holds[hold.hold_id] = hold
+            heapq.heappush(self.hold_expiry, (hold.expires_at, hold.hold_id))
+        return hold
+
+    def confirm_hold(self, hold: SeatHold) -> Union[Ticket, None]:
+        # None once the hold has expired or was released, the seats may already be someone else's
+        with self.lock:
+            self._expire_holds(time.monotonic())
+            if self.holds.pop(hold.hold_id, None) is None:
+                return None
+        return self._ticket(hold.seat_type, hold.seats)
+
+    def release_hold(self, hold: SeatHold) -> bool:
+        with self.lock:
+            self._expire_holds(time.monotonic())
+            if self.holds.pop(hold.hold_id, None) is None:
+                return False
+            self.seat_booking_engine.release_seats(hold.seat_type, self.seat_info, hold.seats)
+            self._changed(hold.seat_type)
+        return True
+
+    def expire_holds(self):
+        with self.lock:
+            self._expire_holds(time.monotonic())
+
+
+class ShowBusy(Exception):
+    # a show's flash-sale queue is full, the caller should back off and retry
+    pass
+
+
+# admission control for a burst of bookings on a few shows
+# - one bounded fifo per show, submit raises once it is full so callers back off instead of piling up
+# - committer threads take a show, pop up to batch_size bookings and settle them all under one show lock,
+#   a show is only ever with one committer so first come is first served
+# - once a seat type has no free seats new bookings are refused at the door, until a released or expired hold
+#   gives seats back (a show change listener clears the mark)
+# - submit raises once the sale is closed, close lets the committers drain what was admitted and joins them
+class FlashSale:
+    SOLD_OUT = Future()
+    SOLD_OUT.set_result(None)
+
+    def __init__(self, max_queue: int = 1000, batch_size: int = 64, workers: int = 4):
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.lock = threading.Lock()
+        self.queues = {}  # show_id: deque of (user, seat_type, seats_required, seats, future)
+        self.scheduled = set()  # show_ids waiting for or held by a committer
+        self.ready = queue.Queue()  # shows with bookings to commit
+        self.sold_out = set()  # (show_id, seat_type), cleared by _on_show_changed when seats come back
+        self.watched = {}  # show_id: Show whose listeners include _on_show_changed
+        self.closed = False
+        self.rejected_busy = 0
+        self.rejected_sold_out = 0
+        self.workers = [threading.Thread(target=self._commit_loop, daemon=True) for _ in range(workers)]
+        for worker in self.workers:
+            worker.start()
+
+    def submit(self, user: User, seat_type: SeatType, show: Show, seats_required: int, seats=None) -> Future:
+        # the future resolves to the Ticket, or None when the seats are gone
+        if self.closed:
+            raise Exception("Flash sale is closed")
+        if (show.show_id, seat_type) in self.sold_out:
+            if show.holds:
+                show.expire_holds()  # holds past their ttl give seats back and clear the mark
+            if (show.show_id, seat_type) in self.sold_out:
+                self.rejected_sold_out += 1
+                return self.SOLD_OUT
+        future = Future()
+        with self.lock:
+            if self.closed:
+                raise Exception("Flash sale is closed")
+            pending = self.queues.get(show.show_id)
+            if pending is None:
+                pending = self.queues[show.show_id] = deque()
+            if len(pending) >= self.max_queue:
+                self.rejected_busy += 1
+                raise ShowBusy(f"Show {show.show_id} is busy, try again")
+            pending.append((user, seat_type, seats_required, seats, future))
+            if show.show_id not in self.scheduled:
+                self.scheduled.add(show.show_id)
+                self.ready.put(show)
+        return future
+
+    def _commit_loop(self):
+        while (show := self.ready.get()) is not None:
+            with self.lock:
+                pending = self.queues[show.show_id]
+                batch = [pending.popleft() for _ in range(min(self.batch_size, len(pending)))]
+            try:
+                self._commit(show, batch)
+            except Exception as e:
+                # a failure outside any one booking fails what is left of the batch, the committer keeps going
+                for *_, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+            finally:
+                with self.lock:
+                    if pending:
+                        self.ready.put(show)
+                    else:
+                        self.scheduled.discard(show.show_id)
+                        if self.closed and not self.scheduled:
+                            self._stop_workers()
+
+    def _stop_workers(self):
+        for _ in self.workers:
+            self.ready.put(None)
+
+    def _on_show_changed(self, show: Show, seat_type: SeatType):
+        # runs under the show lock, a release or an expired hold makes the seat type bookable again
+        if show.seat_info.seat_maps[seat_type].free:
+            self.sold_out.discard((show.show_id, seat_type))
+
+    def _commit(self, show: Show, batch):
+        booked = []
+        with show.lock:
+            show._expire_holds(time.monotonic())
+            for user, seat_type, seats_required, seats, future in batch:
+                if (show.show_id, seat_type) in self.sold_out:
+                    booked.append(None)
+                    continue
+                try:
+                    booked.append(show._book(seat_type, seats_required, seats))
+                except Exception as e:
+                    # a bad request fails on its own future, the rest of the batch still commits
+                    future.set_exception(e)
+                    booked.append(None)
+                    continue
+                if show.seat_info.seat_maps[seat_type].free == 0:
+                    self.sold_out.add((show.show_id, seat_type))
+                    if show.show_id not in self.watched:
+                        self.watched[show.show_id] = show
+                        show.listeners.append(self._on_show_changed)
+        # tickets are built after the lock is dropped
+        for (user, seat_type, seats_required, seats, future), seats_booked in zip(batch, booked):
+            if future.done():
+                continue
+            ticket = show._ticket(seat_type, seats_booked) if seats_booked else None
+            if ticket:
+                user.add_ticket(ticket)
+            future.set_result(ticket)
+
+    def close(self):
+        # bookings already admitted are still committed, the committer that empties the last queue stops the rest
+        with self.lock:
+            self.closed = True
+            if not self.scheduled:
+                self._stop_workers()
+        for worker in self.workers:
+            worker.join()
+        for show in self.watched.values():
+            with show.lock:
+                show.listeners.remove(self._on_show_changed)
+        self.watched.clear()
 
 
 class Movie:
@@ -121,37 +462,495 @@ class Movie:
         self.genre = genre
 
 
+def _words(text: str) -> List[str]:
+    return re.findall(r"[a-z0-9]+", text.lower())
+
+
+def _trigrams(word: str):
+    padded = f"${word}$"
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _edit_distance(a: str, b: str, max_distance: int) -> int:
+    # levenshtein with one bit per character of a (Myers / Hyyro bit-vector), over the bound gives max_distance + 1
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    if not a:
+        return len(b)
+    positions = {}
+    for i, char in enumerate(a):
+        positions[char] = positions.get(char, 0) | 1 << i
+    mask = (1 << len(a)) - 1
+    last = 1 << (len(a) - 1)
+    plus, minus, distance = mask, 0, len(a)  # vertical +1 / -1 deltas of the current column
+    for char in b:
+        equal = positions.get(char, 0)
+        vertical = equal | minus
+        horizontal = ((((equal & plus) + plus) & mask) ^ plus) | equal
+        horizontal_plus = (minus | ~(horizontal | plus)) & mask
+        horizontal_minus = plus & horizontal
+        if horizontal_plus & last:
+            distance += 1
+        elif horizontal_minus & last:
+            distance -= 1
+        horizontal_plus = (horizontal_plus << 1 | 1) & mask
+        horizontal_minus = (horizontal_minus << 1) & mask
+        plus = (horizontal_minus | ~(vertical | horizontal_plus)) & mask
+        minus = horizontal_plus & vertical
+    return min(distance, max_distance + 1)
+
+
+# search over movie names and genres, kept up to date by Catalog.add_movies
+# sorted lists take new entries in pending and merge on the next query, under the lock and copy on write like ShowBucket
+class MovieSearchIndex:
+    MAX_CANDIDATES = 500  # movies scored per query, short prefixes match far more than anyone reads
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.movies = []  # id: Movie, None once replaced
+        self.ids = {}  # movie name: id
+        self.names = []  # sorted (normalized name, id)
+        self.vocabulary = []  # sorted distinct words
+        self.pending_names = []
+        self.pending_words = []
+        self.postings = {}  # word: ids of movies with it in the name
+        self.genre_postings = {}  # word: ids of movies with it in the genre
+        self.word_trigrams = {}  # (trigram, word length): words
+        self.movie_words = []  # id: (name words, genre words)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def add(self, movie: Movie):
+        with self.lock:
+            self._add(movie)
+
+    def _add(self, movie: Movie):
+        old = self.ids.get(movie.name)
+        if old is not None:
+            self.movies[old] = None
+        movie_id = self.ids[movie.name] = len(self.movies)
+        self.movies.append(movie)
+        name_words, genre_words = set(_words(movie.name)), set(_words(movie.genre))
+        self.movie_words.append((name_words, genre_words))
+        self.pending_names.append((" ".join(_words(movie.name)), movie_id))
+        for words, postings in ((name_words, self.postings), (genre_words, self.genre_postings)):
+            for word in words:
+                if word not in self.postings and word not in self.genre_postings:
+                    self.pending_words.append(word)
+                    for trigram in _trigrams(word):
+                        self.word_trigrams.setdefault((trigram, len(word)), []).append(word)
+                postings.setdefault(word, []).append(movie_id)
+
+    @staticmethod
+    def _merged(merged, pending):
+        if len(pending) < 32:
+            merged = merged[:]
+            for entry in pending:
+                bisect.insort(merged, entry)
+            return merged
+        return sorted(merged + pending)
+
+    def _merge(self):
+        # caller holds the lock
+        if self.pending_names:
+            self.names, self.pending_names = self._merged(self.names, self.pending_names), []
+        if self.pending_words:
+            self.vocabulary, self.pending_words = self._merged(self.vocabulary, self.pending_words), []
+
+    def _prefix_words(self, prefix: str, limit: int):
+        vocabulary = self.vocabulary
+        i = bisect.bisect_left(vocabulary, prefix)
+        words = []
+        while i < len(vocabulary) and len(words) < limit and vocabulary[i].startswith(prefix):
+            words.append(vocabulary[i])
+            i += 1
+        return words
+
+    def _similar_words(self, word: str) -> Dict[str, int]:
+        # word: edit distance, tries one edit before two since the tighter bound prunes far more
+        max_distance = 0 if len(word) <= 3 or word.isdigit() else 1 if len(word) <= 6 else 2
+        matches = {word: 0} if word in self.postings or word in self.genre_postings else {}
+        if not max_distance:
+            return matches
+        # a swap of two neighbours can share no trigram at all ("drak" / "dark"), those are looked up directly
+        for i in range(len(word) - 1):
+            swapped = word[:i] + word[i + 1] + word[i] + word[i + 2:]
+            if swapped not in matches and (swapped in self.postings or swapped in self.genre_postings):
+                matches[swapped] = 1
+        trigrams = _trigrams(word)
+        for distance in range(1, max_distance + 1):
+            self._words_within(word, trigrams, distance, matches)
+            if len(matches) > (word in matches):
+                break
+        return matches
+
+    def _words_within(self, word: str, trigrams, max_distance: int, matches: Dict[str, int]):
+        # one edit touches at most 3 trigrams, so a word within max_distance keeps n - 3 * max_distance of them and
+        # shares at least one of the 3 * max_distance + 1 rarest, only those posting lists are read
+        needed = len(trigrams) - 3 * max_distance
+        lengths = range(len(word) - max_distance, len(word) + max_distance + 1)
+        rarest = sorted(trigrams, key=lambda trigram: sum(len(self.word_trigrams.get((trigram, length), ()))
+                                                          for length in lengths))
+        checked = set(matches)
+        for trigram in rarest[:3 * max_distance + 1]:
+            for length in lengths:
+                for other in self.word_trigrams.get((trigram, length), ()):
+                    if other in checked:
+                        continue
+                    checked.add(other)
+                    if len(trigrams & _trigrams(other)) < needed:
+                        continue
+                    distance = _edit_distance(word, other, max_distance)
+                    if distance <= max_distance:
+                        matches[other] = distance
+
+    def search(self, text: str, k: int = 10) -> List[Movie]:
+        # titles starting with the text first, then movies matching every word, fewest corrections first
+        if self.pending_names or self.pending_words:
+            with self.lock:
+                self._merge()
+        words = _words(text)
+        if not words or k <= 0:
+            return []
+        query = " ".join(words)
+        results = []
+        seen = set()
+        names = self.names
+        i = bisect.bisect_left(names, (query,))
+        while i < len(names) and len(results) < k and names[i][0].startswith(query):
+            movie_id = names[i][1]
+            if self.movies[movie_id] is not None:
+                results.append(movie_id)
+                seen.add(movie_id)
+            i += 1
+        if len(results) == k:
+            return [self.movies[movie_id] for movie_id in results]
+
+        # per query word, the words it may stand for and what each costs, the last word can be unfinished
+        # typo corrections are only looked up when the words as typed do not fill k
+        exact = [{word: 0} if word in self.postings or word in self.genre_postings else {} for word in words]
+        for word in self._prefix_words(words[-1], 50):
+            exact[-1].setdefault(word, 0.5)
+        if all(exact):
+            results += self._match(exact, k - len(results), seen)
+        if len(results) < k:
+            # only words that match nothing as typed get corrected
+            fuzzy = [word_options or self._similar_words(word) for word, word_options in zip(words, exact)]
+            if all(fuzzy) and fuzzy != exact:
+                results += self._match(fuzzy, k - len(results), set(results))
+        return [self.movies[movie_id] for movie_id in results]
+
+    def _match(self, options, k: int, seen):
+        # ids of the k cheapest movies having a word from every option set
+        # the rarest query word picks the candidates, the others are checked against each candidate's words
+        rarest = min(options, key=lambda word_options: sum(
+            len(self.postings.get(word, ())) + len(self.genre_postings.get(word, ())) for word in word_options))
+        candidates = set()
+        for word in sorted(rarest, key=rarest.get):
+            for postings in (self.postings, self.genre_postings):
+                candidates.update(postings.get(word, ())[:self.MAX_CANDIDATES - len(candidates)])
+            if len(candidates) >= self.MAX_CANDIDATES:
+                break
+        scored = []
+        for movie_id in candidates - seen:
+            movie = self.movies[movie_id]
+            if movie is None:
+                continue
+            name_words, genre_words = self.movie_words[movie_id]
+            cost = 0
+            for word_options in options:
+                # a genre match counts a little less than a name match
+                best = min([word_options[word] for word in name_words if word in word_options] +
+                           [word_options[word] + 0.25 for word in genre_words if word in word_options], default=None)
+                if best is None:
+                    break
+                cost += best
+            else:
+                scored.append((cost, len(movie.name), movie.name, movie_id))
+        return [movie_id for *_, movie_id in heapq.nsmallest(k, scored)]
+
+
+# shows ordered by show time, a time range is two bisects
+# new shows are parked in pending and merged on the next read, so bulk loads sort once instead of inserting one by one
+# merges build new lists under the bucket lock and swap them in as one tuple, so readers never see half a merge
+class ShowBucket:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sorted = ([], [])  # (times, shows), replaced on every change, never modified in place
+        self.pending = []
+
+    def add(self, show: Show):
+        with self.lock:
+            self.pending.append(show)
+
+    def remove(self, show: Show):
+        with self.lock:
+            self._merge()
+            times, shows = self.sorted
+            i = bisect.bisect_left(times, show.show_time)
+            while shows[i] is not show:
+                i += 1
+            self.sorted = (times[:i] + times[i + 1:], shows[:i] + shows[i + 1:])
+
+    def _merge(self):
+        # caller holds the lock
+        if not self.pending:
+            return
+        times, shows = self.sorted
+        if len(self.pending) < 32:
+            times, shows = times[:], shows[:]
+            for show in self.pending:
+                i = bisect.bisect_right(times, show.show_time)
+                times.insert(i, show.show_time)
+                shows.insert(i, show)
+        else:
+            shows = sorted(shows + self.pending, key=operator.attrgetter("show_time"))
+            times = [show.show_time for show in shows]
+        self.sorted = (times, shows)
+        self.pending = []
+
+    def between(self, start: Optional[datetime] = None, end: Optional[datetime] = None) -> List[Show]:
+        # start <= show_time < end
+        if self.pending:
+            with self.lock:
+                self._merge()
+        times, shows = self.sorted
+        low = bisect.bisect_left(times, start) if start else 0
+        high = bisect.bisect_left(times, end) if end else len(times)
+        return shows[low:high]
+
+
 class Catalog:
     _instance = None
 
     def __new__(cls):
         if cls._instance is None:
             cls._instance = super().__new__(cls)
-            cls._instance.movies = {}  # movie_name, info
-            cls.shows = {}  # show_id, show
+            cls._instance.show_listeners = []  # called as listener(show) on add_shows, listener(None) on clear
+            cls._instance.clear()
         return cls._instance
 
+    def clear(self):
+        # listeners watch the old contents and are dropped with them
+        listeners, self.show_listeners = self.show_listeners, []
+        for listener in listeners:
+            listener(None)
+        self.movies = {}  # movie_name, info
+        self.movie_index = MovieSearchIndex()
+        self.shows = {}  # show_id, show
+        # (movie_name or None, kind, key): ShowBucket, kind is "movie", "theatre", "city" or "area"
+        self.show_index = {}
+
+    @staticmethod
+    def _index_keys(show: Show):
+        theatre = show.theatre
+        keys = [(show.movie_name, "movie", None)]
+        for kind, key in (("theatre", theatre.theatre_id), ("city", theatre.city), ("area", theatre.address)):
+            if key is not None:
+                keys.append((show.movie_name, kind, key))
+                keys.append((None, kind, key))
+        return keys
+
     def add_movies(self, movie: Movie):
         self.movies[movie.name] = movie
+        self.movie_index.add(movie)
 
     def add_shows(self, show: Show):
+        old = self.shows.get(show.show_id)
+        if old is not None:
+            for key in self._index_keys(old):
+                self.show_index[key].remove(old)
         self.shows[show.show_id] = show
+        for key in self._index_keys(show):
+            bucket = self.show_index.get(key)
+            if bucket is None:
+                bucket = self.show_index[key] = ShowBucket()
+            bucket.add(show)
+        for listener in self.show_listeners:
+            if old is not None:
+                listener(old)
+            listener(show)
 
     def get_movies(self) -> Dict[str, Movie]:
         return self.movies
 
-    def search_shows(self, movie_name: str) -> List[Show]:
-        shows = []
-        for show_id, show in self.shows.items():
-            if show.movie_name == movie_name:
-                shows.append(show)
+    def search_movies(self, text: str, k: int = 10) -> List[Movie]:
+        # autocomplete and typo tolerant search over names and genres
+        return self.movie_index.search(text, k)
+
+    def search_shows(self, movie_name: Optional[str] = None, theatre_id: Optional[str] = None,
+                     city: Optional[str] = None, area: Optional[str] = None,
+                     start: Optional[datetime] = None, end: Optional[datetime] = None) -> List[Show]:
+        # shows sorted by time, the narrowest index picks the bucket and the other filters check what is left
+        for kind, key in (("theatre", theatre_id), ("area", area), ("city", city), ("movie", None)):
+            if key is not None or (kind == "movie" and movie_name is not None):
+                break
+        else:
+            raise Exception("search_shows needs a movie, theatre, city or area")
+        bucket = self.show_index.get((movie_name, kind, key))
+        if bucket is None:
+            return []
+        shows = bucket.between(start, end)
+        if kind == "theatre" and (city is not None or area is not None):
+            shows = [show for show in shows if city in (None, show.theatre.city) and area in (None, show.theatre.address)]
+        elif kind == "area" and city is not None:
+            shows = [show for show in shows if show.theatre.city == city]
         return shows
 
 
+class MovieListing:
+    def __init__(self, movie_name: str, shows: List[Show], versions):
+        self.movie_name = movie_name
+        self.shows = shows  # by show time
+        self.shows_by_id = {show.show_id: show for show in shows}
+        self.versions = versions
+        self.version = next(versions)
+        self.lock = threading.Lock()  # held while rendering, never by the show listener
+        self.rows = {}  # show_id: serialized row
+        self.dirty = set(self.shows_by_id)
+        self.response = (None, None)  # (version, page json) of the last render
+
+    def _on_show_changed(self, show: Show, seat_type: SeatType):
+        # runs under the show lock, so it only marks the row and takes a new version, both atomic
+        self.dirty.add(show.show_id)
+        self.version = next(self.versions)
+
+    def _watch(self):
+        for show in self.shows:
+            with show.lock:
+                show.listeners.append(self._on_show_changed)
+
+    def _unwatch(self):
+        for show in self.shows:
+            with show.lock:
+                if self._on_show_changed in show.listeners:
+                    show.listeners.remove(self._on_show_changed)
+
+
+# listing page json per movie, at most max_movies of them, least recently viewed goes first
+# a seat change only re-serializes that show's row, the page is re-joined on the next view
+# versions come from one counter, so a page rebuilt after eviction never reuses an old version
+# each listing listens to its own shows, so a seat change never waits on the cache lock,
+# and searching and rendering happen outside it; a listing that leaves the cache unhooks itself
+class AvailabilityCache:
+    def __init__(self, catalog: Catalog, max_movies: int = 1000):
+        self.catalog = catalog
+        self.max_movies = max_movies
+        self.lock = threading.Lock()
+        self.listings = OrderedDict()  # movie_name: MovieListing
+        self.versions = itertools.count(1)
+        self.added = 0  # bumped by _on_show_added, a listing searched across a bump is not cached
+        self.hits = 0
+        self.misses = 0
+        self.closed = False
+        catalog.show_listeners.append(self._on_show_added)
+
+    def close(self):
+        # stops every catalog and show callback, a closed cache is replaced by BookingEngine on the next listing
+        with self.lock:
+            self.closed = True
+            listings = list(self.listings.values())
+            self.listings.clear()
+        if self._on_show_added in self.catalog.show_listeners:
+            self.catalog.show_listeners.remove(self._on_show_added)
+        for listing in listings:
+            listing._unwatch()
+
+    def get_listing(self, movie_name: str, if_version: Optional[int] = None) -> Optional[str]:
+        # None when the caller's if_version is still current
+        with self.lock:
+            listing = self.listings.get(movie_name)
+            if listing is None:
+                self.misses += 1
+                added = self.added
+            else:
+                self.hits += 1
+                self.listings.move_to_end(movie_name)
+        if listing is None:
+            listing = self._load(movie_name, added)
+        if listing.version == if_version:
+            return None
+        return self._render(listing)
+
+    def _load(self, movie_name: str, added: int) -> MovieListing:
+        listing = MovieListing(movie_name, self.catalog.search_shows(movie_name), self.versions)
+        listing._watch()
+        unwatch = None
+        with self.lock:
+            cached = self.listings.get(movie_name)
+            if cached is not None:
+                listing, unwatch = cached, listing  # another view loaded it first
+            elif self.closed or self.added != added:
+                unwatch = listing  # a show was added or the cache closed during the search, served once uncached
+            else:
+                self.listings[movie_name] = listing
+                if len(self.listings) > self.max_movies:
+                    unwatch = self.listings.popitem(last=False)[1]
+        if unwatch is not None:
+            unwatch._unwatch()
+        return listing
+
+    def _render(self, listing: MovieListing) -> str:
+        with listing.lock:
+            version = listing.version
+            if listing.response[0] == version:
+                return listing.response[1]
+            # a change during the render re-marks its row and takes a newer version, so it is not lost
+            while listing.dirty:
+                show_id = listing.dirty.pop()
+                listing.rows[show_id] = self._render_row(listing.shows_by_id[show_id])
+            response = (f'{{"movie": {json.dumps(listing.movie_name)}, "version": {version}, "shows": ['
+                        + ", ".join(listing.rows[show.show_id] for show in listing.shows) + "]}")
+            listing.response = (version, response)
+        return response
+
+    @staticmethod
+    def _render_row(show: Show) -> str:
+        return json.dumps(AvailabilityCache._row(show))
+
+    @staticmethod
+    def _row(show: Show) -> dict:
+        return {
+            "show_id": show.show_id,
+            "theatre": show.theatre_name,
+            "area": show.theatre.address,
+            "city": show.theatre.city,
+            "show_time": show.show_time.isoformat(),
+            "seats": {seat_type.name: {"available": show.seat_booking_engine.get_available_seats(seat_type, show.seat_info),
+                                       "price": show.show_price.get_per_seat_price(seat_type)}
+                      for seat_type in SeatType},
+        }
+
+    def _on_show_added(self, show: Optional[Show]):
+        # a new show changes the list itself, so the movie is rebuilt on its next view
+        if show is None:
+            self.close()  # catalog cleared
+            return
+        with self.lock:
+            self.added += 1
+            listing = self.listings.pop(show.movie_name, None)
+        if listing is not None:
+            listing._unwatch()
+
+
 class BookingEngine:
     def __init__(self):
         self.theatres = []
         self.catalog = Catalog()
+        self.flash_sale = None
+        self.availability = None  # AvailabilityCache, made on the first listing request
+        self.lock = threading.Lock()
+
+    def start_flash_sale(self, max_queue: int = 1000, batch_size: int = 64, workers: int = 4) -> FlashSale:
+        if self.flash_sale is None:
+            self.flash_sale = FlashSale(max_queue, batch_size, workers)
+        return self.flash_sale
+
+    def stop_flash_sale(self):
+        if self.flash_sale is not None:
+            self.flash_sale.close()
+            self.flash_sale = None
 
     def add_theatre(self, theatre: Theatre):
         self.theatres.append(theatre)
@@ -162,26 +961,371 @@ class BookingEngine:
     def add_shows(self, show: Show):
         self.catalog.add_shows(show)
 
-    def get_shows(self, movie_name: str) -> List[Show]:
-        return self.catalog.search_shows(movie_name)
+    def get_shows(self, movie_name: str, **filters) -> List[Show]:
+        return self.catalog.search_shows(movie_name, **filters)
 
     def get_movies(self):
         return self.catalog.get_movies()
 
+    def search_movies(self, text: str, k: int = 10) -> List[Movie]:
+        return self.catalog.search_movies(text, k)
+
+    def get_show_listing(self, movie_name: str, if_version: Optional[int] = None) -> Optional[str]:
+        availability = self.availability
+        if availability is None or availability.closed:
+            with self.lock:
+                if self.availability is None or self.availability.closed:
+                    self.availability = AvailabilityCache(self.catalog)
+                availability = self.availability
+        return availability.get_listing(movie_name, if_version)
+
+    def close(self):
+        # stops the flash sale and unhooks the listing cache from the catalog, which outlives the engine
+        self.stop_flash_sale()
+        with self.lock:
+            if self.availability is not None:
+                self.availability.close()
+                self.availability = None
+
     @staticmethod
-    def book_seats(user: User, seat_type: SeatType, show: Show, seats_required: int) -> Union[Ticket, None]:
-        ticket = show.book_show(seat_type, seats_required)
+    def book_seats(user: User, seat_type: SeatType, show: Show, seats_required: int, seats=None) -> Union[Ticket, None]:
+        ticket = show.book_show(seat_type, seats_required, seats)
         if ticket:
             user.add_ticket(ticket)
             return ticket
         else:
             return None
 
+    @staticmethod
+    def hold_seats(seat_type: SeatType, show: Show, seats_required: int, ttl: float = 600,
+                   seats=None) -> Optional[SeatHold]:
+        return show.hold_seats(seat_type, seats_required, ttl, seats)
+
+    @staticmethod
+    def confirm_hold(user: User, hold: SeatHold) -> Union[Ticket, None]:
+        ticket = hold.show.confirm_hold(hold)
+        if ticket:
+            user.add_ticket(ticket)
+        return ticket
+
+    @staticmethod
+    def release_hold(hold: SeatHold) -> bool:
+        return hold.show.release_hold(hold)
+
+
+def benchmark_seat_maps(num_shows: int = 10000, queries: int = 100000, seed: int = 0):
+    rng = random.Random(seed)
+    theatre = Theatre("T0", "Screen 0", "Area 0", 200, 120, 40, seats_per_row=20)
+    seat_infos = [SeatInfo(theatre) for _ in range(num_shows)]
+    seat_info = seat_infos[0]
+    size = sys.getsizeof(seat_info) + sys.getsizeof(seat_info.seat_maps)
+    for seat_map in seat_info.seat_maps.values():
+        size += sys.getsizeof(seat_map) + sys.getsizeof(seat_map.rows)  # widths and row order are shared
+    print(f"{sum(theatre.seats.values())} seats per show: {size} bytes per show, "
+          f"{size * 100000 / 2 ** 20:.0f}MB for 100k running shows")
+
+    # fill half of every show with random groups, then time searches on what is left
+    seat_map = seat_info.seat_maps[SeatType.LOWER]
+    while seat_map.free > 100:
+        seats = seat_map.find_adjacent(rng.randrange(1, 7))
+        if seats:
+            seat_map.book(seats)
+    start = time.perf_counter()
+    for _ in range(queries):
+        seat_map.find_adjacent(rng.randrange(1, 7))
+    print(f"find 1-6 adjacent seats in a half full map: {(time.perf_counter() - start) / queries * 1e6:.2f}us")
+    seats = [seat_map.find_adjacent(1) for _ in range(queries // 100)]
+    start = time.perf_counter()
+    for _ in range(100):
+        for seat in seats:
+            seat_map.book(seat)
+            seat_map.release(seat)
+    print(f"book + release one seat: {(time.perf_counter() - start) / queries * 1e6:.2f}us")
+
+
+def stress_test_holds(num_buyers: int = 3000, seats: int = 600, ttl: float = 0.05, seed: int = 0):
+    # thousands of buyers on one show: some pay in time, some too late, some cancel, some walk away
+    theatre = Theatre("T0", "Blockbuster Screen", "Area 0", seats, 0, 0, seats_per_row=30)
+    show = Show("S0", "Blockbuster", datetime.now(), ShowPrice(200, 300, 500), theatre)
+    tickets = []
+    late_confirms = []
+    start_line = threading.Barrier(num_buyers)
+
+    def buyer(buyer_id):
+        rng = random.Random(seed + buyer_id)
+        seats_required = rng.randrange(1, 5)
+        start_line.wait()
+        if rng.random() < 0.2:
+            ticket = show.book_show(SeatType.LOWER, seats_required)
+            if ticket:
+                tickets.append(ticket)
+            return
+        hold = show.hold_seats(SeatType.LOWER, seats_required, ttl)
+        if hold is None:
+            return
+        action = rng.random()
+        if action < 0.6:
+            time.sleep(rng.uniform(0, 2 * ttl))  # payment, sometimes slower than the hold
+            ticket = show.confirm_hold(hold)
+            if ticket:
+                tickets.append(ticket)
+            else:
+                late_confirms.append(hold)
+        elif action < 0.8:
+            show.release_hold(hold)
+
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-5)
+    threads = [threading.Thread(target=buyer, args=(i,)) for i in range(num_buyers)]
+    start = time.perf_counter()
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        sys.setswitchinterval(switch_interval)
+    elapsed = time.perf_counter() - start
+    time.sleep(ttl)
+    show.expire_holds()
+
+    seat_map = show.seat_info.seat_maps[SeatType.LOWER]
+    sold = [seat for ticket in tickets for seat in ticket.seats]
+    if len(sold) != len(set(sold)):
+        raise Exception("Seat sold twice")
+    if any(seat_map.is_free(*seat) for seat in sold) or seat_map.free != seats - len(sold) or show.holds:
+        raise Exception("Seat map does not match the tickets sold")
+    print(f"stress test passed: {num_buyers} buyers on {seats} seats in {elapsed:.1f}s, {len(sold)} seats sold "
+          f"on {len(tickets)} tickets, {len(late_confirms)} confirms after expiry rejected, {seat_map.free} left")
+
+
+def _percentile(samples, p):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * p / 100))] if samples else 0
+
+
+class _DurableCommitLock:
+    # show lock whose critical section ends with a write of commit_latency seconds, like a database commit
+    def __init__(self, commit_latency: float):
+        self.lock = threading.Lock()
+        self.commit_latency = commit_latency
+
+    def __enter__(self):
+        self.lock.acquire()
+
+    def __exit__(self, *exc):
+        time.sleep(self.commit_latency)
+        self.lock.release()
+
+
+def load_test_flash_sale(num_clients: int = 200, requests_per_client: int = 50, num_shows: int = 5,
+                         seats_per_show: int = 2000, commit_latencies=(0, 0.0002), seed: int = 0):
+    # clients hammer a few shows, most of them the first one, until everything is sold
+    def run(book, commit_latency):
+        theatre = Theatre("T0", "Screen 0", "Area 0", seats_per_show, 0, 0, seats_per_row=40)
+        shows = [Show(str(i), "Blockbuster", datetime.now(), ShowPrice(200, 300, 500), theatre) for i in range(num_shows)]
+        if commit_latency:
+            for show in shows:
+                show.lock = _DurableCommitLock(commit_latency)
+        latencies = []
+        start_line = threading.Barrier(num_clients + 1)
+
+        def client(client_id):
+            rng = random.Random(seed + client_id)
+            user = User(str(client_id), "user", "user@example.com", "0")
+            samples = []
+            start_line.wait()
+            for _ in range(requests_per_client):
+                show = shows[0] if rng.random() < 0.7 else rng.choice(shows)
+                start = time.perf_counter()
+                book(user, show, rng.randrange(1, 5))
+                samples.append(time.perf_counter() - start)
+            latencies.extend(samples)
+
+        threads = [threading.Thread(target=client, args=(i,)) for i in range(num_clients)]
+        for thread in threads:
+            thread.start()
+        start_line.wait()
+        start = time.perf_counter()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        sold = sum(seats_per_show - show.seat_info.lower_seats for show in shows)
+        return len(latencies) / elapsed, _percentile(latencies, 50), _percentile(latencies, 99), sold
+
+    def per_request(user, show, seats_required):
+        return BookingEngine.book_seats(user, SeatType.LOWER, show, seats_required)
+
+    def flash(user, show, seats_required):
+        while True:
+            try:
+                return flash_sale.submit(user, SeatType.LOWER, show, seats_required).result()
+            except ShowBusy:
+                time.sleep(0.001)  # admission queue full, back off
+
+    print(f"{num_clients} clients x {requests_per_client} requests on {num_shows} shows of {seats_per_show} seats")
+    for commit_latency in commit_latencies:
+        print(f"commit latency {commit_latency * 1000:.1f}ms")
+        booking_engine = BookingEngine()
+        flash_sale = booking_engine.start_flash_sale()
+        for name, book in (("per request", per_request), ("flash sale", flash)):
+            rps, p50, p99, sold = run(book, commit_latency)
+            print(f"  {name:<12} {rps:>8.0f} rps  p50 {p50 * 1000:>6.2f}ms  p99 {p99 * 1000:>7.2f}ms  {sold} seats sold")
+        print(f"  flash sale refused {flash_sale.rejected_sold_out} at the door, {flash_sale.rejected_busy} for a full queue")
+        booking_engine.stop_flash_sale()
+
+
+def _render_listing(booking_engine: BookingEngine, movie_name: str) -> str:
+    # what a listing page costs without the cache
+    return json.dumps({"movie": movie_name, "shows": [AvailabilityCache._row(show)
+                                                      for show in booking_engine.get_shows(movie_name)]})
+
+
+def benchmark_listing_cache(num_shows: int = 100000, num_movies: int = 500, page_views: int = 5000,
+                            views_per_booking: int = 100, seed: int = 0):
+    booking_engine = build_catalog(num_shows, num_movies=num_movies, seed=seed)
+    rng = random.Random(seed)
+    user = User("1", "user", "user@example.com", "0")
+    # a few movies take most of the views
+    movies = [f"Movie {min(int(rng.paretovariate(1.2)) - 1, num_movies - 1)}" for _ in range(page_views)]
+    for name, render in (("live objects", lambda movie: _render_listing(booking_engine, movie)),
+                         ("snapshot cache", booking_engine.get_show_listing)):
+        start = time.perf_counter()
+        for i, movie in enumerate(movies):
+            render(movie)
+            if i % views_per_booking == 0:
+                show = rng.choice(booking_engine.get_shows(movie))
+                booking_engine.book_seats(user, SeatType.LOWER, show, 2)
+        elapsed = time.perf_counter() - start
+        print(f"{name:<15} {elapsed / page_views * 1e6:>8.1f}us per page view, one booking per {views_per_booking} views")
+    cache = booking_engine.availability
+    print(f"cache hit rate {cache.hits / (cache.hits + cache.misses):.1%}, {len(cache.listings)} movies cached")
+    booking_engine.catalog.clear()
+
+
+def benchmark_movie_search(num_movies: int = 300000, queries: int = 2000, k: int = 10, seed: int = 0):
+    rng = random.Random(seed)
+    # words drawn with english letter frequencies, titles are 1-4 of them plus the odd common word
+    letters, weights = "etaoinshrdlcumwfgypbvkjxqz", [13, 9, 8, 8, 7, 7, 6, 6, 6, 4, 4, 3, 3, 2, 2, 2, 2, 2, 2, 1, 1, 1, 1, 1, 1, 1]
+    vocabulary = list({"".join(rng.choices(letters, weights, k=rng.randrange(3, 11))) for _ in range(50000)})
+    common = ["the", "of", "and", "2", "returns", "rising", "chapter"]
+    genres = ["Action", "Comedy", "Drama", "Horror", "Thriller", "Romance", "Sci-Fi", "Animation", "Crime", "Fantasy"]
+    titles = set()
+    while len(titles) < num_movies:
+        titles.add(" ".join(rng.choice(common) if rng.random() < 0.15 else rng.choice(vocabulary)
+                            for _ in range(rng.randrange(1, 5))))
+    titles = sorted(titles)
+    catalog = Catalog()
+    catalog.clear()
+    start = time.perf_counter()
+    for i, title in enumerate(titles):
+        catalog.add_movies(Movie(str(i), title, rng.choice(genres)))
+    catalog.search_movies("warm up")
+    print(f"indexed {len(catalog.movie_index)} titles in {time.perf_counter() - start:.1f}s")
+
+    def typo(word):
+        i = rng.randrange(len(word))
+        return word[:i] + rng.choice("aeioukrst") + word[i + 1:] if rng.random() < 0.5 else word[:i] + word[i + 1:]
+
+    kinds = {
+        "prefix, 1-3 letters": lambda title: title[:rng.randrange(1, 4)],
+        "prefix, 4-10 letters": lambda title: title[:rng.randrange(4, 11)],
+        "words, last unfinished": lambda title: title[:len(title) * 3 // 4],
+        "one typo": lambda title: " ".join(typo(word) if len(word) > 4 and i == 0 else word
+                                           for i, word in enumerate(title.split())),
+    }
+    for name, make_query in kinds.items():
+        samples = []
+        found = 0
+        for _ in range(queries):
+            title = rng.choice(titles)
+            query = make_query(title)
+            start = time.perf_counter()
+            results = catalog.search_movies(query, k)
+            samples.append(time.perf_counter() - start)
+            found += any(movie.name.startswith(title) for movie in results)
+        print(f"{name:<24} mean {sum(samples) / queries * 1e6:>7.1f}us  p99 {_percentile(samples, 99) * 1e6:>7.1f}us  "
+              f"wanted title in top {k}: {found / queries:.0%}")
+    catalog.clear()
+
+
+def _linear_search(catalog: Catalog, movie_name, area=None, start=None, end=None):
+    # what search_shows did before the indexes
+    return [show for show in catalog.shows.values() if show.movie_name == movie_name
+            and (area is None or show.theatre.address == area)
+            and (start is None or show.show_time >= start) and (end is None or show.show_time < end)]
+
+
+def build_catalog(num_shows: int, num_movies: int = 500, num_cities: int = 20, areas_per_city: int = 10,
+                  theatres_per_area: int = 10, days: int = 14, seed: int = 0) -> BookingEngine:
+    rng = random.Random(seed)
+    booking_engine = BookingEngine()
+    booking_engine.catalog.clear()
+    theatres = []
+    for city in range(num_cities):
+        for area in range(areas_per_city):
+            for i in range(theatres_per_area):
+                theatre = Theatre(f"T{len(theatres)}", f"Screen {len(theatres)}", f"Area {city}-{area}",
+                                  100, 60, 20, city=f"City {city}")
+                theatres.append(theatre)
+                booking_engine.add_theatre(theatre)
+    movies = [Movie(str(i), f"Movie {i}", "Drama") for i in range(num_movies)]
+    for movie in movies:
+        booking_engine.add_movie(movie)
+    show_price = ShowPrice(200, 300, 500)
+    first_day = datetime(2024, 1, 1).timestamp()
+    for i in range(num_shows):
+        show_time = datetime.fromtimestamp(first_day + rng.randrange(days) * 86400 + rng.choice((10, 13, 16, 19, 22)) * 3600)
+        booking_engine.add_shows(Show(str(i), rng.choice(movies).name, show_time, show_price, rng.choice(theatres)))
+    return booking_engine
+
+
+def benchmark_search_shows(num_shows: int = 1000000, queries: int = 1000, seed: int = 0):
+    start = time.perf_counter()
+    catalog = build_catalog(num_shows, seed=seed).catalog
+    print(f"built and indexed {num_shows} shows in {time.perf_counter() - start:.1f}s")
+    start = time.perf_counter()
+    for bucket in catalog.show_index.values():
+        bucket.between()
+    print(f"first read sorted every bucket in {time.perf_counter() - start:.1f}s")
+    rng = random.Random(seed)
+    searches = [("movie only", lambda movie, area, evening: {}),
+                ("movie near area after 6pm", lambda movie, area, evening: {"area": area, "start": evening}),
+                ("movie in area on one evening", lambda movie, area, evening:
+                 {"area": area, "start": evening, "end": datetime.fromtimestamp(evening.timestamp() + 6 * 3600)})]
+    for name, filters in searches:
+        args = []
+        for _ in range(queries):
+            day = datetime(2024, 1, 1 + rng.randrange(14), 18)
+            args.append((f"Movie {rng.randrange(500)}", filters(None, f"Area {rng.randrange(20)}-{rng.randrange(10)}", day)))
+        start = time.perf_counter()
+        found = sum(len(catalog.search_shows(movie, **kwargs)) for movie, kwargs in args)
+        indexed = (time.perf_counter() - start) / queries
+        linear_queries = max(1, queries // 200)
+        start = time.perf_counter()
+        linear_found = sum(len(_linear_search(catalog, movie, **kwargs)) for movie, kwargs in args[:linear_queries])
+        linear = (time.perf_counter() - start) / linear_queries
+        if linear_found != sum(len(catalog.search_shows(movie, **kwargs)) for movie, kwargs in args[:linear_queries]):
+            raise Exception("Indexed search disagrees with linear search")
+        print(f"{name:<30} indexed {indexed * 1e6:>8.1f}us  linear {linear * 1e3:>7.1f}ms  "
+              f"{found / queries:.1f} shows per query")
+    catalog.clear()
+
 
 if __name__ == "__main__":
+    if "--bench" in sys.argv:
+        benchmark_search_shows()
+        benchmark_seat_maps()
+        stress_test_holds()
+        load_test_flash_sale()
+        benchmark_listing_cache()
+        benchmark_movie_search()
+        sys.exit()
+
     user = User(user_id="1", name="Manoj", email="b.b.manoj28@gmail.com", phone="12345678")
-    theatre1 = Theatre(theatre_id="1", name="PVR BR", address="Bannerghatta road", low=30, middle=20, high=10)
-    theatre2 = Theatre(theatre_id="2", name="PVR JP", address="JP Nagar", low=30, middle=20, high=10)
+    theatre1 = Theatre(theatre_id="1", name="PVR BR", address="Bannerghatta road", low=30, middle=20, high=10,
+                       city="Bangalore")
+    theatre2 = Theatre(theatre_id="2", name="PVR JP", address="JP Nagar", low=30, middle=20, high=10, city="Bangalore")
 
     avengers_movie = Movie(movie_id="1", name="Avengers", genre="Comic")
     kgf_movie = Movie(movie_id="2", name="KGF", genre="Thriller")
@@ -205,7 +1349,7 @@ if __name__ == "__main__":
     booking_engine.add_shows(show2)
 
     movies = booking_engine.get_movies()
-    shows = booking_engine.get_shows(kgf_movie.name)
+    shows = booking_engine.get_shows(kgf_movie.name, area="JP Nagar")
 
     ticket = booking_engine.book_seats(user=user, seat_type=SeatType.HIGH, show=shows[0], seats_required=3)
     print(ticket.total_price)
@@ -0,0 +1,270 @@
+# load test for the book-my-show booking flow
+# builds a catalog of cities, theatres, movies and shows, then replays search-then-book sessions from synthetic users
+# popular movies and early evening shows get most of the traffic, like an opening weekend
+# reports latency percentiles and throughput for search_shows, book_show and ticket creation
+# a run can be saved as a json baseline and later runs checked against it
+# baselines depend on the machine, so none is checked in: save one from the commit you start from,
+# on the machine you will compare on, then check your change against it with the same options
+#
+#   python book_my_show_load_test.py --sessions 20000 --concurrency 8 --save-baseline baseline.json
+#   python book_my_show_load_test.py --sessions 20000 --concurrency 8 --check-baseline baseline.json
+
+import argparse
+import bisect
+import itertools
+import json
+import random
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+
+from book_my_show import BookingEngine, Movie, SeatType, Show, ShowPrice, Theatre, User
+
+CITIES = {
+    "Bangalore": ["JP Nagar", "Koramangala", "Whitefield", "Indiranagar", "Jayanagar", "Hebbal", "Bannerghatta road"],
+    "Mumbai": ["Andheri", "Bandra", "Powai", "Malad", "Thane", "Dadar", "Lower Parel"],
+    "Delhi": ["Saket", "Dwarka", "Rohini", "Vasant Kunj", "Karol Bagh", "Lajpat Nagar"],
+    "Chennai": ["T Nagar", "Velachery", "Anna Nagar", "Adyar", "Porur"],
+    "Hyderabad": ["Gachibowli", "Kukatpally", "Banjara Hills", "Ameerpet", "Madhapur"],
+    "Pune": ["Kothrud", "Hinjewadi", "Viman Nagar", "Baner", "Hadapsar"],
+}
+GENRES = ["Action", "Comedy", "Drama", "Thriller", "Horror", "Romance", "Sci-Fi", "Animation", "Crime", "Fantasy"]
+TITLE_WORDS = ["Dark", "Rising", "Storm", "Last", "City", "Shadow", "Kingdom", "Return", "Fire", "Night", "Legend",
+               "Empire", "Silent", "Hunter", "Golden", "Broken", "Code", "Wild", "Iron", "Lost", "Chapter", "Road"]
+SHOW_HOURS = [9, 12, 15, 18, 21]
+SEAT_TYPES = [SeatType.LOWER, SeatType.MIDDLE, SeatType.HIGH]
+OPERATIONS = ["search_shows", "book_show", "ticket", "session"]
+
+
+class LoadTestConfig:
+    def __init__(self, theatres=2000, movies=300, shows=50000, users=10000, sessions=20000, concurrency=8,
+                 movie_skew=1.1, show_skew=1.5, days=3, seed=0):
+        self.theatres = theatres
+        self.movies = movies
+        self.shows = shows
+        self.users = users
+        self.sessions = sessions
+        self.concurrency = concurrency
+        self.movie_skew = movie_skew  # zipf exponent over movie popularity
+        self.show_skew = show_skew  # zipf exponent over the shows a search returns, earliest first
+        self.days = days
+        self.seed = seed
+
+    def to_dict(self):
+        return dict(vars(self))
+
+
+class LatencyRecorder:
+    # one per thread, merged at the end so recording never takes a lock
+    def __init__(self):
+        self.samples = {operation: [] for operation in OPERATIONS}
+        self.booked = 0
+        self.failed = 0
+
+    def merge(self, other):
+        for operation, samples in other.samples.items():
+            self.samples[operation] += samples
+        self.booked += other.booked
+        self.failed += other.failed
+
+
+def _percentile(samples, p):
+    return samples[min(len(samples) - 1, int(len(samples) * p / 100))] if samples else 0
+
+
+def _zipf_weights(n, skew):
+    return [1 / (rank + 1) ** skew for rank in range(n)]
+
+
+def _zipf_pick(rng, items, cum_weights):
+    # cum_weights covers at least len(items) ranks, only the first len(items) take part
+    return items[bisect.bisect(cum_weights, rng.random() * cum_weights[len(items) - 1], 0, len(items) - 1)]
+
+
+def build_catalog(config: LoadTestConfig):
+    # returns the engine, movies by popularity (most popular first) and the users
+    rng = random.Random(config.seed)
+    booking_engine = BookingEngine()
+    booking_engine.catalog.clear()
+    areas = [(city, area) for city, city_areas in CITIES.items() for area in city_areas]
+    theatres = []
+    for i in range(config.theatres):
+        city, area = areas[i % len(areas)]
+        theatre = Theatre(str(i), f"Screen {i} {area}", area, rng.randrange(80, 300), rng.randrange(40, 150),
+                          rng.randrange(10, 60), city=city, seats_per_row=rng.randrange(16, 31))
+        theatres.append(theatre)
+        booking_engine.add_theatre(theatre)
+
+    movies = []
+    names = set()
+    while len(movies) < config.movies:
+        name = " ".join(rng.sample(TITLE_WORDS, rng.randrange(1, 4)))
+        if rng.random() < 0.2:
+            name += f" {rng.randrange(2, 5)}"
+        if name not in names:
+            names.add(name)
+            movies.append(Movie(str(len(movies)), name, rng.choice(GENRES)))
+            booking_engine.add_movie(movies[-1])
+
+    # popular movies get more shows, the way theatres schedule a big release
+    weights = _zipf_weights(len(movies), config.movie_skew)
+    first_day = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    prices = [ShowPrice(150 + 50 * i, 250 + 50 * i, 400 + 50 * i) for i in range(5)]
+    for i in range(config.shows):
+        show_time = first_day + timedelta(days=rng.randrange(config.days), hours=rng.choice(SHOW_HOURS))
+        movie = rng.choices(movies, weights)[0]
+        booking_engine.add_shows(Show(str(i), movie.name, show_time, rng.choice(prices), rng.choice(theatres)))
+    # sort every bucket now, otherwise the first searches pay for it inside the measured window
+    for bucket in booking_engine.catalog.show_index.values():
+        bucket.between()
+
+    users = [User(str(i), f"user{i}", f"user{i}@example.com", f"9{i:09d}") for i in range(config.users)]
+    return booking_engine, movies, users
+
+
+def _run_sessions(booking_engine, movies, users, config, sessions, seed, recorder):
+    rng = random.Random(seed)
+    clock = time.perf_counter
+    movie_weights = _zipf_weights(len(movies), config.movie_skew)
+    show_weights = list(itertools.accumulate(_zipf_weights(256, config.show_skew)))
+    first_day = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    for _ in range(sessions):
+        session_start = clock()
+        user = rng.choice(users)
+        movie = rng.choices(movies, movie_weights)[0]
+        city = rng.choice(list(CITIES))
+        filters = {"city": city}
+        if rng.random() < 0.4:
+            filters = {"area": rng.choice(CITIES[city]), "city": city}
+        if rng.random() < 0.5:
+            filters["start"] = first_day + timedelta(days=rng.randrange(config.days), hours=17)
+
+        start = clock()
+        shows = booking_engine.get_shows(movie.name, **filters)
+        recorder.samples["search_shows"].append(clock() - start)
+        if not shows:
+            continue
+
+        if len(shows) > len(show_weights):
+            show_weights = list(itertools.accumulate(_zipf_weights(len(shows), config.show_skew)))
+        show = _zipf_pick(rng, shows, show_weights)
+        seat_type = rng.choices(SEAT_TYPES, [6, 3, 1])[0]
+        start = clock()
+        ticket = booking_engine.book_seats(user, seat_type, show, rng.choices(range(1, 7), [3, 8, 3, 4, 1, 1])[0])
+        recorder.samples["book_show"].append(clock() - start)
+        if ticket:
+            recorder.booked += 1
+        else:
+            recorder.failed += 1  # not enough free seats of that type
+        recorder.samples["session"].append(clock() - session_start)
+
+
+def run_load_test(config: LoadTestConfig):
+    start = time.perf_counter()
+    booking_engine, movies, users = build_catalog(config)
+    print(f"catalog: {config.theatres} theatres, {config.movies} movies, {config.shows} shows, "
+          f"{config.users} users, built in {time.perf_counter() - start:.1f}s")
+
+    recorders = [LatencyRecorder() for _ in range(config.concurrency)]
+    local = threading.local()
+    make_ticket = Show._ticket
+
+    def timed_ticket(show, seat_type, booked):
+        # ticket creation is timed inside book_show, the recorder is the calling thread's
+        start = time.perf_counter()
+        ticket = make_ticket(show, seat_type, booked)
+        local.recorder.samples["ticket"].append(time.perf_counter() - start)
+        return ticket
+
+    def worker(i):
+        local.recorder = recorders[i]
+        sessions = config.sessions // config.concurrency + (i < config.sessions % config.concurrency)
+        _run_sessions(booking_engine, movies, users, config, sessions, config.seed * 1000 + i, recorders[i])
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(config.concurrency)]
+    Show._ticket = timed_ticket
+    start = time.perf_counter()
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        Show._ticket = make_ticket
+    elapsed = time.perf_counter() - start
+
+    recorder = LatencyRecorder()
+    for thread_recorder in recorders:
+        recorder.merge(thread_recorder)
+    results = {"config": config.to_dict(), "elapsed": elapsed, "booked": recorder.booked, "failed": recorder.failed,
+               "operations": {}}
+    for operation, samples in recorder.samples.items():
+        samples.sort()
+        results["operations"][operation] = {
+            "count": len(samples),
+            "rps": len(samples) / elapsed,
+            "p50_ms": _percentile(samples, 50) * 1000,
+            "p95_ms": _percentile(samples, 95) * 1000,
+            "p99_ms": _percentile(samples, 99) * 1000,
+            "max_ms": (samples[-1] if samples else 0) * 1000,
+        }
+    booking_engine.catalog.clear()
+    return results
+
+
+def print_results(results):
+    print(f"{results['config']['sessions']} sessions on {results['config']['concurrency']} threads in "
+          f"{results['elapsed']:.1f}s, {results['booked']} booked, {results['failed']} failed")
+    print(f"{'operation':<14} {'count':>8} {'rps':>10} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for operation, stats in results["operations"].items():
+        print(f"{operation:<14} {stats['count']:>8} {stats['rps']:>10.0f} {stats['p50_ms']:>9.3f} "
+              f"{stats['p95_ms']:>9.3f} {stats['p99_ms']:>9.3f} {stats['max_ms']:>9.3f}")
+
+
+def check_baseline(results, baseline, tolerance):
+    # a regression is p99 above baseline * (1 + tolerance) or throughput below baseline * (1 - tolerance)
+    if baseline["config"] != results["config"]:
+        print("warning: baseline was recorded with a different config")
+    regressions = []
+    for operation, stats in results["operations"].items():
+        base = baseline["operations"].get(operation)
+        if base is None or not base["count"]:
+            continue
+        if stats["p99_ms"] > base["p99_ms"] * (1 + tolerance):
+            regressions.append(f"{operation} p99 {stats['p99_ms']:.3f}ms vs baseline {base['p99_ms']:.3f}ms")
+        if stats["rps"] < base["rps"] * (1 - tolerance):
+            regressions.append(f"{operation} throughput {stats['rps']:.0f}/s vs baseline {base['rps']:.0f}/s")
+    return regressions
+
+
+def main(argv=None):
+    defaults = LoadTestConfig()
+    parser = argparse.ArgumentParser(description="Load test the book-my-show booking flow")
+    for name, value in defaults.to_dict().items():
+        parser.add_argument(f"--{name.replace('_', '-')}", type=type(value), default=value)
+    parser.add_argument("--save-baseline", metavar="FILE")
+    parser.add_argument("--check-baseline", metavar="FILE")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown before a run fails")
+    args = parser.parse_args(argv)
+
+    config = LoadTestConfig(**{name: getattr(args, name) for name in defaults.to_dict()})
+    results = run_load_test(config)
+    print_results(results)
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"baseline saved to {args.save_baseline}")
+    if args.check_baseline:
+        with open(args.check_baseline) as f:
+            regressions = check_baseline(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION: {regression}")
+        if regressions:
+            return 1
+        print(f"no regressions against {args.check_baseline} (tolerance {args.tolerance:.0%})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,8 +1,22 @@
 # Design elevator system
 # Entities - Elevator, Scheduler, Elevator system (manages elevators)
+# each elevator serves its stops with LOOK: keep going in one direction while there are stops ahead, then turn
+# ElevatorSimulation is a discrete-event simulator for comparing schedulers under realistic traffic
+# at peak the calls of one tick can be dispatched together as a min-cost car-to-call assignment
+# AsyncElevatorController runs every car as its own asyncio task fed by a live request stream
+# FleetState keeps many buildings' cars as parallel typed arrays for large what-if simulations
 
+from array import array
 from enum import Enum
+from collections import deque
+from itertools import compress, repeat
+import asyncio
+import bisect
 import heapq
+import operator
+import random
+import sys
+import time
 
 
 class Direction(Enum):
@@ -29,24 +43,130 @@ class Request:
         self.request_type = request_type
 
 
+# original queue, always goes to the lowest requested floor next
+class HeapRequestQueue:
+    def __init__(self):
+        self.floors = []
+
+    def __len__(self):
+        return len(self.floors)
+
+    def add(self, request: Request, current_floor: int):
+        heapq.heappush(self.floors, request.floor)
+
+    def next_stop(self, current_floor: int):
+        return self.floors[0] if self.floors else None
+
+    def remove_stop(self, floor: int):
+        while self.floors and self.floors[0] == floor:
+            heapq.heappop(self.floors)
+
+    def bounds(self):
+        return (self.floors[0], max(self.floors)) if self.floors else None
+
+
+# LOOK queue, separate sorted up / down stop lists, a floor is stored once per list
+# car calls go to the list of the side they are on, hall calls to the list of the direction they want,
+# so a hall call for the opposite direction is picked up on the way back
+class LookRequestQueue:
+    def __init__(self):
+        self.up_stops = []
+        self.down_stops = []
+        self.sweep = Direction.IDLE
+
+    def __len__(self):
+        return len(self.up_stops) + len(self.down_stops)
+
+    def add(self, request: Request, current_floor: int):
+        if request.request_type == RequestType.EXTERNAL and request.direction != Direction.IDLE:
+            going_up = request.direction == Direction.UP
+        elif request.floor != current_floor:
+            going_up = request.floor > current_floor
+        else:
+            going_up = self.sweep != Direction.DOWN
+        stops = self.up_stops if going_up else self.down_stops
+        index = bisect.bisect_left(stops, request.floor)
+        if index == len(stops) or stops[index] != request.floor:
+            stops.insert(index, request.floor)
+
+    def _next_up(self, current_floor):
+        index = bisect.bisect_left(self.up_stops, current_floor)
+        if index < len(self.up_stops):
+            return self.up_stops[index]
+        # highest down call above the car is where the up sweep turns
+        if self.down_stops and self.down_stops[-1] > current_floor:
+            return self.down_stops[-1]
+        return None
+
+    def _next_down(self, current_floor):
+        index = bisect.bisect_right(self.down_stops, current_floor)
+        if index:
+            return self.down_stops[index - 1]
+        if self.up_stops and self.up_stops[0] < current_floor:
+            return self.up_stops[0]
+        return None
+
+    def _nearest(self, current_floor):
+        nearest = None
+        for stops in (self.up_stops, self.down_stops):
+            index = bisect.bisect_left(stops, current_floor)
+            for floor in stops[max(0, index - 1):index + 1]:
+                if nearest is None or abs(floor - current_floor) < abs(nearest - current_floor):
+                    nearest = floor
+        return nearest
+
+    def next_stop(self, current_floor: int):
+        if self.sweep == Direction.IDLE:
+            nearest = self._nearest(current_floor)
+            if nearest is None:
+                return None
+            self.sweep = Direction.DOWN if nearest < current_floor else Direction.UP
+        # keep the sweep direction while there is anything ahead, otherwise turn around once
+        for _ in range(2):
+            if self.sweep == Direction.UP:
+                stop = self._next_up(current_floor)
+            else:
+                stop = self._next_down(current_floor)
+            if stop is not None:
+                return stop
+            self.sweep = Direction.DOWN if self.sweep == Direction.UP else Direction.UP
+        self.sweep = Direction.IDLE
+        return None
+
+    def bounds(self):
+        lowest = [stops[0] for stops in (self.up_stops, self.down_stops) if stops]
+        highest = [stops[-1] for stops in (self.up_stops, self.down_stops) if stops]
+        return (min(lowest), max(highest)) if lowest else None
+
+    def remove_stop(self, floor: int):
+        # doors open once, everyone waiting at the floor is served
+        for stops in (self.up_stops, self.down_stops):
+            index = bisect.bisect_left(stops, floor)
+            if index < len(stops) and stops[index] == floor:
+                stops.pop(index)
+
+
 class Elevator:
-    def __init__(self, id):
+    def __init__(self, id, request_queue=None, capacity=16):
         self.id = id
         self.current_floor = 0
         self.current_state = State.IDLE
         self.direction = Direction.IDLE
-        self.requests = []
+        self.requests = request_queue if request_queue is not None else LookRequestQueue()
+        self.capacity = capacity
+        self.load = 0
 
     def add_request(self, request: Request):
-        heapq.heappush(self.requests, request.floor)
+        self.requests.add(request, self.current_floor)
 
     def move(self):
-        if not self.requests:
+        next_floor = self.requests.next_stop(self.current_floor)
+        if next_floor is None:
             self.current_state = State.IDLE
             self.direction = Direction.IDLE
             return
 
-        next_floor = heapq.heappop(self.requests)
+        self.requests.remove_stop(next_floor)
         # set direction
         if next_floor > self.current_floor:
             self.direction = Direction.UP
@@ -60,39 +180,930 @@ class Elevator:
         print(f"Elevator {self.id} moved to floor {next_floor}")
 
 
+# hungarian algorithm (shortest augmenting path), cost is rows x cols with rows <= cols,
+# returns the column given to each row so that the total cost is minimal
+def _min_cost_assignment(cost):
+    num_rows, num_cols = len(cost), len(cost[0])
+    inf = float("inf")
+    row_potential = [0] * (num_rows + 1)
+    col_potential = [0] * (num_cols + 1)
+    owner = [0] * (num_cols + 1)  # row matched to each column, 1-based, 0 = free
+    way = [0] * (num_cols + 1)
+    for row in range(1, num_rows + 1):
+        owner[0] = row
+        col = 0
+        min_slack = [inf] * (num_cols + 1)
+        used = [False] * (num_cols + 1)
+        while True:
+            used[col] = True
+            current_row = owner[col]
+            costs = cost[current_row - 1]
+            potential = row_potential[current_row]
+            delta = inf
+            next_col = 0
+            for j in range(1, num_cols + 1):
+                if not used[j]:
+                    slack = costs[j - 1] - potential - col_potential[j]
+                    if slack < min_slack[j]:
+                        min_slack[j] = slack
+                        way[j] = col
+                    if min_slack[j] < delta:
+                        delta = min_slack[j]
+                        next_col = j
+            for j in range(num_cols + 1):
+                if used[j]:
+                    row_potential[owner[j]] += delta
+                    col_potential[j] -= delta
+                else:
+                    min_slack[j] -= delta
+            col = next_col
+            if owner[col] == 0:
+                break
+        while col:
+            previous = way[col]
+            owner[col] = owner[previous]
+            col = previous
+    result = [0] * num_rows
+    for col in range(1, num_cols + 1):
+        if owner[col]:
+            result[owner[col] - 1] = col - 1
+    return result
+
+
+# calls that no car can take yet wait in a queue and are handed out as soon as a car frees up, none are dropped
+# cars are kept in floor-ordered indexes (idle, moving up, moving down) so picking a car is a bisect, not a scan
 class Scheduler:
+    BATCH_THRESHOLD = 4  # smaller batches are assigned greedily in arrival order
+    STOP_COST = 5  # a stop (doors, dwell) costs about as much time as travelling this many floors
+    FULL_CAR_STOPS = 20  # a full car is priced as if it had this many more stops
+
+    def __init__(self, elevators):
+        self.elevators = elevators
+        self.pending = deque()
+        self.indexes = {Direction.IDLE: [], Direction.UP: [], Direction.DOWN: []}  # sorted (floor, elevator id)
+        self.positions = {}  # elevator id: (index direction, key)
+        self.by_id = {elevator.id: elevator for elevator in elevators}
+        for elevator in elevators:
+            self._reindex(elevator)
+
+    def _reindex(self, elevator):
+        old = self.positions.pop(elevator.id, None)
+        if old:
+            index = self.indexes[old[0]]
+            del index[bisect.bisect_left(index, old[1])]
+        if elevator.current_state == State.MAINTENANCE:
+            return
+        if elevator.current_state != State.IDLE and elevator.direction == Direction.IDLE:
+            # busy at its floor, not free for new calls until it leaves
+            return
+        key = (elevator.current_floor, elevator.id)
+        bisect.insort(self.indexes[elevator.direction], key)
+        self.positions[elevator.id] = (elevator.direction, key)
+
+    def _nearest_idle(self, floor):
+        index = self.indexes[Direction.IDLE]
+        position = bisect.bisect_left(index, (floor, -1))
+        candidates = index[max(0, position - 1):position + 1]
+        if not candidates:
+            return None, float("inf")
+        car_floor, elevator_id = min(candidates, key=lambda key: abs(key[0] - floor))
+        return self.by_id[elevator_id], abs(car_floor - floor)
+
+    def _nearest_passing(self, request: Request):
+        # nearest car still short of the floor and moving towards it in the direction the caller wants, with room left
+        if request.direction == Direction.UP:
+            index = self.indexes[Direction.UP]
+            positions = range(bisect.bisect_left(index, (request.floor, -1)) - 1, -1, -1)
+        elif request.direction == Direction.DOWN:
+            index = self.indexes[Direction.DOWN]
+            positions = range(bisect.bisect_right(index, (request.floor, float("inf"))), len(index))
+        else:
+            return None, float("inf")
+        for position in positions:
+            car_floor, elevator_id = index[position]
+            elevator = self.by_id[elevator_id]
+            if elevator.load < elevator.capacity:
+                return elevator, abs(car_floor - request.floor)
+        return None, float("inf")
+
+    def select(self, request: Request):
+        idle, idle_distance = self._nearest_idle(request.floor)
+        passing, passing_distance = self._nearest_passing(request)
+        return passing if passing_distance < idle_distance else idle
+
+    def _give(self, elevator, request: Request):
+        elevator.add_request(request)
+        if elevator.current_state == State.IDLE:
+            elevator.current_state = State.MOVING
+            if request.floor > elevator.current_floor:
+                elevator.direction = Direction.UP
+            elif request.floor < elevator.current_floor:
+                elevator.direction = Direction.DOWN
+            else:
+                elevator.direction = request.direction
+        self._reindex(elevator)
+
+    # returns the elevator the call went to, None if it is queued until a car is free
+    def assign(self, request: Request):
+        elevator = self.select(request)
+        if elevator is None:
+            self.pending.append(request)
+            return None
+        self._give(elevator, request)
+        return elevator
+
+    # call whenever a car's floor, direction or state changes, returns (request, elevator) handed out from the queue
+    def update(self, elevator):
+        self._reindex(elevator)
+        if elevator.current_state != State.IDLE:
+            return []
+        return self.dispatch_pending()
+
+    # a batch of calls is solved as rounds of min-cost assignment, each car takes at most one call per round
+    # and starts the next round from that call's floor, small batches go through assign one by one
+    def assign_batch(self, requests):
+        calls = list({(request.floor, request.direction): request for request in requests}.values())
+        cars = [elevator for elevator in self.elevators if elevator.current_state != State.MAINTENANCE]
+        if len(calls) < self.BATCH_THRESHOLD or not cars:
+            return [(request, self.assign(request)) for request in calls]
+        states = [self._route_state(elevator) for elevator in cars]
+        remaining = calls
+        assigned = []
+        while remaining:
+            costs = self._cost_matrix(states, remaining)  # cars x calls
+            if len(cars) <= len(remaining):
+                pairs = enumerate(_min_cost_assignment(costs))
+            else:
+                transposed = [list(column) for column in zip(*costs)]
+                pairs = ((car, call) for call, car in enumerate(_min_cost_assignment(transposed)))
+            taken = set()
+            for car, call in pairs:
+                request = remaining[call]
+                self._give(cars[car], request)
+                assigned.append((request, cars[car]))
+                floor, _, _, stops = states[car]
+                states[car] = (request.floor, request.direction, None, stops + 1)
+                taken.add(call)
+            remaining = [request for i, request in enumerate(remaining) if i not in taken]
+        return assigned
+
     @staticmethod
-    def assign(elevators, request: Request):
+    def _route_state(elevator):
+        # (floor, direction, furthest stop in that direction, stops already planned)
+        bounds = elevator.requests.bounds()
+        if elevator.direction == Direction.UP:
+            furthest = max(elevator.current_floor, bounds[1]) if bounds else elevator.current_floor
+        elif elevator.direction == Direction.DOWN:
+            furthest = min(elevator.current_floor, bounds[0]) if bounds else elevator.current_floor
+        else:
+            furthest = None
+        stops = len(elevator.requests) + (Scheduler.FULL_CAR_STOPS if elevator.load >= elevator.capacity else 0)
+        return elevator.current_floor, elevator.direction, furthest, stops
+
+    def _cost_matrix(self, states, calls):
+        # estimated floors travelled before reaching each call, a planned stop counts as STOP_COST floors
+        floors = [request.floor for request in calls]
+        ups = [request.direction == Direction.UP for request in calls]
+        rows = []
+        for floor, direction, furthest, stops in states:
+            penalty = stops * self.STOP_COST
+            if direction == Direction.UP:
+                turn = furthest if furthest is not None else floor
+                rows.append([(target - floor if up and target >= floor else turn - floor + abs(turn - target)) + penalty
+                             for target, up in zip(floors, ups)])
+            elif direction == Direction.DOWN:
+                turn = furthest if furthest is not None else floor
+                rows.append([(floor - target if not up and target <= floor else floor - turn + abs(target - turn)) + penalty
+                             for target, up in zip(floors, ups)])
+            else:
+                rows.append([abs(target - floor) + penalty for target in floors])
+        return rows
+
+    def dispatch_pending(self):
+        # oldest call first, stop as soon as it cannot be placed
+        assigned = []
+        while self.pending:
+            elevator = self.select(self.pending[0])
+            if elevator is None:
+                break
+            request = self.pending.popleft()
+            self._give(elevator, request)
+            assigned.append((request, elevator))
+        return assigned
+
+
+# original policy, nearest idle car by linear scan, kept to compare against
+class NearestIdleScheduler(Scheduler):
+    def _reindex(self, elevator):
+        pass
+
+    def select(self, request: Request):
         best_elevator = None
         min_distance = float("inf")
-        for elevator in elevators:
+        for elevator in self.elevators:
             if elevator.current_state == State.IDLE:
                 distance = abs(request.floor - elevator.current_floor)
                 if distance < min_distance:
                     min_distance = distance
                     best_elevator = elevator
-        if best_elevator:
-            best_elevator.add_request(request)
-            best_elevator.current_state = State.MOVING
+        return best_elevator
 
 
 class ElevatorSystem:
-    def __init__(self, num_elevators: int):
+    def __init__(self, num_elevators: int, scheduler_class=Scheduler, batch_dispatch=False):
         self.elevators = [Elevator(i) for i in range(num_elevators)]
-        self.scheduler = Scheduler()
+        self.scheduler = scheduler_class(self.elevators)
+        self.batch_dispatch = batch_dispatch
+        self.batch = []
 
+    # returns the elevator the call went to, None if it is queued until a car is free
+    # or, in batch mode, until the next step dispatches the tick's calls together
     def handle_request(self, floor: int, direction: Direction):
         request = Request(floor, direction, RequestType.EXTERNAL)
-        self.scheduler.assign(self.elevators, request)
+        if self.batch_dispatch:
+            self.batch.append(request)
+            return None
+        return self.scheduler.assign(request)
+
+    def dispatch_batch(self):
+        requests, self.batch = self.batch, []
+        return self.scheduler.assign_batch(requests)
 
     def step(self):
+        if self.batch:
+            self.dispatch_batch()
         for elevator in self.elevators:
             elevator.move()
+            self.scheduler.update(elevator)
+
+
+# Elevator-compatible view over one car of a FleetState, reads and writes go straight to the fleet's arrays
+class ElevatorView:
+    __slots__ = ("fleet", "id")
+
+    def __init__(self, fleet, id):
+        self.fleet = fleet
+        self.id = id
+
+    @property
+    def current_floor(self):
+        return self.fleet.floors[self.id]
+
+    @property
+    def direction(self):
+        return Direction(self.fleet.directions[self.id])
+
+    @property
+    def current_state(self):
+        return State(self.fleet.states[self.id])
+
+    @property
+    def target(self):
+        target = self.fleet.targets[self.id]
+        return None if target < 0 else target
+
+    def add_request(self, request: Request):
+        self.fleet.add_stop(self.id, request.floor)
+
+    def move(self):
+        # jumps to the next stop like Elevator.move, FleetState.step moves every car one floor instead
+        fleet = self.fleet
+        target = fleet.targets[self.id]
+        if target < 0:
+            return
+        fleet.floors[self.id] = target
+        fleet._arrive(self.id)
+
+
+# column store for many buildings, car i of building b is row b * cars_per_building + i
+# each car's current target is a column, distances, assignment and step() go through map / min over whole
+# columns instead of a python loop over Elevator objects
+# further stops of a car and calls no idle car could take are kept aside in deques, like Scheduler.pending
+class FleetState:
+    def __init__(self, num_buildings: int, cars_per_building: int):
+        size = num_buildings * cars_per_building
+        self.num_buildings = num_buildings
+        self.cars_per_building = cars_per_building
+        self.floors = array("l", bytes(size * array("l").itemsize))
+        self.directions = array("b", bytes(size))  # Direction values
+        self.states = array("b", [State.IDLE.value]) * size
+        self.targets = array("l", [-1]) * size
+        self.busy_penalty = array("l", bytes(size * array("l").itemsize))  # 0 for idle cars, large otherwise
+        self.idle_counts = array("l", [cars_per_building]) * num_buildings
+        self.stops = {}  # car: deque of floors after its target, only for cars given more than one stop
+        self.pending = [deque() for _ in range(num_buildings)]  # building: floors waiting for an idle car
+
+    def elevator(self, car):
+        return ElevatorView(self, car)
+
+    @property
+    def elevators(self):
+        return [ElevatorView(self, car) for car in range(len(self.floors))]
+
+    def _cars(self, building):
+        start = building * self.cars_per_building
+        return start, start + self.cars_per_building
+
+    def distances(self, building, floor):
+        start, end = self._cars(building)
+        return list(map(abs, map(operator.sub, self.floors[start:end], repeat(floor))))
+
+    def _set_target(self, car, floor):
+        current = self.floors[car]
+        self.targets[car] = floor
+        self.directions[car] = (floor > current) - (floor < current)
+        if self.states[car] == State.IDLE.value:
+            self.states[car] = State.MOVING.value
+            self.busy_penalty[car] = 1 << 30
+            self.idle_counts[car // self.cars_per_building] -= 1
+
+    def add_stop(self, car, floor):
+        if self.targets[car] < 0:
+            self._set_target(car, floor)
+        else:
+            self.stops.setdefault(car, deque()).append(floor)
+
+    def assign(self, building, floor):
+        # nearest idle car of the building, None if all are busy and the call is queued until one is free
+        if not self.idle_counts[building]:
+            self.pending[building].append(floor)
+            return None
+        start, end = self._cars(building)
+        costs = list(map(operator.add, map(abs, map(operator.sub, self.floors[start:end], repeat(floor))),
+                         self.busy_penalty[start:end]))
+        car = start + costs.index(min(costs))
+        self._set_target(car, floor)
+        return car
+
+    def _arrive(self, car):
+        # car is at its target, it takes its next stop or goes idle and picks up the oldest queued call
+        # returns [(building, floor, car)] handed out from the queue
+        stops = self.stops.get(car)
+        if stops:
+            self._set_target(car, stops.popleft())
+            if not stops:
+                del self.stops[car]
+            return []
+        self.targets[car] = -1
+        self.directions[car] = Direction.IDLE.value
+        self.states[car] = State.IDLE.value
+        self.busy_penalty[car] = 0
+        building = car // self.cars_per_building
+        self.idle_counts[building] += 1
+        pending = self.pending[building]
+        assigned = []
+        while pending and self.idle_counts[building]:
+            floor = pending.popleft()
+            assigned.append((building, floor, self.assign(building, floor)))
+        return assigned
+
+    def step(self):
+        # every car moves one floor along its direction, returns the queued calls handed to cars that went idle
+        self.floors = array("l", map(operator.add, self.floors, self.directions))
+        assigned = []
+        for car in list(compress(range(len(self.floors)), map(operator.eq, self.floors, self.targets))):
+            assigned += self._arrive(car)
+        return assigned
+
+
+# one task per car plus a dispatcher task, button panels push calls into an asyncio queue at any time
+# a car moves a floor at a time and looks at its queue again on every floor, so calls made while
+# it is moving are picked up on the way without any global tick
+class AsyncElevatorController:
+    def __init__(self, system: ElevatorSystem, floor_travel_time=1.5, door_dwell=8.0):
+        self.system = system
+        self.scheduler = system.scheduler
+        self.floor_travel_time = floor_travel_time
+        self.door_dwell = door_dwell
+        self.calls = None
+        self.wakeups = {}
+        self.tasks = []
+        self.waiting = {}  # floor: [submit time] of calls not served yet
+        self.latencies = []
+
+    async def start(self):
+        self.calls = asyncio.Queue()
+        self.wakeups = {elevator.id: asyncio.Event() for elevator in self.system.elevators}
+        self.tasks = [asyncio.create_task(self._dispatch())]
+        self.tasks += [asyncio.create_task(self._run_car(elevator)) for elevator in self.system.elevators]
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    async def hall_call(self, floor: int, direction: Direction):
+        await self.calls.put((Request(floor, direction, RequestType.EXTERNAL), None))
+
+    async def car_call(self, elevator_id, floor: int):
+        await self.calls.put((Request(floor, Direction.IDLE, RequestType.INTERNAL), elevator_id))
+
+    def _wake(self, elevator):
+        self.wakeups[elevator.id].set()
+
+    async def _dispatch(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.calls.get()]
+            # everything that queued up meanwhile is dispatched together
+            while not self.calls.empty():
+                batch.append(self.calls.get_nowait())
+            now = loop.time()
+            hall_calls = []
+            for request, elevator_id in batch:
+                self.waiting.setdefault(request.floor, []).append(now)
+                if elevator_id is None:
+                    hall_calls.append(request)
+                    continue
+                elevator = self.system.elevators[elevator_id]
+                elevator.add_request(request)
+                self._wake(elevator)
+            for _, elevator in self.scheduler.assign_batch(hall_calls):
+                if elevator:
+                    self._wake(elevator)
+
+    def _serve(self, floor):
+        now = asyncio.get_running_loop().time()
+        self.latencies.extend(now - submitted for submitted in self.waiting.pop(floor, ()))
+
+    async def _run_car(self, elevator):
+        wakeup = self.wakeups[elevator.id]
+        while True:
+            next_floor = elevator.requests.next_stop(elevator.current_floor)
+            if next_floor is None:
+                elevator.current_state = State.IDLE
+                elevator.direction = Direction.IDLE
+                for _, assigned in self.scheduler.update(elevator):
+                    self._wake(assigned)
+                if elevator.requests.next_stop(elevator.current_floor) is None:
+                    wakeup.clear()
+                    await wakeup.wait()
+                continue
+            if next_floor != elevator.current_floor:
+                step = 1 if next_floor > elevator.current_floor else -1
+                elevator.current_state = State.MOVING
+                elevator.direction = Direction.UP if step > 0 else Direction.DOWN
+                await asyncio.sleep(self.floor_travel_time)
+                elevator.current_floor += step
+                self.scheduler.update(elevator)
+                continue
+            elevator.requests.remove_stop(next_floor)
+            self._serve(next_floor)
+            await asyncio.sleep(self.door_dwell)
+
+
+class Passenger:
+    __slots__ = ("origin", "destination", "arrival_time", "board_time")
+
+    def __init__(self, arrival_time, origin, destination):
+        self.arrival_time = arrival_time
+        self.origin = origin
+        self.destination = destination
+        self.board_time = None
+
+    @property
+    def direction(self):
+        return Direction.UP if self.destination > self.origin else Direction.DOWN
+
+
+# traffic generators, each yields passengers in arrival order, times are seconds from midnight
+class TrafficGenerator:
+    @staticmethod
+    def _poisson(rng, start, end, per_hour):
+        now = start
+        while True:
+            now += rng.expovariate(per_hour / 3600)
+            if now >= end:
+                return
+            yield now
+
+    @staticmethod
+    def up_peak(num_floors, start, end, per_hour, lobby=0, seed=None):
+        rng = random.Random(seed)
+        for arrival in TrafficGenerator._poisson(rng, start, end, per_hour):
+            yield Passenger(arrival, lobby, rng.choice([f for f in range(num_floors) if f != lobby]))
+
+    @staticmethod
+    def down_peak(num_floors, start, end, per_hour, lobby=0, seed=None):
+        rng = random.Random(seed)
+        for arrival in TrafficGenerator._poisson(rng, start, end, per_hour):
+            yield Passenger(arrival, rng.choice([f for f in range(num_floors) if f != lobby]), lobby)
+
+    @staticmethod
+    def lunch(num_floors, start, end, per_hour, lobby=0, seed=None):
+        # 40% going out, 40% coming back, 20% between floors
+        rng = random.Random(seed)
+        for arrival in TrafficGenerator._poisson(rng, start, end, per_hour):
+            floor = rng.randrange(1, num_floors)
+            mix = rng.random()
+            if mix < 0.4:
+                yield Passenger(arrival, floor, lobby)
+            elif mix < 0.8:
+                yield Passenger(arrival, lobby, floor)
+            else:
+                other = rng.randrange(1, num_floors)
+                yield Passenger(arrival, floor, other if other != floor else lobby)
+
+    @staticmethod
+    def interfloor(num_floors, start, end, per_hour, seed=None):
+        rng = random.Random(seed)
+        for arrival in TrafficGenerator._poisson(rng, start, end, per_hour):
+            origin, destination = rng.sample(range(num_floors), 2)
+            yield Passenger(arrival, origin, destination)
+
+    @staticmethod
+    def full_day(num_floors, population, seed=0):
+        hour = 3600
+        phases = [
+            TrafficGenerator.up_peak(num_floors, 7.5 * hour, 10 * hour, population * 0.4, seed=seed),
+            TrafficGenerator.lunch(num_floors, 11.5 * hour, 14 * hour, population * 0.5, seed=seed + 1),
+            TrafficGenerator.down_peak(num_floors, 16.5 * hour, 19 * hour, population * 0.4, seed=seed + 2),
+            TrafficGenerator.interfloor(num_floors, 7 * hour, 20 * hour, population * 0.05, seed=seed + 3),
+        ]
+        return heapq.merge(*phases, key=lambda passenger: passenger.arrival_time)
+
+
+class SimulationReport:
+    def __init__(self, delivered, duration, waits, journeys):
+        self.delivered = delivered
+        self.duration = duration
+        self.waits = waits
+        self.journeys = journeys
+
+    @property
+    def throughput_per_hour(self):
+        return self.delivered / self.duration * 3600 if self.duration else 0
+
+    def summary(self):
+        waits, journeys = self.waits, self.journeys
+        return (f"delivered {self.delivered} ({self.throughput_per_hour:.0f}/h), "
+                f"wait p50/p95/p99 {_percentile(waits, 50):.0f}/{_percentile(waits, 95):.0f}/"
+                f"{_percentile(waits, 99):.0f}s, "
+                f"journey p50/p95/p99 {_percentile(journeys, 50):.0f}/{_percentile(journeys, 95):.0f}/"
+                f"{_percentile(journeys, 99):.0f}s")
+
+
+# discrete-event simulation over an ElevatorSystem, cars only generate events when they reach a stop or leave it
+class ElevatorSimulation:
+    PASSENGER_ARRIVAL = 0
+    CAR_ARRIVAL = 1
+    CAR_DEPARTURE = 2
+
+    def __init__(self, system: ElevatorSystem, floor_travel_time=1.5, door_dwell=8.0, capacity=16):
+        self.system = system
+        self.floor_travel_time = floor_travel_time
+        self.door_dwell = door_dwell
+        self.capacity = capacity
+        for elevator in system.elevators:
+            elevator.capacity = capacity
+        self.riders = {elevator.id: [] for elevator in system.elevators}
+        self.busy = {elevator.id: False for elevator in system.elevators}
+        self.trips = {}  # elevator id: (departure time, from floor, target floor) while moving
+        self.versions = {elevator.id: 0 for elevator in system.elevators}  # stale car arrivals are skipped
+        self.waiting = {}  # (floor, direction): deque of passengers
+        # (floor, direction): [elevator id, None while queued in the scheduler], one call per car load waiting
+        self.hall_calls = {}
+        self.events = []
+        self.sequence = 0
+        self.now = 0.0
+        self.waits = []
+        self.journeys = []
+
+    def _push(self, at, kind, payload, version=0):
+        self.sequence += 1
+        heapq.heappush(self.events, (at, self.sequence, kind, payload, version))
+
+    def run(self, passengers):
+        passengers = iter(passengers)
+        first = next(passengers, None)
+        if first is None:
+            return SimulationReport(0, 0, [], [])
+        start = first.arrival_time
+        self._push(first.arrival_time, self.PASSENGER_ARRIVAL, first)
+        while self.events:
+            self.now, _, kind, payload, version = heapq.heappop(self.events)
+            if kind == self.PASSENGER_ARRIVAL:
+                upcoming = next(passengers, None)
+                if upcoming is not None:
+                    self._push(upcoming.arrival_time, self.PASSENGER_ARRIVAL, upcoming)
+                self._on_passenger(payload)
+            elif kind == self.CAR_ARRIVAL:
+                if version == self.versions[payload.id]:
+                    self._on_car_arrival(payload)
+            else:
+                self._on_car_departure(payload)
+        return SimulationReport(len(self.journeys), self.now - start, self.waits, self.journeys)
+
+    def _on_passenger(self, passenger):
+        key = (passenger.origin, passenger.direction)
+        self.waiting.setdefault(key, deque()).append(passenger)
+        self._hall_call(*key)
+
+    def _hall_call(self, floor, direction):
+        key = (floor, direction)
+        calls = self.hall_calls.setdefault(key, [])
+        refreshed = False
+        while len(self.waiting.get(key, ())) > self.capacity * len(calls):
+            if not refreshed:
+                self._refresh_positions()
+                refreshed = True
+            elevator = self.system.scheduler.assign(Request(floor, direction, RequestType.EXTERNAL))
+            calls.append(elevator.id if elevator else None)
+            if elevator is None:
+                return
+            self._wake(elevator)
+
+    def _update(self, elevator):
+        for request, assigned in self.system.scheduler.update(elevator):
+            calls = self.hall_calls.get((request.floor, request.direction))
+            if calls and None in calls:
+                calls[calls.index(None)] = assigned.id
+            self._wake(assigned)
+
+    def _wake(self, elevator):
+        if not self.busy[elevator.id]:
+            self.busy[elevator.id] = True
+            self._push(self.now, self.CAR_DEPARTURE, elevator)
+        elif elevator.id in self.trips:
+            self._reroute(elevator)
+
+    def _refresh_positions(self):
+        # moving cars only report their floor at stops, bring them up to date before the scheduler looks
+        for elevator_id, (departed_at, from_floor, target) in self.trips.items():
+            step = 1 if target > from_floor else -1
+            passed = min(int((self.now - departed_at) / self.floor_travel_time), abs(target - from_floor))
+            elevator = self.system.elevators[elevator_id]
+            if elevator.current_floor != from_floor + step * passed:
+                elevator.current_floor = from_floor + step * passed
+                self._update(elevator)
+
+    def _reroute(self, elevator):
+        # a new stop between the next floor the car can still stop at and its target shortens the trip
+        departed_at, from_floor, target = self.trips[elevator.id]
+        step = 1 if target > from_floor else -1
+        passed = int((self.now - departed_at) / self.floor_travel_time)
+        next_floor = from_floor + step * min(passed + 1, abs(target - from_floor))
+        elevator.current_floor = next_floor - step
+        self._update(elevator)
+        stop = elevator.requests.next_stop(next_floor)
+        if stop is None or stop == target or (stop - next_floor) * step < 0 or (target - stop) * step <= 0:
+            return
+        self.trips[elevator.id] = (departed_at, from_floor, stop)
+        self.versions[elevator.id] += 1
+        arrive_at = departed_at + abs(stop - from_floor) * self.floor_travel_time
+        self._push(arrive_at, self.CAR_ARRIVAL, elevator, self.versions[elevator.id])
+
+    def _on_car_arrival(self, elevator):
+        _, _, floor = self.trips.pop(elevator.id, (None, None, elevator.current_floor))
+        elevator.current_floor = floor
+        self._update(elevator)
+        elevator.requests.remove_stop(floor)
+        riders = self.riders[elevator.id]
+        staying = []
+        for passenger in riders:
+            if passenger.destination == floor:
+                self.journeys.append(self.now - passenger.arrival_time)
+            else:
+                staying.append(passenger)
+        riders[:] = staying
+
+        next_floor = elevator.requests.next_stop(floor)
+        if next_floor is not None and next_floor != floor:
+            direction = Direction.UP if next_floor > floor else Direction.DOWN
+        elif self.waiting.get((floor, Direction.UP)):
+            direction = Direction.UP
+        else:
+            direction = Direction.DOWN
+        queue = self.waiting.get((floor, direction))
+        while queue and len(riders) < elevator.capacity:
+            passenger = queue.popleft()
+            passenger.board_time = self.now
+            self.waits.append(self.now - passenger.arrival_time)
+            riders.append(passenger)
+            elevator.add_request(Request(passenger.destination, direction, RequestType.INTERNAL))
+        elevator.load = len(riders)
+
+        # calls left at this floor, either the car was full or they want the other way
+        for key in ((floor, Direction.UP), (floor, Direction.DOWN)):
+            if not self.waiting.get(key):
+                self.hall_calls.pop(key, None)
+                continue
+            calls = self.hall_calls.get(key)
+            if calls:
+                calls[:] = [elevator_id for elevator_id in calls if elevator_id != elevator.id]
+            self._hall_call(*key)
+        self._push(self.now + self.door_dwell, self.CAR_DEPARTURE, elevator)
+
+    def _on_car_departure(self, elevator):
+        floor = elevator.current_floor
+        next_floor = elevator.requests.next_stop(floor)
+        if next_floor is None:
+            self.busy[elevator.id] = False
+            elevator.current_state = State.IDLE
+            elevator.direction = Direction.IDLE
+            self._update(elevator)
+            return
+        elevator.current_state = State.MOVING
+        if next_floor > floor:
+            elevator.direction = Direction.UP
+        elif next_floor < floor:
+            elevator.direction = Direction.DOWN
+        self._update(elevator)
+        self.trips[elevator.id] = (self.now, floor, next_floor)
+        self.versions[elevator.id] += 1
+        self._push(self.now + abs(next_floor - floor) * self.floor_travel_time, self.CAR_ARRIVAL, elevator,
+                   self.versions[elevator.id])
+
+
+def _percentile(values, percent):
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+
+def benchmark_request_queues(num_floors=50, num_ticks=200000, arrival_rates=(0.05, 0.2), seed=1):
+    # one car moving a floor per tick, random hall calls, wait = ticks until the car stops at the floor
+    for arrival_rate, queue_class in ((rate, cls) for rate in arrival_rates for cls in (HeapRequestQueue, LookRequestQueue)):
+        rng = random.Random(seed)
+        queue = queue_class()
+        current_floor = 0
+        waiting = {}  # floor: [arrival ticks]
+        waits = []
+        travelled = 0
+        for tick in range(num_ticks):
+            if rng.random() < arrival_rate:
+                floor = rng.randrange(num_floors)
+                if floor == 0:
+                    direction = Direction.UP
+                elif floor == num_floors - 1:
+                    direction = Direction.DOWN
+                else:
+                    direction = rng.choice((Direction.UP, Direction.DOWN))
+                queue.add(Request(floor, direction, RequestType.EXTERNAL), current_floor)
+                waiting.setdefault(floor, []).append(tick)
+            target = queue.next_stop(current_floor)
+            if target is None:
+                continue
+            if target != current_floor:
+                current_floor += 1 if target > current_floor else -1
+                travelled += 1
+            if current_floor == target:
+                queue.remove_stop(current_floor)
+                waits.extend(tick - arrived for arrived in waiting.pop(current_floor, []))
+        print(f"{queue_class.__name__} at {arrival_rate} calls/tick: served {len(waits)}, avg wait {sum(waits) / len(waits):.1f}, "
+              f"p95 wait {_percentile(waits, 95)}, floors travelled {travelled}")
+
+
+def benchmark_simulation(num_elevators=50, num_floors=100, population=10000, seed=0,
+                         scheduler_classes=(NearestIdleScheduler, Scheduler)):
+    for scheduler_class in scheduler_classes:
+        system = ElevatorSystem(num_elevators, scheduler_class)
+        simulation = ElevatorSimulation(system)
+        start = time.perf_counter()
+        report = simulation.run(TrafficGenerator.full_day(num_floors, population, seed))
+        elapsed = time.perf_counter() - start
+        print(f"{scheduler_class.__name__}, full day, {num_elevators} cars, {num_floors} floors: "
+              f"{report.summary()}, simulated in {elapsed:.1f}s")
+
+
+def benchmark_assign(fleet_sizes=(50, 500, 5000), num_requests=20000, num_floors=1000, seed=0):
+    # half the fleet idle, half moving, cost of choosing a car per call
+    for fleet_size in fleet_sizes:
+        for scheduler_class in (NearestIdleScheduler, Scheduler):
+            rng = random.Random(seed)
+            elevators = [Elevator(i) for i in range(fleet_size)]
+            for elevator in elevators:
+                elevator.current_floor = rng.randrange(num_floors)
+                if rng.random() < 0.5:
+                    elevator.current_state = State.MOVING
+                    elevator.direction = rng.choice((Direction.UP, Direction.DOWN))
+            scheduler = scheduler_class(elevators)
+            requests = [Request(rng.randrange(num_floors), rng.choice((Direction.UP, Direction.DOWN)),
+                                RequestType.EXTERNAL) for _ in range(num_requests)]
+            start = time.perf_counter()
+            for request in requests:
+                scheduler.select(request)
+            elapsed = time.perf_counter() - start
+            print(f"{scheduler_class.__name__}, {fleet_size} cars: {elapsed / num_requests * 1e6:.1f}us per call")
+
+
+def benchmark_batch_dispatch(num_elevators=50, num_floors=100, batch_sizes=(2, 50, 200, 500), seed=0):
+    # same fleet and calls, greedy one-by-one vs batch assignment, cost is the batch planner's travel estimate
+    for batch_size in batch_sizes:
+        results = []
+        for batch in (False, True):
+            rng = random.Random(seed)
+            system = ElevatorSystem(num_elevators)
+            for elevator in system.elevators:
+                elevator.current_floor = rng.randrange(num_floors)
+            requests = [Request(floor, Direction.UP if floor < rng.randrange(num_floors) else Direction.DOWN,
+                                RequestType.EXTERNAL) for floor in (rng.randrange(num_floors) for _ in range(batch_size))]
+            states = {elevator.id: Scheduler._route_state(elevator) for elevator in system.elevators}
+            start = time.perf_counter()
+            if batch:
+                assigned = system.scheduler.assign_batch(requests)
+            else:
+                assigned = [(request, system.scheduler.assign(request)) for request in requests]
+            elapsed = time.perf_counter() - start
+            total = 0
+            for request, elevator in assigned:
+                total += system.scheduler._cost_matrix([states[elevator.id]], [request])[0][0]
+                states[elevator.id] = (request.floor, request.direction, None, states[elevator.id][3] + 1)
+            results.append(f"{'batch' if batch else 'greedy'} {elapsed * 1000:.2f}ms cost {total}")
+        print(f"{batch_size} calls, {num_elevators} cars: " + ", ".join(results))
+
+
+async def _load_test(num_elevators, num_floors, requests_per_second, duration, floor_travel_time, door_dwell, seed):
+    rng = random.Random(seed)
+    controller = AsyncElevatorController(ElevatorSystem(num_elevators), floor_travel_time, door_dwell)
+    await controller.start()
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    submitted = 0
+    while loop.time() - start < duration:
+        due = int((loop.time() - start) * requests_per_second)
+        while submitted < due:
+            floor = rng.randrange(num_floors)
+            if rng.random() < 0.2:
+                await controller.car_call(rng.randrange(num_elevators), floor)
+            else:
+                direction = Direction.UP if floor < rng.randrange(num_floors) else Direction.DOWN
+                await controller.hall_call(floor, direction)
+            submitted += 1
+        await asyncio.sleep(0.001)
+    submit_time = loop.time() - start
+    # let the cars finish what is queued
+    while controller.waiting and loop.time() - start < duration * 10:
+        await asyncio.sleep(0.01)
+    await controller.stop()
+    latencies = controller.latencies
+    print(f"{num_elevators} cars: submitted {submitted} calls at {submitted / submit_time:.0f}/s, "
+          f"served {len(latencies)}, latency p50 {_percentile(latencies, 50) * 1000:.0f}ms "
+          f"p99 {_percentile(latencies, 99) * 1000:.0f}ms")
+
+
+def load_test_async_controller(num_elevators=50, num_floors=100, requests_per_second=5000, duration=2.0,
+                               floor_travel_time=0.002, door_dwell=0.005, seed=0):
+    asyncio.run(_load_test(num_elevators, num_floors, requests_per_second, duration, floor_travel_time, door_dwell,
+                           seed))
+
+
+def benchmark_fleet_state(num_buildings=100, cars_per_building=50, num_floors=100, num_ticks=200, calls_per_tick=3,
+                          seed=0):
+    # every tick each building gets a few calls, then all cars move a floor, calls with no idle car wait in a queue
+    rng = random.Random(seed)
+    calls = [[(building, rng.randrange(num_floors)) for building in range(num_buildings) for _ in range(calls_per_tick)]
+             for _ in range(num_ticks)]
+
+    buildings = [[Elevator(i, HeapRequestQueue()) for i in range(cars_per_building)] for _ in range(num_buildings)]
+    schedulers = [NearestIdleScheduler(elevators) for elevators in buildings]
+    start = time.perf_counter()
+    for tick_calls in calls:
+        for building, floor in tick_calls:
+            schedulers[building].assign(Request(floor, Direction.IDLE, RequestType.EXTERNAL))
+        for scheduler, elevators in zip(schedulers, buildings):
+            for elevator in elevators:
+                target = elevator.requests.next_stop(elevator.current_floor)
+                if target is None:
+                    continue
+                if target != elevator.current_floor:
+                    elevator.current_floor += 1 if target > elevator.current_floor else -1
+                if elevator.current_floor == target:
+                    elevator.requests.remove_stop(target)
+                    elevator.current_state = State.IDLE
+                    elevator.direction = Direction.IDLE
+                    scheduler.update(elevator)
+    objects = time.perf_counter() - start
+    objects_waiting = sum(len(scheduler.pending) for scheduler in schedulers)
+
+    fleet = FleetState(num_buildings, cars_per_building)
+    start = time.perf_counter()
+    for tick_calls in calls:
+        for building, floor in tick_calls:
+            fleet.assign(building, floor)
+        fleet.step()
+    columns = time.perf_counter() - start
+    cars = num_buildings * cars_per_building
+    print(f"{cars} cars, {num_ticks} ticks: objects {objects / num_ticks * 1000:.2f}ms/tick, "
+          f"fleet arrays {columns / num_ticks * 1000:.2f}ms/tick, calls still waiting: objects {objects_waiting}, "
+          f"fleet arrays {sum(map(len, fleet.pending))}")
+
+
+if __name__ == "__main__":
+    system = ElevatorSystem(3)
+    system.handle_request(5, Direction.UP)
+    system.handle_request(2, Direction.DOWN)
 
+    system.step()
+    system.step()
 
-system = ElevatorSystem(3)
-system.handle_request(5, Direction.UP)
-system.handle_request(2, Direction.DOWN)
 
-system.step()
-system.step()
+    if "--bench" in sys.argv:
+        benchmark_request_queues()
+        benchmark_simulation()
+        benchmark_assign()
+        benchmark_batch_dispatch()
+        load_test_async_controller()
+        benchmark_fleet_state()
@@ -4,10 +4,28 @@
 # parking lot should support different vehicle types (bike, car, truck)
 # generate ticket before parking will have entry time stamp
 # different pricing strategy for different vehicle types
+# free spots are indexed per (floor, vehicle type) so assigning a spot does not scan the floor
+# multiple gates can assign / release in parallel, each (floor, vehicle type) has its own lock
+# CompactParkingFloor keeps spots in typed arrays for very large deployments
+# fares can be settled one ticket at a time or for a whole day of exits in one batch
+# free spot counts per floor per vehicle type are kept live for availability displays
+# assign / release events can be journaled to disk so the lot can be rebuilt after a restart
+from abc import ABC, abstractmethod
+from array import array
 from enum import Enum
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+import bisect
+import heapq
+import json
+import os
+import random
+import sys
+import threading
+import time
+import tempfile
+import tracemalloc
 import uuid
-from datetime import datetime
+from datetime import datetime, timedelta
 
 
 class VehicleType(Enum):
@@ -35,60 +53,678 @@ class Ticket:
 
 
 class ParkingSpot:
-    def __init__(self, spot_id, spot_type: VehicleType):
+    def __init__(self, spot_id, spot_type: VehicleType, distance_to_elevator=0):
         self.spot_id = spot_id
         self.spot_type = spot_type
+        self.distance_to_elevator = distance_to_elevator
         self.is_free = True
         self.vehicle = None
+        self.floor = None
 
     def assign_vehicle(self, vehicle):
         self.vehicle = vehicle
         self.is_free = False
+        if self.floor:
+            self.floor.on_spot_taken(self)
 
     def remove_vehicle(self):
         self.is_free = True
         self.vehicle = None
+        if self.floor:
+            self.floor.on_spot_freed(self)
+
+
+# free spots of one type on one floor, add / remove / peek are O(1)
+class FreeSpotPool:
+    def __init__(self):
+        self.spots = []
+        self.positions = {}  # spot_id: index in spots
+
+    def __len__(self):
+        return len(self.spots)
+
+    def add(self, spot):
+        if spot.spot_id in self.positions:
+            return
+        self.positions[spot.spot_id] = len(self.spots)
+        self.spots.append(spot)
+
+    def remove(self, spot):
+        index = self.positions.pop(spot.spot_id, None)
+        if index is None:
+            return
+        last = self.spots.pop()
+        if last is not spot:
+            self.spots[index] = last
+            self.positions[last.spot_id] = index
+
+    def peek(self):
+        return self.spots[-1] if self.spots else None
+
+
+# free spots ordered by a key (eg distance to elevator), add / remove are O(log n), peek is amortised O(1)
+class OrderedFreeSpotPool:
+    def __init__(self, key):
+        self.key = key
+        self.heap = []
+        self.in_heap = set()  # spot ids that have an entry in heap
+        self.free = set()
+
+    def __len__(self):
+        return len(self.free)
+
+    def add(self, spot):
+        self.free.add(spot.spot_id)
+        if spot.spot_id not in self.in_heap:
+            self.in_heap.add(spot.spot_id)
+            heapq.heappush(self.heap, (self.key(spot), spot.spot_id, spot))
+
+    def remove(self, spot):
+        # lazy delete, the heap entry is dropped when it reaches the top
+        self.free.discard(spot.spot_id)
+
+    def peek(self):
+        while self.heap and self.heap[0][1] not in self.free:
+            _, spot_id, _ = heapq.heappop(self.heap)
+            self.in_heap.discard(spot_id)
+        return self.heap[0][2] if self.heap else None
 
 
 class ParkingFloor:
-    def __init__(self, floor_number):
+    def __init__(self, floor_number, spot_key=None):
         self.floor_number = floor_number
         self.spots = []
+        self.spots_by_id = {}
+        self.spot_key = spot_key
+        self.free_spots = {vehicle_type: self._new_pool() for vehicle_type in VehicleType}
+        self.locks = {vehicle_type: threading.Lock() for vehicle_type in VehicleType}
+
+    def _new_pool(self):
+        return OrderedFreeSpotPool(self.spot_key) if self.spot_key else FreeSpotPool()
+
+    def set_spot_key(self, spot_key):
+        # rebuild the free spot index when a policy wants spots in a different order
+        if spot_key is self.spot_key:
+            return
+        self.spot_key = spot_key
+        self.free_spots = {vehicle_type: self._new_pool() for vehicle_type in VehicleType}
+        for spot in self.spots:
+            if spot.is_free:
+                self.free_spots[spot.spot_type].add(spot)
 
     def add_spot(self, spot):
+        spot.floor = self
         self.spots.append(spot)
+        self.spots_by_id[spot.spot_id] = spot
+        if spot.is_free:
+            self.free_spots[spot.spot_type].add(spot)
+
+    def on_spot_taken(self, spot):
+        self.free_spots[spot.spot_type].remove(spot)
+
+    def on_spot_freed(self, spot):
+        self.free_spots[spot.spot_type].add(spot)
+
+    def free_count(self, vehicle_type: VehicleType):
+        return len(self.free_spots[vehicle_type])
 
     def get_available_spot(self, vehicle: Vehicle):
+        return self.free_spots[vehicle.vehicle_type].peek()
+
+    def get_spot(self, spot_id):
+        return self.spots_by_id.get(spot_id)
+
+    def take_spot(self, vehicle: Vehicle):
+        # pick and assign under the (floor, type) lock so two gates never get the same spot
+        with self.locks[vehicle.vehicle_type]:
+            spot = self.free_spots[vehicle.vehicle_type].peek()
+            if spot:
+                spot.assign_vehicle(vehicle)
+            return spot
+
+    def release_spot(self, spot, vehicle=None):
+        # False when the spot no longer holds vehicle, e.g. a ticket released twice
+        with self.locks[spot.spot_type]:
+            if spot.is_free or (vehicle is not None and spot.vehicle is not vehicle):
+                return False
+            spot.remove_vehicle()
+            return True
+
+    def scan_available_spot(self, vehicle: Vehicle):
+        # linear scan without the index, kept to benchmark against
         for spot in self.spots:
             if spot.is_free and spot.spot_type == vehicle.vehicle_type:
                 return spot
         return None
 
 
-class ParkingLot:
+# per-spot view over a CompactParkingFloor, created only when a spot is asked for
+class CompactSpotView:
+    __slots__ = ("floor", "spot_id")
+
+    def __init__(self, floor, spot_id):
+        self.floor = floor
+        self.spot_id = spot_id
+
+    @property
+    def spot_type(self):
+        return VehicleType(self.floor.spot_types[self.spot_id])
+
+    @property
+    def is_free(self):
+        return not self.floor.is_occupied(self.spot_id)
+
+    @property
+    def vehicle(self):
+        return self.floor.vehicles.get(self.spot_id)
+
+    @property
+    def distance_to_elevator(self):
+        return 0
+
+    def assign_vehicle(self, vehicle):
+        self.floor.occupy(self.spot_id, vehicle)
+
+    def remove_vehicle(self):
+        self.floor.vacate(self.spot_id)
+
+
+class CompactSpotList:
+    def __init__(self, floor):
+        self.floor = floor
+
+    def __len__(self):
+        return len(self.floor.spot_types)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return CompactSpotView(self.floor, index)
+
+    def __iter__(self):
+        for spot_id in range(len(self)):
+            yield CompactSpotView(self.floor, spot_id)
+
+
+# same api as ParkingFloor, spot ids are positions on the floor
+# spot type, occupancy bitmap and free-spot index live in typed arrays,
+# vehicles are only kept for occupied spots
+class CompactParkingFloor:
+    def __init__(self, floor_number):
+        self.floor_number = floor_number
+        self.spot_types = array("b")
+        self.occupied = bytearray()  # 1 bit per spot
+        self.vehicles = {}  # spot_id: vehicle, occupied spots only
+        self.free_stacks = {vehicle_type: array("l") for vehicle_type in VehicleType}
+        self.free_positions = array("l")  # spot_id: index in its free stack, -1 if taken
+        self.spots = CompactSpotList(self)
+        self.locks = {vehicle_type: threading.Lock() for vehicle_type in VehicleType}
+
+    def set_spot_key(self, spot_key):
+        if spot_key is not None:
+            raise Exception("Compact floors only support unordered spot policies")
+
+    def add_spot(self, spot):
+        # the spot object is only read for its id and type and is not kept, use the returned view from here on
+        if spot.spot_id != len(self.spot_types):
+            raise Exception(f"Compact floor {self.floor_number} numbers spots by position, "
+                            f"expected spot id {len(self.spot_types)}, got {spot.spot_id}")
+        self.add_spots(spot.spot_type, 1)
+        return CompactSpotView(self, spot.spot_id)
+
+    def add_spots(self, spot_type: VehicleType, count):
+        start = len(self.spot_types)
+        self.spot_types.extend([spot_type.value] * count)
+        self.occupied.extend(bytes((start + count + 7) // 8 - len(self.occupied)))
+        stack = self.free_stacks[spot_type]
+        self.free_positions.extend(range(len(stack), len(stack) + count))
+        stack.extend(range(start, start + count))
+        return range(start, start + count)
+
+    def get_spot(self, spot_id):
+        return CompactSpotView(self, spot_id) if 0 <= spot_id < len(self.spot_types) else None
+
+    def is_occupied(self, spot_id):
+        return self.occupied[spot_id >> 3] & (1 << (spot_id & 7)) != 0
+
+    def occupy(self, spot_id, vehicle):
+        self.occupied[spot_id >> 3] |= 1 << (spot_id & 7)
+        self.vehicles[spot_id] = vehicle
+        position = self.free_positions[spot_id]
+        if position < 0:
+            return
+        stack = self.free_stacks[VehicleType(self.spot_types[spot_id])]
+        last = stack.pop()
+        if last != spot_id:
+            stack[position] = last
+            self.free_positions[last] = position
+        self.free_positions[spot_id] = -1
+
+    def vacate(self, spot_id):
+        self.occupied[spot_id >> 3] &= ~(1 << (spot_id & 7)) & 0xFF
+        self.vehicles.pop(spot_id, None)
+        if self.free_positions[spot_id] >= 0:
+            return
+        stack = self.free_stacks[VehicleType(self.spot_types[spot_id])]
+        self.free_positions[spot_id] = len(stack)
+        stack.append(spot_id)
+
+    def free_count(self, vehicle_type: VehicleType):
+        return len(self.free_stacks[vehicle_type])
+
+    def get_available_spot(self, vehicle: Vehicle):
+        stack = self.free_stacks[vehicle.vehicle_type]
+        return CompactSpotView(self, stack[-1]) if stack else None
+
+    def take_spot(self, vehicle: Vehicle):
+        with self.locks[vehicle.vehicle_type]:
+            stack = self.free_stacks[vehicle.vehicle_type]
+            if not stack:
+                return None
+            spot_id = stack[-1]
+            self.occupy(spot_id, vehicle)
+            return CompactSpotView(self, spot_id)
+
+    def release_spot(self, spot, vehicle=None):
+        with self.locks[spot.spot_type]:
+            if not self.is_occupied(spot.spot_id) or (vehicle is not None and self.vehicles.get(spot.spot_id) is not vehicle):
+                return False
+            self.vacate(spot.spot_id)
+            return True
+
+    def scan_available_spot(self, vehicle: Vehicle):
+        for spot_id, spot_type in enumerate(self.spot_types):
+            if spot_type == vehicle.vehicle_type.value and not self.is_occupied(spot_id):
+                return CompactSpotView(self, spot_id)
+        return None
+
+
+# strategy for picking a spot: which floors are tried first and how spots on a floor are ordered
+class SpotSelectionPolicy(ABC):
+    spot_key = None
+
+    @abstractmethod
+    def order_floors(self, floors):
+        pass
+
+
+class LowestFloorFirstPolicy(SpotSelectionPolicy):
+    def order_floors(self, floors):
+        return sorted(floors, key=lambda floor: floor.floor_number)
+
+
+class ClosestToElevatorPolicy(LowestFloorFirstPolicy):
+    @staticmethod
+    def spot_key(spot):
+        return spot.distance_to_elevator
+
+
+# live free-spot counters per (floor, vehicle type), updated by ParkingLot on every assign / release
+class OccupancyBoard:
     def __init__(self):
+        self.counts = {}  # (floor_number, vehicle_type): free spots
+        self.locks = {}  # (floor_number, vehicle_type): lock, keeps notifications for one counter in order
+        self.subscribers = []  # (floor_number or None, vehicle_type or None, callback)
+
+    def add_floor(self, floor):
+        for vehicle_type in VehicleType:
+            key = (floor.floor_number, vehicle_type)
+            self.locks[key] = threading.Lock()
+            self.counts[key] = floor.free_count(vehicle_type)
+
+    def update(self, floor_number, vehicle_type: VehicleType, delta):
+        if not delta:
+            return
+        key = (floor_number, vehicle_type)
+        with self.locks[key]:
+            self.counts[key] += delta
+            count = self.counts[key]
+            for sub_floor, sub_type, callback in self.subscribers:
+                if sub_floor in (None, floor_number) and sub_type in (None, vehicle_type):
+                    callback(floor_number, vehicle_type, count)
+
+    def subscribe(self, callback, floor_number=None, vehicle_type: VehicleType = None):
+        # callback(floor_number, vehicle_type, free_count), runs on the gate thread so keep it quick
+        self.subscribers.append((floor_number, vehicle_type, callback))
+
+    def unsubscribe(self, callback):
+        self.subscribers = [sub for sub in self.subscribers if sub[2] is not callback]
+
+    def free_count(self, vehicle_type: VehicleType, floor_number=None):
+        if floor_number is not None:
+            return self.counts[(floor_number, vehicle_type)]
+        return sum(count for (_, key_type), count in self.counts.items() if key_type == vehicle_type)
+
+    def snapshot(self):
+        result = {}
+        for (floor_number, vehicle_type), count in list(self.counts.items()):
+            result.setdefault(floor_number, {})[vehicle_type] = count
+        return result
+
+
+# append-only journal of assign / release events with periodic snapshots
+# - events are json lines in journal-<first seq>.log segments
+# - a writer thread group-commits everything queued with one write + fsync, gates only wait for their batch
+# - every snapshot_every events the active tickets are written to snapshot.json and older segments are deleted,
+#   so recovery reads one snapshot plus a short tail however long the lot has been running
+class TicketJournal:
+    SNAPSHOT_FILE = "snapshot.json"
+
+    def __init__(self, directory, snapshot_every=10000, durable=True):
+        self.directory = directory
+        self.snapshot_every = snapshot_every
+        self.durable = durable
+        os.makedirs(directory, exist_ok=True)
+        self.condition = threading.Condition()
+        self.pending = []  # (segment, line) or (None, snapshot) in commit order
+        self.closed = False
+        self.snapshot_seq, self.active = self._load()
+        self.seq = self.last_loaded_seq
+        self.committed_seq = self.seq
+        self.events_since_snapshot = self.seq - self.snapshot_seq
+        self.segment = self._segment_path(self.seq + 1)
+        self.writer = threading.Thread(target=self._write_loop, daemon=True)
+        self.writer.start()
+
+    def _segment_path(self, first_seq):
+        return os.path.join(self.directory, f"journal-{first_seq:012d}.log")
+
+    def _segments(self):
+        names = sorted(name for name in os.listdir(self.directory)
+                       if name.startswith("journal-") and name.endswith(".log"))
+        return [os.path.join(self.directory, name) for name in names]
+
+    def _load(self):
+        # snapshot + every event after it, a torn last line from a crash is ignored
+        snapshot_seq, active = 0, {}
+        snapshot_path = os.path.join(self.directory, self.SNAPSHOT_FILE)
+        if os.path.exists(snapshot_path):
+            with open(snapshot_path) as f:
+                snapshot = json.load(f)
+            snapshot_seq = snapshot["seq"]
+            active = {record["ticket"]: record for record in snapshot["tickets"]}
+        last_seq = snapshot_seq
+        for path in self._segments():
+            with open(path) as f:
+                for line in f:
+                    try:
+                        event = json.loads(line)
+                    except ValueError:
+                        break
+                    if event["seq"] <= snapshot_seq:
+                        continue
+                    self._apply(active, event)
+                    last_seq = max(last_seq, event["seq"])
+        self.last_loaded_seq = last_seq
+        return snapshot_seq, active
+
+    @staticmethod
+    def _apply(active, event):
+        if event["op"] == "assign":
+            active[event["ticket"]] = event
+        else:
+            active.pop(event["ticket"], None)
+
+    def active_tickets(self):
+        with self.condition:
+            return list(self.active.values())
+
+    def record_assign(self, ticket: Ticket):
+        self._append({"op": "assign", "ticket": ticket.ticket_id, "floor": ticket.spot.floor.floor_number,
+                      "spot": ticket.spot.spot_id, "license": ticket.vehicle.license_number,
+                      "type": ticket.vehicle.vehicle_type.value, "entry": ticket.entry_time.isoformat()})
+
+    def record_release(self, ticket: Ticket):
+        self._append({"op": "release", "ticket": ticket.ticket_id})
+
+    def _append(self, event):
+        with self.condition:
+            if self.closed:
+                raise Exception("Journal is closed")
+            self.seq += 1
+            seq = event["seq"] = self.seq
+            self._apply(self.active, event)
+            self.pending.append((self.segment, json.dumps(event)))
+            self.events_since_snapshot += 1
+            if self.events_since_snapshot >= self.snapshot_every:
+                self._queue_snapshot()
+            self.condition.notify_all()
+            if self.durable:
+                while self.committed_seq < seq:
+                    self.condition.wait()
+
+    def _queue_snapshot(self):
+        # called with the lock held, later events go to a new segment
+        snapshot = {"seq": self.seq, "tickets": list(self.active.values())}
+        self.pending.append((None, snapshot))
+        self.segment = self._segment_path(self.seq + 1)
+        self.events_since_snapshot = 0
+
+    def _write_loop(self):
+        while True:
+            with self.condition:
+                while not self.pending and not self.closed:
+                    self.condition.wait()
+                if not self.pending and self.closed:
+                    return
+                batch, self.pending = self.pending, []
+                last_seq = self.seq
+            self._write_batch(batch)
+            with self.condition:
+                self.committed_seq = max(self.committed_seq, last_seq)
+                self.condition.notify_all()
+
+    def _write_batch(self, batch):
+        lines = []
+        segment = None
+        for target, item in batch:
+            if target is None:
+                self._flush(segment, lines)
+                lines, segment = [], None
+                self._write_snapshot(item)
+                continue
+            if target != segment:
+                self._flush(segment, lines)
+                lines, segment = [], target
+            lines.append(item)
+        self._flush(segment, lines)
+
+    def _flush(self, segment, lines):
+        if not lines:
+            return
+        with open(segment, "a") as f:
+            f.write("\n".join(lines) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _write_snapshot(self, snapshot):
+        path = os.path.join(self.directory, self.SNAPSHOT_FILE)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(snapshot, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        # segments that start at or before the snapshot are fully covered by it
+        for segment in self._segments():
+            first_seq = int(os.path.basename(segment)[len("journal-"):-len(".log")])
+            if first_seq <= snapshot["seq"]:
+                os.remove(segment)
+        self.snapshot_seq = snapshot["seq"]
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        self.writer.join()
+
+
+class ParkingLot:
+    def __init__(self, policy: SpotSelectionPolicy = None, journal: TicketJournal = None):
         self.floors = []
+        self.floors_by_number = {}
+        self.policy = policy or LowestFloorFirstPolicy()
+        self.floor_order = []
+        self.occupancy = OccupancyBoard()
+        self.journal = journal
+        self.active_tickets = {}  # ticket_id: ticket
 
+    # spots should be added to the floor before the floor is added to the lot
     def add_floor(self, parking_floor):
+        parking_floor.set_spot_key(self.policy.spot_key)
         self.floors.append(parking_floor)
+        self.floors_by_number[parking_floor.floor_number] = parking_floor
+        self.floor_order = self.policy.order_floors(self.floors)
+        self.occupancy.add_floor(parking_floor)
 
     def assign_spot(self, vehicle: Vehicle):
-        for floor in self.floors:
-            spot = floor.get_available_spot(vehicle)
+        for floor in self.floor_order:
+            if not floor.free_count(vehicle.vehicle_type):
+                continue
+            spot = floor.take_spot(vehicle)
             if spot:
-                spot.assign_vehicle(vehicle)
+                self.occupancy.update(floor.floor_number, vehicle.vehicle_type, -1)
                 ticket_id = str(uuid.uuid4())
                 ticket = Ticket(ticket_id, vehicle, spot)
+                if self.journal:
+                    try:
+                        self.journal.record_assign(ticket)
+                    except Exception:
+                        # no ticket goes out, so the spot and its counter are given back
+                        floor.release_spot(spot, vehicle)
+                        self.occupancy.update(floor.floor_number, vehicle.vehicle_type, 1)
+                        raise
+                self.active_tickets[ticket_id] = ticket
                 return ticket
         raise Exception("Spots not available")
 
-    @staticmethod
-    def release_spot(ticket):
+    def release_spot(self, ticket):
+        # a ticket whose vehicle has already left its spot must not free it again or bump the counters
+        if ticket.spot.vehicle is not ticket.vehicle:
+            raise Exception(f"Ticket {ticket.ticket_id} is already released")
         ticket.set_exit_time()
         fee = FareCalculator.calculate_fare(ticket)
-        ticket.spot.remove_vehicle()
+        # journal the release before the spot is freed so a later assign of the same spot is always after it
+        if self.journal:
+            self.journal.record_release(ticket)
+        self.active_tickets.pop(ticket.ticket_id, None)
+        floor = ticket.spot.floor
+        if floor:
+            released = floor.release_spot(ticket.spot, ticket.vehicle)
+            if released and self.floors_by_number.get(floor.floor_number) is floor:
+                self.occupancy.update(floor.floor_number, ticket.spot.spot_type, 1)
+        else:
+            ticket.spot.remove_vehicle()
         return fee
 
+    def get_availability(self):
+        return self.occupancy.snapshot()
+
+    def recover(self):
+        # floors and spots are rebuilt from config, parked vehicles come back from the journal
+        if self.journal is None:
+            raise Exception("Cannot recover a parking lot without a TicketJournal")
+        for record in self.journal.active_tickets():
+            floor = self.floors_by_number[record["floor"]]
+            spot = floor.get_spot(record["spot"])
+            vehicle = Vehicle(record["license"], VehicleType(record["type"]))
+            with floor.locks[spot.spot_type]:
+                spot.assign_vehicle(vehicle)
+            self.occupancy.update(floor.floor_number, vehicle.vehicle_type, -1)
+            ticket = Ticket(record["ticket"], vehicle, spot)
+            ticket.entry_time = datetime.fromisoformat(record["entry"])
+            self.active_tickets[ticket.ticket_id] = ticket
+        return len(self.active_tickets)
+
+
+# rate tables work on columns so a batch settlement prices a whole vehicle type in one pass
+class RateTable(ABC):
+    @abstractmethod
+    def fares(self, vehicle_type: VehicleType, entry_times, hours):
+        pass
+
+    def fare(self, vehicle_type: VehicleType, entry_time, hours):
+        return self.fares(vehicle_type, [entry_time], [hours])[0]
+
+
+class FlatRateTable(RateTable):
+    def __init__(self, rate_per_hour):
+        self.rate_per_hour = rate_per_hour
+
+    def fares(self, vehicle_type, entry_times, hours):
+        rate = self.rate_per_hour[vehicle_type]
+        return [max(1, int(duration)) * rate for duration in hours]
+
+
+# tiers: {vehicle_type: [(up_to_hours, rate), ..., (None, rate)]}, each billed hour is charged at its tier rate
+class TieredRateTable(RateTable):
+    def __init__(self, tiers):
+        self.tiers = tiers
+        self.cumulative = {}  # vehicle_type: (tier bounds, fare of all hours up to each bound)
+        for vehicle_type, type_tiers in tiers.items():
+            bounds, totals, total, previous = [], [], 0, 0
+            for up_to, rate in type_tiers[:-1]:
+                total += (up_to - previous) * rate
+                bounds.append(up_to)
+                totals.append(total)
+                previous = up_to
+            self.cumulative[vehicle_type] = (bounds, totals)
+
+    def fares(self, vehicle_type, entry_times, hours):
+        bounds, totals = self.cumulative[vehicle_type]
+        rates = [rate for _, rate in self.tiers[vehicle_type]]
+        result = []
+        for duration in hours:
+            billed = max(1, int(duration))
+            tier = bisect.bisect_left(bounds, billed)
+            base_hours = bounds[tier - 1] if tier else 0
+            base_fare = totals[tier - 1] if tier else 0
+            result.append(base_fare + (billed - base_hours) * rates[tier])
+        return result
+
+
+# rates: {vehicle_type: [(start_hour, rate), ...]}, each billed hour is charged at the rate of the hour of day it starts in
+class TimeOfDayRateTable(RateTable):
+    def __init__(self, rates):
+        self.hourly = {}  # vehicle_type: rate for every hour of the day
+        for vehicle_type, windows in rates.items():
+            windows = sorted(windows)
+            starts = [start for start, _ in windows]
+            # hours before the first window belong to the last one, which runs overnight
+            self.hourly[vehicle_type] = [windows[bisect.bisect_right(starts, hour) - 1][1] for hour in range(24)]
+        # day_totals[h][n]: fare of n hours starting at hour h, n < 24
+        self.day_totals = {}
+        for vehicle_type, hourly in self.hourly.items():
+            totals = []
+            for start_hour in range(24):
+                running = [0]
+                for n in range(24):
+                    running.append(running[-1] + hourly[(start_hour + n) % 24])
+                totals.append(running)
+            self.day_totals[vehicle_type] = totals
+
+    def fares(self, vehicle_type, entry_times, hours):
+        totals = self.day_totals[vehicle_type]
+        full_day = totals[0][24]
+        result = []
+        for entry_time, duration in zip(entry_times, hours):
+            days, rest = divmod(max(1, int(duration)), 24)
+            result.append(days * full_day + totals[entry_time.hour][rest])
+        return result
+
+
+@dataclass
+class FareSettlement:
+    fares: list
+    revenue_by_type: dict = field(default_factory=dict)
+    count_by_type: dict = field(default_factory=dict)
+
+    @property
+    def total_revenue(self):
+        return sum(self.revenue_by_type.values())
+
 
 class FareCalculator:
     rate_per_hour = {
@@ -97,25 +733,285 @@ class FareCalculator:
         VehicleType.Truck: 70
     }
     @staticmethod
-    def calculate_fare(ticket: Ticket):
+    def calculate_fare(ticket: Ticket, rate_table: RateTable = None):
         entry_time = ticket.entry_time
         exit_time = ticket.exit_time
         total_duration = (exit_time - entry_time).total_seconds()/3600
+        if rate_table:
+            return rate_table.fare(ticket.vehicle.vehicle_type, entry_time, total_duration)
         hourly_rate = FareCalculator.rate_per_hour[ticket.vehicle.vehicle_type]
         return max(1, int(total_duration))*hourly_rate
 
+    @staticmethod
+    def settle_batch(entry_times, exit_times, vehicle_types, rate_table: RateTable = None):
+        # same arithmetic as calculate_fare, one column per vehicle type instead of one call per ticket
+        rate_table = rate_table or FlatRateTable(FareCalculator.rate_per_hour)
+        rows_by_type = {}
+        for row, vehicle_type in enumerate(vehicle_types):
+            rows_by_type.setdefault(vehicle_type, []).append(row)
+
+        settlement = FareSettlement([0] * len(vehicle_types))
+        for vehicle_type, rows in rows_by_type.items():
+            entries = [entry_times[row] for row in rows]
+            hours = [(exit_times[row] - entry_time).total_seconds()/3600 for row, entry_time in zip(rows, entries)]
+            type_fares = rate_table.fares(vehicle_type, entries, hours)
+            for row, fare in zip(rows, type_fares):
+                settlement.fares[row] = fare
+            settlement.revenue_by_type[vehicle_type] = sum(type_fares)
+            settlement.count_by_type[vehicle_type] = len(rows)
+        return settlement
+
+    @staticmethod
+    def settle_tickets(tickets, rate_table: RateTable = None):
+        return FareCalculator.settle_batch([ticket.entry_time for ticket in tickets],
+                                           [ticket.exit_time for ticket in tickets],
+                                           [ticket.vehicle.vehicle_type for ticket in tickets],
+                                           rate_table)
+
+
+def _build_lot(num_floors, spots_per_floor):
+    lot = ParkingLot()
+    vehicle_types = list(VehicleType)
+    for floor_number in range(num_floors):
+        floor = ParkingFloor(floor_number)
+        for spot_id in range(spots_per_floor):
+            floor.add_spot(ParkingSpot(spot_id, vehicle_types[spot_id % len(vehicle_types)]))
+        lot.add_floor(floor)
+    return lot
+
+
+def _run_gates(lot, num_gates, ops_per_gate, on_assign=None, on_release=None):
+    errors = []
+
+    def gate(gate_id):
+        rng = random.Random(gate_id)
+        tickets = []
+        try:
+            for i in range(ops_per_gate):
+                if tickets and (rng.random() < 0.5 or len(tickets) > 20):
+                    ticket = tickets.pop(rng.randrange(len(tickets)))
+                    if on_release:
+                        on_release(ticket)
+                    lot.release_spot(ticket)
+                    continue
+                vehicle = Vehicle(f"G{gate_id}-{i}", rng.choice(list(VehicleType)))
+                try:
+                    ticket = lot.assign_spot(vehicle)
+                except Exception:
+                    continue
+                if on_assign:
+                    on_assign(ticket)
+                tickets.append(ticket)
+            for ticket in tickets:
+                if on_release:
+                    on_release(ticket)
+                lot.release_spot(ticket)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=gate, args=(gate_id,)) for gate_id in range(num_gates)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return errors
+
+
+def benchmark_assign_spot(num_floors=10, spots_per_floor=10000, rounds=1000):
+    # nearly full garage, only the last spot of the top floor is free
+    lot = ParkingLot()
+    for floor_number in range(num_floors):
+        floor = ParkingFloor(floor_number)
+        for spot_id in range(spots_per_floor):
+            floor.add_spot(ParkingSpot(spot_id, VehicleType.Car))
+        lot.add_floor(floor)
+    parked = Vehicle("BENCH", VehicleType.Car)
+    for floor in lot.floors:
+        for spot in floor.spots:
+            spot.assign_vehicle(parked)
+    lot.floors[-1].spots[-1].remove_vehicle()
+
+    vehicle = Vehicle("KA-01-0001", VehicleType.Car)
+    start = time.perf_counter()
+    for _ in range(rounds):
+        ticket = lot.assign_spot(vehicle)
+        ticket.spot.remove_vehicle()
+    indexed = (time.perf_counter() - start) / rounds
+
+    scan_rounds = max(1, rounds // 100)
+    start = time.perf_counter()
+    for _ in range(scan_rounds):
+        for floor in lot.floor_order:
+            spot = floor.scan_available_spot(vehicle)
+            if spot:
+                spot.assign_vehicle(vehicle)
+                spot.remove_vehicle()
+                break
+    scan = (time.perf_counter() - start) / scan_rounds
+
+    total = num_floors * spots_per_floor
+    print(f"{total} spots: scan {scan * 1e6:.1f}us, index {indexed * 1e6:.1f}us per assign + release")
+
+
+def stress_test_gates(num_gates=16, ops_per_gate=5000, num_floors=3, spots_per_floor=60):
+    # small lot so gates keep fighting over the same spots, fails on any double booking
+    lot = _build_lot(num_floors, spots_per_floor)
+    occupied = {}  # (floor_number, spot_id): ticket
+    occupied_lock = threading.Lock()
+
+    def on_assign(ticket):
+        key = (ticket.spot.floor.floor_number, ticket.spot.spot_id)
+        with occupied_lock:
+            if key in occupied:
+                raise Exception(f"Spot {key} booked twice")
+            occupied[key] = ticket
+
+    def on_release(ticket):
+        with occupied_lock:
+            del occupied[(ticket.spot.floor.floor_number, ticket.spot.spot_id)]
+
+    errors = _run_gates(lot, num_gates, ops_per_gate, on_assign, on_release)
+    if errors:
+        raise errors[0]
+    for floor in lot.floors:
+        for vehicle_type in VehicleType:
+            free = sum(1 for spot in floor.spots if spot.is_free and spot.spot_type == vehicle_type)
+            if free != floor.free_count(vehicle_type):
+                raise Exception(f"Free index out of sync on floor {floor.floor_number}")
+            if free != lot.occupancy.free_count(vehicle_type, floor.floor_number):
+                raise Exception(f"Occupancy counter out of sync on floor {floor.floor_number}")
+    print(f"stress test passed: {num_gates} gates x {ops_per_gate} ops, no double booking")
+
+
+def benchmark_gate_throughput(gate_counts=(1, 2, 4, 8, 16), ops_per_gate=20000, num_floors=10, spots_per_floor=1000):
+    for num_gates in gate_counts:
+        lot = _build_lot(num_floors, spots_per_floor)
+        start = time.perf_counter()
+        _run_gates(lot, num_gates, ops_per_gate)
+        elapsed = time.perf_counter() - start
+        print(f"{num_gates} gates: {num_gates * ops_per_gate / elapsed:.0f} ops/s")
+
+
+def benchmark_compact_floor(num_floors=10, spots_per_floor=100000, rounds=100000):
+    vehicle_types = list(VehicleType)
+    for name, floor_class in (("objects", ParkingFloor), ("compact", CompactParkingFloor)):
+        tracemalloc.start()
+        lot = ParkingLot()
+        for floor_number in range(num_floors):
+            floor = floor_class(floor_number)
+            if floor_class is CompactParkingFloor:
+                for vehicle_type in vehicle_types:
+                    floor.add_spots(vehicle_type, spots_per_floor // len(vehicle_types))
+            else:
+                for spot_id in range(spots_per_floor // len(vehicle_types) * len(vehicle_types)):
+                    floor.add_spot(ParkingSpot(spot_id, vehicle_types[spot_id % len(vehicle_types)]))
+            lot.add_floor(floor)
+        memory, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        vehicles = [Vehicle(f"KA-{i}", vehicle_types[i % len(vehicle_types)]) for i in range(1000)]
+        start = time.perf_counter()
+        for i in range(rounds):
+            ticket = lot.assign_spot(vehicles[i % len(vehicles)])
+            ticket.spot.floor.release_spot(ticket.spot)
+        elapsed = time.perf_counter() - start
+        total = sum(len(floor.spots) for floor in lot.floors)
+        print(f"{name}: {total} spots, {memory / total:.1f} bytes/spot, "
+              f"{elapsed / rounds * 1e6:.2f}us per assign + release")
+
+
+def benchmark_settlement(num_exits=500000):
+    rng = random.Random(7)
+    vehicle_types = list(VehicleType)
+    day = datetime(2024, 1, 1)
+    tickets = []
+    for i in range(num_exits):
+        ticket = Ticket(i, Vehicle(f"KA-{i}", rng.choice(vehicle_types)), None)
+        ticket.entry_time = day + timedelta(seconds=rng.randrange(86400))
+        ticket.exit_time = ticket.entry_time + timedelta(seconds=rng.randrange(60, 30 * 3600))
+        tickets.append(ticket)
+    rate_tables = {
+        "flat": None,
+        "tiered": TieredRateTable({vehicle_type: [(2, rate), (6, rate // 2), (None, rate // 4)]
+                                   for vehicle_type, rate in FareCalculator.rate_per_hour.items()}),
+        "time of day": TimeOfDayRateTable({vehicle_type: [(8, rate), (20, rate // 2)]
+                                           for vehicle_type, rate in FareCalculator.rate_per_hour.items()}),
+    }
+    entry_times = [ticket.entry_time for ticket in tickets]
+    exit_times = [ticket.exit_time for ticket in tickets]
+    types = [ticket.vehicle.vehicle_type for ticket in tickets]
+    for name, rate_table in rate_tables.items():
+        start = time.perf_counter()
+        single = [FareCalculator.calculate_fare(ticket, rate_table) for ticket in tickets]
+        single_elapsed = time.perf_counter() - start
+        start = time.perf_counter()
+        settlement = FareCalculator.settle_batch(entry_times, exit_times, types, rate_table)
+        batch_elapsed = time.perf_counter() - start
+        if settlement.fares != single:
+            raise Exception(f"Batch settlement does not match single ticket fares for {name} rates")
+        print(f"{name}: {num_exits} exits, single {single_elapsed:.2f}s, batch {batch_elapsed:.2f}s, "
+              f"revenue {settlement.total_revenue}")
+
+
+def benchmark_journal(gate_counts=(1, 8, 32), ops_per_gate=2000, history_sizes=(10000, 100000)):
+    # with one gate every event pays a full fsync, more gates share each group commit
+    for num_gates in gate_counts:
+        for durable in (False, True):
+            with tempfile.TemporaryDirectory() as directory:
+                lot = _build_lot(10, 1000)
+                lot.journal = TicketJournal(directory) if durable else None
+                start = time.perf_counter()
+                _run_gates(lot, num_gates, ops_per_gate)
+                elapsed = time.perf_counter() - start
+                if lot.journal:
+                    lot.journal.close()
+                name = "journal" if durable else "no journal"
+                print(f"{num_gates} gates, {name}: {num_gates * ops_per_gate / elapsed:.0f} ops/s")
+
+    for history in history_sizes:
+        with tempfile.TemporaryDirectory() as directory:
+            lot = _build_lot(10, 1000)
+            lot.journal = TicketJournal(directory, durable=False)
+            tickets = []
+            for i in range(history):
+                if len(tickets) > 2000 or (tickets and i % 3 == 0):
+                    lot.release_spot(tickets.pop())
+                else:
+                    tickets.append(lot.assign_spot(Vehicle(f"KA-{i}", VehicleType(i % 3 + 1))))
+            lot.journal.close()
+
+            start = time.perf_counter()
+            recovered = _build_lot(10, 1000)
+            recovered.journal = TicketJournal(directory)
+            parked = recovered.recover()
+            elapsed = time.perf_counter() - start
+            recovered.journal.close()
+            if parked != len(tickets):
+                raise Exception(f"Recovered {parked} tickets, expected {len(tickets)}")
+            print(f"{history} events of history: recovered {parked} parked vehicles in {elapsed * 1000:.0f}ms")
+
+
+if __name__ == "__main__":
+    lot = ParkingLot()
+    floor1 = ParkingFloor(1)
+    spot1 = ParkingSpot(1, VehicleType.Bike)
+    spot2 = ParkingSpot(2, VehicleType.Car)
+    floor1.add_spot(spot1)
+    floor1.add_spot(spot2)
+    lot.add_floor(floor1)
+
+    vehicle = Vehicle("KA-05-LY-2101", VehicleType.Bike)
+    try:
+        ticket = lot.assign_spot(vehicle)
+        print(lot.get_availability())
+        lot.release_spot(ticket)
+    except Exception as e:
+        print(repr(e))
 
-lot = ParkingLot()
-floor1 = ParkingFloor(1)
-spot1 = ParkingSpot(1, VehicleType.Bike)
-spot2 = ParkingSpot(2, VehicleType.Car)
-floor1.add_spot(spot1)
-floor1.add_spot(spot2)
-lot.add_floor(floor1)
-
-vehicle = Vehicle("KA-05-LY-2101", VehicleType.Bike)
-try:
-    ticket = lot.assign_spot(vehicle)
-    lot.release_spot(ticket)
-except Exception as e:
-    print(repr(e))
+    if "--bench" in sys.argv:
+        benchmark_assign_spot()
+        stress_test_gates()
+        benchmark_gate_throughput()
+        benchmark_compact_floor()
+        benchmark_settlement()
+        benchmark_journal()